@@ -0,0 +1,277 @@
+from argparse import ArgumentParser, Namespace
+from json import dump as json_dump, load as json_load
+from sys import exit as sys_exit
+from time import perf_counter
+from typing import Callable, Dict, List, NamedTuple, Tuple, Union
+
+import dgl
+import numpy as np
+import torch
+from torch import nn
+
+from model.attention import Attention
+from model.decoder import Decoder
+from model.encoder import Encoder
+from model.encoder.treelstm import TreeLSTM
+from tests.generator import generate_node_with_children, generate_random_tree, generate_tree
+from utils.common import fix_seed, EOS, PAD, SOS, UNK
+from utils.level_schedule import LevelSchedule, build_level_schedule
+from utils.tree_operations import get_root_indexes
+
+# required parameters of registered components, components without them are created with default parameters
+CELL_PARAMS = {
+    'Convolutional': {'kernel': 3},
+    'SelfAttention': {'n_heads': 4}
+}
+ENCODER_PARAMS = {
+    'Transformer': {'n_heads': 4, 'h_ffd': 256, 'dropout': 0.},
+    'DfsLSTM': {'dropout': 0.},
+    'TwoOrderLSTM': {'dropout': 0.}
+}
+DECODER_PARAMS = {
+    'LSTM': {'teacher_force': 1.}
+}
+ATTENTION_PARAMS = {
+    'Luong': [{'score': 'concat'}, {'score': 'general'}]
+}
+
+BENCHMARK_SHAPES = ['ast', 'full', 'star']
+
+Output = Union[torch.Tensor, Tuple[torch.Tensor, ...]]
+
+
+class BenchmarkBatch(NamedTuple):
+    graph: dgl.DGLGraph
+    # level schedule of the graph, as training batches are loaded with it
+    schedule: LevelSchedule
+    # [n nodes; h emb] embeddings of nodes, the input of encoders
+    x: torch.Tensor
+    # [n nodes; h enc] hidden and memory states of nodes, the input of decoders and attentions
+    encoded: Tuple[torch.Tensor, torch.Tensor]
+    # [batch size; h dec] states of decoder, the input of attentions
+    decoder_states: torch.Tensor
+    root_indexes: torch.LongTensor
+    tree_sizes: List[int]
+    # [seq len; batch size]
+    labels: torch.Tensor
+
+
+def generate_trees(
+        shape: str, batch_size: int, n_nodes: int, max_depth: int, max_branch_factor: int, seed: int
+) -> List[dgl.DGLGraph]:
+    """Generate trees of the batch, edges are directed to root as in training batches
+
+    :param shape: ast -- random trees shaped like AST, full -- full trees of max depth and max branch factor,
+        star -- root with n_nodes - 1 children
+    :param batch_size: number of trees
+    :param n_nodes: maximum number of nodes in random trees, number of nodes in star trees
+    :param max_depth: maximum depth of random trees, depth of full trees
+    :param max_branch_factor: maximum branch factor of random trees, branch factor of full trees
+    :param seed: seed of random trees
+    :return: list of trees
+    """
+    if shape == 'ast':
+        random_state = np.random.RandomState(seed)
+        return [generate_random_tree(n_nodes, max_depth, max_branch_factor, random_state) for _ in range(batch_size)]
+    if shape == 'full':
+        return [generate_tree(max_depth, max_branch_factor) for _ in range(batch_size)]
+    if shape == 'star':
+        return [generate_node_with_children(n_nodes - 1) for _ in range(batch_size)]
+    raise ValueError(f"unknown shape of trees: {shape}")
+
+
+def create_batch(trees: List[dgl.DGLGraph], h_emb: int, h_enc: int, h_dec: int, label_to_id: Dict,
+                 label_length: int) -> BenchmarkBatch:
+    graph = dgl.batch(trees)
+    n_nodes = graph.number_of_nodes()
+    tree_sizes = [tree.number_of_nodes() for tree in trees]
+    labels = torch.randint(len(label_to_id), (label_length, len(trees)))
+    labels[0] = label_to_id[SOS]
+    return BenchmarkBatch(
+        graph, build_level_schedule(graph), torch.rand(n_nodes, h_emb), (torch.rand(n_nodes, h_enc), torch.rand(n_nodes, h_enc)),
+        torch.rand(len(trees), h_dec), torch.tensor(get_root_indexes(tree_sizes), dtype=torch.long),
+        tree_sizes, labels
+    )
+
+
+def _run_encoder(encoder: nn.Module, batch: BenchmarkBatch) -> Output:
+    # encoders store intermediate states in graph, so the input is set before each run
+    batch.graph.ndata['x'] = batch.x
+    return encoder(batch.graph, batch.schedule)
+
+
+def _run_decoder(decoder: nn.Module, batch: BenchmarkBatch) -> Output:
+    return decoder(batch.encoded, batch.root_indexes, batch.labels)
+
+
+def _run_attention(attention: nn.Module, batch: BenchmarkBatch) -> Output:
+    return attention(batch.decoder_states, batch.encoded[0], batch.tree_sizes)
+
+
+def get_benchmark_cases(
+        h_emb: int, h_enc: int, h_dec: int, label_to_id: Dict
+) -> Dict[str, Tuple[Callable[[], nn.Module], Callable[[nn.Module, BenchmarkBatch], Output]]]:
+    """Collect all registered encoders, TreeLSTM cells, decoders and attentions
+
+    :return: name of the case -> (function to create module, function to run module on batch)
+    """
+    cases = {}
+    for cell in TreeLSTM.get_known_cells():
+        cell_info = {'name': cell, 'params': CELL_PARAMS.get(cell, {})}
+        cases[f'encoder/TreeLSTM/{cell}'] = (
+            lambda cell_info=cell_info: Encoder(h_emb, h_enc, TreeLSTM.name, {'cell': cell_info}).encoder,
+            _run_encoder
+        )
+        # wavefront engine computes all layers in one pass over levels, so it's measured with several layers too
+        for engine, n_layers in [('levels', 1), ('wavefront', 1), ('levels', 3), ('wavefront', 3)]:
+            suffix = f'/{engine}' if n_layers == 1 else f'/{engine}/{n_layers}_layers'
+            encoder_params = {'cell': cell_info, 'engine': engine, 'n_layers': n_layers, 'residual': n_layers > 1}
+            cases[f'encoder/TreeLSTM/{cell}{suffix}'] = (
+                lambda encoder_params=encoder_params: Encoder(h_emb, h_enc, TreeLSTM.name, encoder_params).encoder,
+                _run_encoder
+            )
+    for encoder in Encoder.get_known_tree_encoders():
+        if encoder == TreeLSTM.name:
+            continue
+        cases[f'encoder/{encoder}'] = (
+            lambda encoder=encoder: Encoder(h_emb, h_enc, encoder, ENCODER_PARAMS.get(encoder, {})).encoder,
+            _run_encoder
+        )
+    for decoder in Decoder.get_known_decoders():
+        cases[f'decoder/{decoder}'] = (
+            lambda decoder=decoder: Decoder(h_enc, h_dec, label_to_id, decoder, DECODER_PARAMS.get(decoder, {})),
+            _run_decoder
+        )
+    for attention in Attention.get_known_attentions():
+        for params in ATTENTION_PARAMS.get(attention, [{}]):
+            suffix = ''.join(f'/{value}' for value in params.values())
+            cases[f'attention/{attention}{suffix}'] = (
+                lambda attention=attention, params=params: Attention(h_enc, h_dec, attention, params),
+                _run_attention
+            )
+            # LSTM decoder with attention to subtrees
+            decoder_params = {**DECODER_PARAMS.get('LSTM', {}), 'attention': {'name': attention, 'params': params}}
+            cases[f'decoder/LSTM+{attention}{suffix}'] = (
+                lambda decoder_params=decoder_params: Decoder(h_enc, h_dec, label_to_id, 'LSTM', decoder_params),
+                _run_decoder
+            )
+    return cases
+
+
+def measure(
+        module: nn.Module, run: Callable[[nn.Module, BenchmarkBatch], Output], batch: BenchmarkBatch,
+        n_warmup: int, n_repeats: int
+) -> Dict[str, float]:
+    """Measure time of forward and backward passes, backward pass is made for sum of outputs
+
+    :return: median and minimum time of passes in milliseconds
+    """
+    module.train()
+    forward_times, backward_times = [], []
+    for repeat in range(n_warmup + n_repeats):
+        module.zero_grad()
+        start = perf_counter()
+        output = run(module, batch)
+        forward_end = perf_counter()
+        outputs = output if isinstance(output, tuple) else (output,)
+        sum(tensor.sum() for tensor in outputs).backward()
+        backward_end = perf_counter()
+        if repeat >= n_warmup:
+            forward_times.append((forward_end - start) * 1000)
+            backward_times.append((backward_end - forward_end) * 1000)
+    return {
+        'forward_ms': float(np.median(forward_times)), 'forward_min_ms': float(np.min(forward_times)),
+        'backward_ms': float(np.median(backward_times)), 'backward_min_ms': float(np.min(backward_times))
+    }
+
+
+def run_benchmarks(args: Namespace) -> Dict:
+    fix_seed(args.seed)
+    torch.set_num_threads(args.n_threads)
+    label_to_id = {PAD: 0, UNK: 1, SOS: 2, EOS: 3}
+    label_to_id.update({f'label_{i}': i + 4 for i in range(args.n_labels)})
+
+    trees = generate_trees(args.shape, args.batch_size, args.n_nodes, args.max_depth, args.max_branch, args.seed)
+    batch = create_batch(trees, args.hidden, args.hidden, args.hidden, label_to_id, args.label_length)
+    print(f"batch of {len(trees)} trees, {batch.graph.number_of_nodes()} nodes")
+
+    results = {}
+    for name, (create_module, run) in get_benchmark_cases(args.hidden, args.hidden, args.hidden, label_to_id).items():
+        if args.filter is not None and args.filter not in name:
+            continue
+        # failed case is recorded in the report, so the rest of the suite is still measured
+        try:
+            results[name] = measure(create_module(), run, batch, args.n_warmup, args.n_repeats)
+        except Exception as e:
+            results[name] = {'error': f'{type(e).__name__}: {e}'}
+            print(f"{name} failed: {results[name]['error']}")
+            continue
+        print(f"{name}: forward {results[name]['forward_ms']:.2f} ms, backward {results[name]['backward_ms']:.2f} ms")
+
+    config = {key: value for key, value in vars(args).items() if key not in ['output', 'baseline', 'tolerance']}
+    config.update({
+        'n_nodes_in_batch': batch.graph.number_of_nodes(), 'torch_version': torch.__version__,
+        'dgl_version': dgl.__version__
+    })
+    return {'config': config, 'results': results}
+
+
+def compare_reports(report: Dict, baseline: Dict, tolerance: float) -> List[str]:
+    """Compare median times with baseline report
+
+    :param report: current report
+    :param baseline: saved report
+    :param tolerance: allowed relative slowdown
+    :return: list of regressions, cases that are slower than baseline more than tolerance
+        or failed while they were measured in baseline
+    """
+    for key, value in report['config'].items():
+        if key != 'filter' and baseline['config'].get(key) != value:
+            print(f"baseline was measured with different {key}: {baseline['config'].get(key)}")
+    regressions = []
+    for name, result in report['results'].items():
+        if name not in baseline['results'] or 'error' in baseline['results'][name]:
+            continue
+        if 'error' in result:
+            regressions.append(f"{name}: {result['error']}")
+            continue
+        for metric in ['forward_ms', 'backward_ms']:
+            base_time, cur_time = baseline['results'][name][metric], result[metric]
+            ratio = cur_time / base_time if base_time > 0 else float('inf')
+            print(f"{name} {metric}: {base_time:.2f} -> {cur_time:.2f} ({ratio:.2f}x)")
+            if ratio > 1 + tolerance:
+                regressions.append(f"{name} {metric}: {base_time:.2f} -> {cur_time:.2f} ms")
+    return regressions
+
+
+if __name__ == '__main__':
+    arg_parse = ArgumentParser(description='measure forward and backward time of registered components on CPU')
+    arg_parse.add_argument('--output', type=str, default='benchmark.json', help='path to save report')
+    arg_parse.add_argument('--baseline', type=str, default=None, help='path to report to compare with')
+    arg_parse.add_argument('--tolerance', type=float, default=0.1, help='allowed relative slowdown')
+    arg_parse.add_argument('--filter', type=str, default=None, help='run only cases that contain the substring')
+    arg_parse.add_argument('--shape', choices=BENCHMARK_SHAPES, default='ast')
+    arg_parse.add_argument('--batch_size', type=int, default=64)
+    arg_parse.add_argument('--n_nodes', type=int, default=200)
+    arg_parse.add_argument('--max_depth', type=int, default=12)
+    arg_parse.add_argument('--max_branch', type=int, default=4)
+    arg_parse.add_argument('--hidden', type=int, default=128)
+    arg_parse.add_argument('--n_labels', type=int, default=1000)
+    arg_parse.add_argument('--label_length', type=int, default=7)
+    arg_parse.add_argument('--n_warmup', type=int, default=2)
+    arg_parse.add_argument('--n_repeats', type=int, default=10)
+    arg_parse.add_argument('--n_threads', type=int, default=1)
+    arg_parse.add_argument('--seed', type=int, default=7)
+    args = arg_parse.parse_args()
+
+    benchmark_report = run_benchmarks(args)
+    with open(args.output, 'w') as output_file:
+        json_dump(benchmark_report, output_file, indent=2)
+
+    if args.baseline is not None:
+        with open(args.baseline) as baseline_file:
+            baseline_report = json_load(baseline_file)
+        found_regressions = compare_reports(benchmark_report, baseline_report, args.tolerance)
+        if len(found_regressions) > 0:
+            print('regressions:\n' + '\n'.join(found_regressions))
+            sys_exit(1)
@@ -1 +1,2 @@
 from .tree_dgl_dataset import TreeDGLDataset
+from .prefetch_loader import PrefetchLoader
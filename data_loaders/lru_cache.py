@@ -0,0 +1,45 @@
+from collections import OrderedDict, Counter
+from typing import Any, Callable, Dict, Hashable, Tuple
+
+
+class LRUCache:
+    """Least recently used cache with a budget on the total size of stored values.
+    Values are loaded by a passed function, that also returns their size, values larger than the budget aren't stored.
+    Hits and misses are counted separately for each group of values.
+
+    :param budget: maximum total size of stored values in bytes
+    """
+
+    def __init__(self, budget: int):
+        self.budget = budget
+        self.size = 0
+        self.hits = Counter()
+        self.misses = Counter()
+        self._values = OrderedDict()
+
+    def get(self, key: Hashable, load: Callable[[], Tuple[Any, int]], group: str = 'cache') -> Any:
+        if key in self._values:
+            self._values.move_to_end(key)
+            self.hits[group] += 1
+            return self._values[key][0]
+        self.misses[group] += 1
+        value, size = load()
+        if size > self.budget:
+            return value
+        while self.size + size > self.budget:
+            _, (_, evicted_size) = self._values.popitem(last=False)
+            self.size -= evicted_size
+        self._values[key] = (value, size)
+        self.size += size
+        return value
+
+    def clear(self) -> None:
+        self._values.clear()
+        self.size = 0
+
+    def get_state_dict(self) -> Dict[str, int]:
+        state_dict = {}
+        for group in sorted(set(self.hits) | set(self.misses)):
+            state_dict[f'{group}_hits'] = self.hits[group]
+            state_dict[f'{group}_misses'] = self.misses[group]
+        return state_dict
@@ -0,0 +1,32 @@
+from typing import List
+
+import numpy as np
+
+
+def plan_node_budget_batches(
+        tree_indexes: np.ndarray, n_nodes: np.ndarray, depth: np.ndarray, max_batch_nodes: int
+) -> List[np.ndarray]:
+    """Group trees into batches with total number of nodes not exceeding the budget.
+    Trees are sorted by depth and then by size, so each batch contains trees of similar shape
+    and propagation through the batch doesn't wait for a single deep tree.
+    A tree larger than the budget forms a batch on its own.
+
+    :param tree_indexes: [n trees] indexes of trees to group
+    :param n_nodes: [n trees] number of nodes in each tree
+    :param depth: [n trees] depth of each tree
+    :param max_batch_nodes: budget on the total number of nodes in a batch
+    :return: list of batches, each one is a sorted array of tree indexes
+    """
+    if max_batch_nodes <= 0:
+        raise ValueError(f"budget of nodes in a batch should be positive, but got {max_batch_nodes}")
+    order = np.lexsort((n_nodes, depth))
+    batches = []
+    batch_start, batch_nodes = 0, 0
+    for position, tree_nodes in enumerate(n_nodes[order].tolist()):
+        if batch_nodes + tree_nodes > max_batch_nodes and position > batch_start:
+            batches.append(np.sort(tree_indexes[order[batch_start:position]]))
+            batch_start, batch_nodes = position, 0
+        batch_nodes += tree_nodes
+    if batch_start < order.shape[0]:
+        batches.append(np.sort(tree_indexes[order[batch_start:]]))
+    return batches
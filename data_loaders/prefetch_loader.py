@@ -0,0 +1,111 @@
+import os
+from collections import deque
+from typing import Iterator, Tuple, List, Dict, Optional
+
+import torch
+from dgl import DGLGraph
+from torch.multiprocessing import Pool
+
+from data_loaders.tree_dgl_dataset import TreeDGLDataset
+from utils.level_schedule import LevelSchedule
+
+# dataset is passed to each worker once, instead of pickling it for each batch
+_worker_dataset = None
+
+
+def _init_prefetch_worker(dataset: TreeDGLDataset, n_workers: int) -> None:
+    global _worker_dataset
+    # workers don't share cache, so each of them gets its part of the budget
+    dataset.split_cache(n_workers)
+    _worker_dataset = dataset
+
+
+def _load_batch_task(
+        batch_id: int
+) -> Tuple[Tuple[DGLGraph, torch.Tensor, Optional[LevelSchedule]], int, Dict[str, int]]:
+    return _worker_dataset.load_batch(batch_id), os.getpid(), _worker_dataset.get_cache_state_dict()
+
+
+class PrefetchLoader:
+    """Iterate over batches of dataset in order, while next batches are loaded in background.
+    Worker processes read, filter, and collate batches on CPU, at most prefetch_depth of them
+    are waiting in the queue. The main process only moves the ready batch to the device.
+    Each worker has its own cache of the dataset with n_workers-th part of the cache budget,
+    so the total memory of caches is the configured budget.
+    With zero workers batches are loaded in the main process without prefetching.
+    Loader yields the step and the batch (graph, labels, and level schedule),
+    that is loaded from the order[step] position of dataset.
+    Persistent loader keeps its workers between iterations, e.g. for repeated evaluations,
+    and should be closed after the last one.
+
+    :param dataset: dataset of batches
+    :param start_batch_id: step to start from
+    :param n_workers: number of worker processes
+    :param prefetch_depth: maximum number of batches, that are loaded in advance
+    :param order: order of batches in dataset, by default sequential, it may contain only a part of batches
+    :param persistent: keep worker processes after iteration
+    """
+
+    def __init__(
+            self, dataset: TreeDGLDataset, start_batch_id: int = 0, n_workers: int = 0, prefetch_depth: int = 2,
+            order: List[int] = None, persistent: bool = False
+    ):
+        if prefetch_depth < 1:
+            raise ValueError(f"prefetch depth should be positive, but got {prefetch_depth}")
+        self.dataset = dataset
+        self.start_batch_id = start_batch_id
+        self.n_workers = n_workers
+        self.prefetch_depth = prefetch_depth
+        self.order = order if order is not None else list(range(len(dataset)))
+        self.persistent = persistent
+        self._workers_cache_state = {}
+        self._pool = None
+
+    def get_cache_state_dict(self) -> Dict[str, int]:
+        """Hits and misses of dataset cache summed over workers"""
+        if self.n_workers == 0:
+            return self.dataset.get_cache_state_dict()
+        state_dict = {}
+        for worker_state_dict in self._workers_cache_state.values():
+            for key, value in worker_state_dict.items():
+                state_dict[key] = state_dict.get(key, 0) + value
+        return state_dict
+
+    def _get_ready_batch(self, in_flight: deque) -> Tuple[int, DGLGraph, torch.Tensor, Optional[LevelSchedule]]:
+        ready_id, ready_task = in_flight.popleft()
+        ready_batch, worker_pid, cache_state_dict = ready_task.get()
+        self._workers_cache_state[worker_pid] = cache_state_dict
+        return (ready_id, *self.dataset.to_device(*ready_batch))
+
+    def __len__(self) -> int:
+        return len(self.order) - self.start_batch_id
+
+    def __iter__(self) -> Iterator[Tuple[int, DGLGraph, torch.Tensor, Optional[LevelSchedule]]]:
+        batch_ids = range(self.start_batch_id, len(self.order))
+        if self.n_workers == 0:
+            for batch_id in batch_ids:
+                yield (batch_id, *self.dataset[self.order[batch_id]])
+            return
+
+        if self._pool is None:
+            self._pool = Pool(
+                self.n_workers, initializer=_init_prefetch_worker, initargs=(self.dataset, self.n_workers)
+            )
+        try:
+            in_flight = deque()
+            for batch_id in batch_ids:
+                in_flight.append((batch_id, self._pool.apply_async(_load_batch_task, (self.order[batch_id],))))
+                if len(in_flight) > self.prefetch_depth:
+                    yield self._get_ready_batch(in_flight)
+            while len(in_flight) > 0:
+                yield self._get_ready_batch(in_flight)
+        finally:
+            if not self.persistent:
+                self.close()
+
+    def close(self) -> None:
+        """Stop worker processes"""
+        if self._pool is not None:
+            self._pool.terminate()
+            self._pool.join()
+            self._pool = None
@@ -1,14 +1,27 @@
 import os
 from pickle import load
-from typing import Tuple, List
+from typing import Tuple, List, Dict, Optional
 
+import numpy as np
 import torch
 from dgl import DGLGraph, batch
 from dgl.data.utils import load_graphs
 from torch.utils.data import Dataset
 from tqdm.auto import tqdm
 
-from utils.tree_operations import get_tree_depth
+from utils.columnar_format import (
+    NODE_OFFSETS, EDGE_OFFSETS, SRC, DST, TOKEN, TYPE, LABEL, is_columnar_dataset, load_columnar_dataset
+)
+from data_loaders.lru_cache import LRUCache
+from data_loaders.node_budget_sampler import plan_node_budget_batches
+from utils.level_schedule import LevelSchedule, build_level_schedule
+from utils.tree_operations import (
+    LEAVES_TO_ROOT, get_trees_statistics, get_graphs_statistics, concatenate_statistics, load_trees_statistics,
+    save_trees_statistics, load_trees_orientation
+)
+
+# approximate size in bytes of DGLGraph object without node features and edges
+_GRAPH_OVERHEAD = 1024
 
 
 def _get_batches(path: str, ext: str) -> List[str]:
@@ -18,69 +31,282 @@ def _get_batches(path: str, ext: str) -> List[str]:
     return [os.path.join(path, gf) for gf in files]
 
 
+def _load_labels(label_file: str) -> Tuple[torch.Tensor, int]:
+    with open(label_file, 'rb') as pkl_file:
+        pkl_data = load(pkl_file)
+    labels = torch.tensor(pkl_data['labels'].T)
+    return labels, labels.element_size() * labels.nelement()
+
+
+def _get_segments_index(starts: np.ndarray, sizes: np.ndarray) -> np.ndarray:
+    """Indexes of all elements of segments [starts[i], starts[i] + sizes[i]) one after another"""
+    sizes = sizes.astype(np.int64)
+    segment_positions = np.cumsum(sizes) - sizes
+    return np.repeat(starts.astype(np.int64) - segment_positions, sizes) + np.arange(sizes.sum(), dtype=np.int64)
+
+
+def _create_batched_graph(n_nodes: np.ndarray, n_edges: np.ndarray, src: np.ndarray, dst: np.ndarray) -> DGLGraph:
+    """Create batched graph of trees at once from their concatenated edges
+
+    :param n_nodes: number of nodes in each tree
+    :param n_edges: number of edges in each tree
+    :param src: sources of edges with node ids inside their trees
+    :param dst: destinations of edges with node ids inside their trees
+    :return: batched graph equal to dgl.batch of trees
+    """
+    node_offsets = np.repeat(np.cumsum(n_nodes) - n_nodes, n_edges)
+    graph = DGLGraph()
+    graph.add_nodes(int(n_nodes.sum()))
+    graph.add_edges(torch.from_numpy(src + node_offsets), torch.from_numpy(dst + node_offsets))
+    graph = batch([graph])
+    if hasattr(graph, 'set_batch_num_nodes'):
+        graph.set_batch_num_nodes(torch.from_numpy(n_nodes.astype(np.int64)))
+        graph.set_batch_num_edges(torch.from_numpy(n_edges.astype(np.int64)))
+    else:
+        # BatchedDGLGraph of dgl 0.4 keeps sizes of trees in plain attributes without public setters
+        graph._batch_size = n_nodes.shape[0]
+        graph._batch_num_nodes = n_nodes.tolist()
+        graph._batch_num_edges = n_edges.tolist()
+    return graph
+
+
+def _load_graphs(graph_file: str) -> Tuple[List[DGLGraph], int]:
+    graphs, _ = load_graphs(graph_file)
+    size = sum(
+        graph.number_of_edges() * 2 * 8 + sum(
+            graph.ndata[key].element_size() * graph.ndata[key].nelement() for key in graph.ndata
+        ) + _GRAPH_OVERHEAD
+        for graph in graphs
+    )
+    return graphs, size
+
+
 class TreeDGLDataset(Dataset):
+    """Dataset of batched trees, that are stored either in batch_N.dgl and batch_N.pkl files
+    or in the columnar format (see utils.columnar_format). The latter is memory mapped,
+    so each batch is sliced from flat arrays without deserialization.
+    Batches are loaded on CPU by load_batch and moved to the device by to_device,
+    this allows to load batches in worker processes, see data_loaders.prefetch_loader.
+    Decoded graph files and labels are kept in LRU cache with cache_size budget in MB,
+    use get_batch_order to visit batches in cache friendly shuffled order. The budget is total
+    for all processes loading the dataset, each prefetch worker gets its part (see split_cache).
+    With invert_edges batches are directed from leaves to root, as encoders expect. Datasets written
+    in this orientation (see utils.tree_operations) are loaded as is, otherwise each tree is reversed.
+    Trees are filtered by the statistics index (see utils.tree_operations), that is calculated once
+    and stored next to the dataset, so unsuitable trees are never loaded.
+    If max_batch_nodes is set, batches are formed from trees of similar depth and size with a budget
+    on the total number of nodes instead of batch_size trees. If label_pad_index is passed,
+    labels of each batch are trimmed to the longest one.
+    Batches directed from leaves to root are loaded with the level schedule (see utils.level_schedule),
+    so it's built in the loading process instead of the training one. Each batch is a tuple of graph,
+    labels, and schedule, that is None for batches directed from root to leaves.
+    """
 
     def __init__(
             self, dataset_path: str, batch_size: int, device: torch.device,
-            invert_edges: bool = False, max_n_nodes: int = -1, max_depth: int = -1
+            invert_edges: bool = False, max_n_nodes: int = -1, max_depth: int = -1, cache_size: int = 1024,
+            max_batch_nodes: int = -1, label_pad_index: int = None
     ) -> None:
         if not os.path.exists(dataset_path):
             raise ValueError(f"no dataset found on {dataset_path}")
 
         self.device = device
         self.invert_edges = invert_edges
+        # trees are reversed on loading only if they are stored not in the requested orientation
+        self.orientation = load_trees_orientation(dataset_path)
+        self._reverse_edges = invert_edges != (self.orientation == LEAVES_TO_ROOT)
         self.max_n_nodes = max_n_nodes
         self.max_depth = max_depth
+        self.batch_size = batch_size
+        self.max_batch_nodes = max_batch_nodes
+        self.label_pad_index = label_pad_index
+        self.dataset_path = dataset_path
+        self.is_columnar = is_columnar_dataset(dataset_path)
+        self._columns = None
+        self._cache = LRUCache(cache_size * 1024 ** 2)
+
+        # batches never cross files, each file is described by (graph file, label file, n graphs, offset),
+        # where offset is the position of the first tree of the file in the whole dataset
+        files = []
+        if self.is_columnar:
+            index, _ = load_columnar_dataset(dataset_path)
+            n_graphs = index['n_graphs']
+            files.append((None, None, n_graphs, 0))
+        else:
+            label_files = _get_batches(dataset_path, 'pkl')
+            graph_files = _get_batches(dataset_path, 'dgl')
+
+            # iterate over pkl files to aggregate information about batches
+            print(f"prepare the {dataset_path} dataset...")
+            n_graphs = 0
+            for graph_file, label_file in tqdm(zip(graph_files, label_files), total=len(graph_files)):
+                with open(label_file, 'rb') as pkl_file:
+                    pkl_data = load(pkl_file)
+                    labels = pkl_data['labels']
+                files.append((graph_file, label_file, len(labels), n_graphs))
+                n_graphs += len(labels)
+
+        self.statistics = load_trees_statistics(dataset_path)
+        if self.statistics is None or self.statistics['n_nodes'].shape[0] != n_graphs:
+            self.statistics = self._calculate_statistics()
+            try:
+                save_trees_statistics(dataset_path, self.statistics)
+            except OSError as err:
+                print(f"can't save statistics of trees to {dataset_path}: {err}")
+        self._plan_batches(files)
+
+    def __len__(self) -> int:
+        return len(self.batch_description)
+
+    def __getstate__(self) -> Dict:
+        # memory mapped columns and cached files are reopened by each process
+        state = self.__dict__.copy()
+        state.update(_columns=None, _cache=LRUCache(self._cache.budget))
+        return state
+
+    def split_cache(self, n_parts: int) -> None:
+        """Reduce the cache budget to n_parts-th part, if the dataset is loaded by several processes.
+        Batches are sent to processes in turn, so each of them may decode the same file.
+        """
+        self._cache = LRUCache(self._cache.budget // n_parts)
 
-        label_files = _get_batches(dataset_path, 'pkl')
-        graph_files = _get_batches(dataset_path, 'dgl')
-        self.batch_description = []
+    def get_cache_state_dict(self) -> Dict[str, int]:
+        return self._cache.get_state_dict()
 
-        # iterate over pkl files to aggregate information about batches
-        print(f"prepare the {dataset_path} dataset...")
-        for graph_file, label_file in tqdm(zip(graph_files, label_files), total=len(graph_files)):
-            with open(label_file, 'rb') as pkl_file:
-                pkl_data = load(pkl_file)
-                labels = pkl_data['labels']
-            n_graphs = len(labels)
+    def get_batch_order(self, random_state: np.random.RandomState) -> List[int]:
+        """Shuffle order of batches: files are visited in random order, and batches of each file
+        in random order too, so each file is loaded once per pass
+        """
+        file_batches = {}
+        for batch_id, (graph_file, _, _, _) in enumerate(self.batch_description):
+            file_batches.setdefault(graph_file, []).append(batch_id)
+        file_batches = list(file_batches.values())
+        order = []
+        for file_id in random_state.permutation(len(file_batches)):
+            order += random_state.permutation(file_batches[file_id]).tolist()
+        return order
 
-            batches_per_file = n_graphs // batch_size + (1 if n_graphs % batch_size > 0 else 0)
+    def _calculate_statistics(self) -> Dict[str, np.ndarray]:
+        print(f"calculate statistics of trees in {self.dataset_path}...")
+        if self.is_columnar:
+            _, columns = load_columnar_dataset(self.dataset_path)
+            return concatenate_statistics([get_trees_statistics(
+                np.diff(columns[NODE_OFFSETS]), np.diff(columns[EDGE_OFFSETS]), columns[SRC], columns[DST],
+                self.orientation
+            )])
+        return concatenate_statistics([
+            get_graphs_statistics(load_graphs(graph_file)[0], self.orientation)
+            for graph_file in tqdm(_get_batches(self.dataset_path, 'dgl'))
+        ])
 
-            # collect information from the file
-            for batch_id in range(batches_per_file):
-                start_index = batch_id * batch_size
-                end_index = min(n_graphs, (batch_id + 1) * batch_size)
+    def _plan_batches(self, files: List[Tuple[str, str, int, int]]) -> None:
+        """Select suitable trees by the statistics and group them into batches.
+        By default each batch is a slice of batch_size trees, batches without suitable trees are dropped.
+        With max_batch_nodes trees of each file are grouped by depth and size with a budget on the total
+        number of nodes (see data_loaders.node_budget_sampler).
+        Each batch is described by a span of trees in its file and a mask of selected trees inside the span.
+        """
+        is_suitable = np.ones_like(self.statistics['n_nodes'], dtype=np.bool_)
+        if self.max_n_nodes != -1:
+            is_suitable &= self.statistics['n_nodes'] < self.max_n_nodes
+        if self.max_depth != -1:
+            is_suitable &= self.statistics['depth'] < self.max_depth
+
+        self.batch_description, self.batch_masks = [], []
+        for graph_file, label_file, n_file_graphs, offset in files:
+            if self.max_batch_nodes == -1:
+                batches = [
+                    start_index + np.nonzero(
+                        is_suitable[offset + start_index:offset + min(n_file_graphs, start_index + self.batch_size)]
+                    )[0]
+                    for start_index in range(0, n_file_graphs, self.batch_size)
+                ]
+            else:
+                tree_indexes = np.nonzero(is_suitable[offset:offset + n_file_graphs])[0]
+                batches = plan_node_budget_batches(
+                    tree_indexes, self.statistics['n_nodes'][offset + tree_indexes],
+                    self.statistics['depth'][offset + tree_indexes], self.max_batch_nodes
+                )
+            for tree_indexes in batches:
+                if tree_indexes.shape[0] == 0:
+                    continue
+                start_index, end_index = int(tree_indexes[0]), int(tree_indexes[-1]) + 1
                 self.batch_description.append((graph_file, label_file, start_index, end_index))
+                self.batch_masks.append(tree_indexes - start_index)
 
-        self.current_label_file = None
-        self.labels = None
+    def _get_columnar_batch(self, start_index: int, end_index: int, mask: np.ndarray) -> Tuple[DGLGraph, torch.Tensor]:
+        if self._columns is None:
+            _, self._columns = load_columnar_dataset(self.dataset_path)
+        tree_indexes = start_index + mask
+        node_starts = self._columns[NODE_OFFSETS][tree_indexes]
+        n_nodes = self._columns[NODE_OFFSETS][tree_indexes + 1] - node_starts
+        edge_starts = self._columns[EDGE_OFFSETS][tree_indexes]
+        n_edges = self._columns[EDGE_OFFSETS][tree_indexes + 1] - edge_starts
+        # fancy indexing of memory mapped columns reads only rows of selected trees
+        edge_index = _get_segments_index(edge_starts, n_edges)
+        src = self._columns[SRC][edge_index].astype(np.int64)
+        dst = self._columns[DST][edge_index].astype(np.int64)
+        if self._reverse_edges:
+            src, dst = dst, src
 
-    def __len__(self) -> int:
-        return len(self.batch_description)
+        # edges of all trees are added at once with node ids shifted by the preceding trees
+        graph = _create_batched_graph(n_nodes, n_edges, src, dst)
+        node_index = _get_segments_index(node_starts, n_nodes)
+        graph.ndata['token'] = torch.from_numpy(self._columns[TOKEN][node_index].astype(np.int64))
+        graph.ndata['type'] = torch.from_numpy(self._columns[TYPE][node_index].astype(np.int64))
+        # [sequence len, batch size]
+        labels = torch.from_numpy(self._columns[LABEL][tree_indexes].astype(np.int64).T)
 
-    def _is_tree_suitable(self, tree: DGLGraph) -> bool:
-        return (self.max_n_nodes == -1 or tree.number_of_nodes() < self.max_n_nodes) and\
-               (self.max_depth == -1 or get_tree_depth(tree) < self.max_depth)
+        return graph, self._trim_label_padding(labels)
 
-    def __getitem__(self, item) -> Tuple[DGLGraph, torch.Tensor]:
-        graph_filename, label_filename, start_index, end_index = self.batch_description[item]
+    def _trim_label_padding(self, labels: torch.Tensor) -> torch.Tensor:
+        """Remove trailing steps, where all labels of the batch are padded"""
+        if self.label_pad_index is None or labels.dim() != 2:
+            return labels
+        is_content_step = (labels != self.label_pad_index).any(dim=1).nonzero()
+        length = is_content_step[-1].item() + 1 if is_content_step.shape[0] > 0 else labels.shape[0]
+        return labels[:length]
 
-        if label_filename != self.current_label_file:
-            self.current_label_file = label_filename
-            with open(label_filename, 'rb') as pkl_file:
-                pkl_data = load(pkl_file)
-            self.labels = torch.tensor(pkl_data['labels'].T, device=self.device).detach()
+    def load_batch(self, item) -> Tuple[DGLGraph, torch.Tensor, Optional[LevelSchedule]]:
+        """Load batch on CPU"""
+        graph_filename, label_filename, start_index, end_index = self.batch_description[item]
+        mask = self.batch_masks[item]
+        if self.is_columnar:
+            graph, labels = self._get_columnar_batch(start_index, end_index, mask)
+        else:
+            graph, labels = self._get_file_batch(graph_filename, label_filename, start_index, end_index, mask)
+        # the schedule is passed next to the graph from worker process
+        schedule = build_level_schedule(graph) if self.invert_edges else None
+        return graph, labels, schedule
 
-        graphs, _ = load_graphs(graph_filename, list(range(start_index, end_index)))
-        graphs, mask = zip(*[(g, i) for i, g in enumerate(graphs) if self._is_tree_suitable(g)])
+    def _get_file_batch(
+            self, graph_filename: str, label_filename: str, start_index: int, end_index: int, mask: np.ndarray
+    ) -> Tuple[DGLGraph, torch.Tensor]:
+        all_labels = self._cache.get(label_filename, lambda: _load_labels(label_filename), 'label_cache')
+        if os.path.getsize(graph_filename) > self._cache.budget:
+            # the whole file doesn't fit the cache, so load only trees of the batch
+            graphs, _ = load_graphs(graph_filename, (start_index + mask).tolist())
+        else:
+            graphs = self._cache.get(graph_filename, lambda: _load_graphs(graph_filename), 'graph_cache')
+            graphs = [graphs[start_index + i] for i in mask]
 
-        if self.invert_edges:
+        if self._reverse_edges:
             graphs = [g.reverse(share_ndata=True) for g in graphs]
 
         graph = batch(graphs)
+        # [sequence len, batch size]
+        labels = all_labels[:, start_index:end_index][:, mask]
+
+        return graph, self._trim_label_padding(labels)
+
+    def to_device(
+            self, graph: DGLGraph, labels: torch.Tensor, schedule: Optional[LevelSchedule]
+    ) -> Tuple[DGLGraph, torch.Tensor, Optional[LevelSchedule]]:
         graph.ndata['token'] = graph.ndata['token'].to(self.device).detach()
         graph.ndata['type'] = graph.ndata['type'].to(self.device).detach()
-        # [sequence len, batch size]
-        labels = self.labels[:, start_index:end_index][:, list(mask)]
+        if schedule is not None:
+            schedule = schedule.to(self.device)
+        return graph, labels.to(self.device).detach(), schedule
 
-        return graph, labels
+    def __getitem__(self, item) -> Tuple[DGLGraph, torch.Tensor, Optional[LevelSchedule]]:
+        return self.to_device(*self.load_batch(item))
@@ -0,0 +1,314 @@
+import json
+import os
+from math import ceil
+from pickle import dump, load
+from shutil import rmtree
+from typing import List, Iterator, Tuple, Union
+
+import numpy as np
+import torch
+from dgl import DGLGraph
+from dgl.data.utils import save_graphs, load_graphs
+from tqdm.auto import tqdm
+
+from utils.columnar_format import (
+    INDEX_NAME, FORMAT_NAME, FORMAT_VERSION, NODE_OFFSETS, EDGE_OFFSETS, SRC, DST, TOKEN, TYPE, LABEL, SOURCE_PATHS,
+    get_column_path, load_columnar_dataset
+)
+from utils.common import create_folder
+from utils.tree_operations import (
+    ROOT_TO_LEAVES, LEAVES_TO_ROOT, get_trees_statistics, get_graphs_statistics, concatenate_statistics,
+    save_trees_statistics, save_trees_orientation
+)
+
+# rough ratio between the size of decoded graphs in memory and the size of converted files on disk
+_MEMORY_PER_DISK_BYTE = 4
+_SHARDS_FOLDER = 'shards'
+
+
+class BatchWriter:
+    """Incrementally write graphs into batch_N.dgl and batch_N.pkl files.
+    Graphs are buffered until there are enough of them for a batch, so only one batch is kept in memory.
+    Added graphs are directed from root to leaves, with LEAVES_TO_ROOT orientation they are reversed before writing.
+    """
+
+    def __init__(self, output_path: str, batch_size: int, orientation: str = ROOT_TO_LEAVES):
+        self.output_path = output_path
+        self.batch_size = batch_size
+        self.orientation = orientation
+        self.n_batches = 0
+        self.n_graphs = 0
+
+        self._graphs = []
+        self._labels = []
+        self._source_paths = []
+        self._statistics = []
+
+    def add(self, graphs: List[DGLGraph], labels: List, source_paths: List) -> None:
+        self._graphs += graphs
+        self._labels += labels
+        self._source_paths += source_paths
+        n_full_batches = len(self._graphs) // self.batch_size
+        for batch_id in range(n_full_batches):
+            self._write_batch(slice(batch_id * self.batch_size, (batch_id + 1) * self.batch_size))
+        written = n_full_batches * self.batch_size
+        self._graphs = self._graphs[written:]
+        self._labels = self._labels[written:]
+        self._source_paths = self._source_paths[written:]
+
+    def close(self) -> None:
+        if len(self._graphs) > 0:
+            self._write_batch(slice(0, len(self._graphs)))
+            self._graphs, self._labels, self._source_paths = [], [], []
+        if len(self._statistics) > 0:
+            save_trees_statistics(self.output_path, concatenate_statistics(self._statistics))
+        save_trees_orientation(self.output_path, self.orientation)
+
+    def _write_batch(self, current_slice: slice) -> None:
+        output_graph_path = os.path.join(self.output_path, f'batch_{self.n_batches}.dgl')
+        output_labels_path = os.path.join(self.output_path, f'batch_{self.n_batches}.pkl')
+        graphs = self._graphs[current_slice]
+        self._statistics.append(get_graphs_statistics(graphs))
+        if self.orientation == LEAVES_TO_ROOT:
+            graphs = [graph.reverse(share_ndata=True) for graph in graphs]
+        save_graphs(output_graph_path, graphs)
+        with open(output_labels_path, 'wb') as pkl_file:
+            dump({
+                'labels': np.array(self._labels[current_slice]), 'source_paths': self._source_paths[current_slice]
+            }, pkl_file)
+        self.n_batches += 1
+        self.n_graphs += current_slice.stop - current_slice.start
+
+
+class ColumnarWriter:
+    """Incrementally write graphs into the columnar format, see utils.columnar_format.
+    Each column is appended to its flat binary file, the index with shapes and dtypes is written on close,
+    so an unfinished dataset isn't recognized by the loader.
+    Added graphs are directed from root to leaves, with LEAVES_TO_ROOT orientation source and destination
+    columns are swapped.
+    """
+
+    def __init__(
+            self, output_path: str, token_dtype: np.dtype = np.int32, type_dtype: np.dtype = np.int32,
+            label_dtype: np.dtype = np.int32, orientation: str = ROOT_TO_LEAVES
+    ):
+        self.output_path = output_path
+        self.orientation = orientation
+        self.n_graphs = 0
+        self.n_nodes = 0
+        self.n_edges = 0
+
+        self._dtypes = {
+            NODE_OFFSETS: np.dtype(np.int64), EDGE_OFFSETS: np.dtype(np.int64),
+            SRC: np.dtype(np.int32), DST: np.dtype(np.int32),
+            TOKEN: np.dtype(token_dtype), TYPE: np.dtype(type_dtype), LABEL: np.dtype(label_dtype)
+        }
+        self._files = {column: open(get_column_path(output_path, column), 'wb') for column in self._dtypes}
+        self._source_paths_file = open(os.path.join(output_path, SOURCE_PATHS), 'w')
+        self._token_width = None
+        self._label_shape = None
+        self._write(NODE_OFFSETS, np.zeros(1))
+        self._write(EDGE_OFFSETS, np.zeros(1))
+
+    def _write(self, column: str, data: np.ndarray) -> None:
+        self._files[column].write(np.ascontiguousarray(data, dtype=self._dtypes[column]).tobytes())
+
+    def add(self, graphs: List[DGLGraph], labels: List, source_paths: List) -> None:
+        if len(graphs) == 0:
+            return
+        edges = [graph.all_edges(order='eid') for graph in graphs]
+        if self.orientation == LEAVES_TO_ROOT:
+            edges = [(dst, src) for src, dst in edges]
+        n_nodes = np.array([graph.number_of_nodes() for graph in graphs])
+        n_edges = np.array([src.shape[0] for src, _ in edges])
+        token = torch.cat([graph.ndata['token'] for graph in graphs]).numpy()
+        token = token.reshape(token.shape[0], -1)
+        labels = np.array(labels)
+
+        if self._token_width is None:
+            self._token_width, self._label_shape = token.shape[1], list(labels.shape[1:])
+        if token.shape[1] != self._token_width or list(labels.shape[1:]) != self._label_shape:
+            raise ValueError(f"shapes of tokens or labels differ from the previous ones in {self.output_path}")
+
+        self._write(NODE_OFFSETS, self.n_nodes + np.cumsum(n_nodes))
+        self._write(EDGE_OFFSETS, self.n_edges + np.cumsum(n_edges))
+        self._write(SRC, torch.cat([src for src, _ in edges]).numpy())
+        self._write(DST, torch.cat([dst for _, dst in edges]).numpy())
+        self._write(TOKEN, token)
+        self._write(TYPE, torch.cat([graph.ndata['type'] for graph in graphs]).numpy())
+        self._write(LABEL, labels)
+        self._source_paths_file.write(''.join(f'{source_path}\n' for source_path in source_paths))
+
+        self.n_graphs += len(graphs)
+        self.n_nodes += int(n_nodes.sum())
+        self.n_edges += int(n_edges.sum())
+
+    def close(self) -> None:
+        for file in self._files.values():
+            file.close()
+        self._source_paths_file.close()
+        shapes = {
+            NODE_OFFSETS: [self.n_graphs + 1], EDGE_OFFSETS: [self.n_graphs + 1],
+            SRC: [self.n_edges], DST: [self.n_edges],
+            TOKEN: [self.n_nodes, self._token_width or 0], TYPE: [self.n_nodes],
+            LABEL: [self.n_graphs] + (self._label_shape or [])
+        }
+        tmp_index_path = os.path.join(self.output_path, f'{INDEX_NAME}.tmp')
+        with open(tmp_index_path, 'w') as index_file:
+            json.dump({
+                'format': FORMAT_NAME, 'version': FORMAT_VERSION, 'n_graphs': self.n_graphs,
+                'columns': {column: [dtype.str, shapes[column]] for column, dtype in self._dtypes.items()}
+            }, index_file)
+        save_trees_orientation(self.output_path, self.orientation)
+        os.replace(tmp_index_path, os.path.join(self.output_path, INDEX_NAME))
+
+        if self.n_graphs > 0:
+            _, columns = load_columnar_dataset(self.output_path)
+            save_trees_statistics(self.output_path, concatenate_statistics([get_trees_statistics(
+                np.diff(columns[NODE_OFFSETS]), np.diff(columns[EDGE_OFFSETS]), columns[SRC], columns[DST],
+                self.orientation
+            )]))
+
+
+def _collect_converted_projects(projects_paths: List[str], log_file: str) -> List[Tuple[str, int, int]]:
+    """Collect information about converted projects
+
+    :return: list of tuples with path to project, number of graphs in it, and size of converted files
+    """
+    converted_projects = []
+    for project_path in projects_paths:
+        graph_path = os.path.join(project_path, 'converted.dgl')
+        labels_path = os.path.join(project_path, 'converted.pkl')
+        if not os.path.exists(graph_path) or not os.path.exists(labels_path):
+            with open(log_file, 'a') as file:
+                file.write(f"can't load graphs for {project_path} project\n")
+            continue
+        with open(labels_path, 'rb') as pkl_file:
+            n_graphs = len(load(pkl_file)['labels'])
+        converted_projects.append((project_path, n_graphs, os.path.getsize(graph_path) + os.path.getsize(labels_path)))
+    return converted_projects
+
+
+def _load_project_slices(project_path: str, n_graphs: int, slice_size: int) -> Iterator[Tuple[List, List, List]]:
+    with open(os.path.join(project_path, 'converted.pkl'), 'rb') as pkl_file:
+        pkl_data = load(pkl_file)
+    labels, source_paths = pkl_data['labels'], pkl_data['source_paths']
+    assert len(labels) == len(source_paths), "unequal lengths of labels and source paths"
+    for start in range(0, n_graphs, slice_size):
+        end = min(n_graphs, start + slice_size)
+        graphs, _ = load_graphs(os.path.join(project_path, 'converted.dgl'), list(range(start, end)))
+        assert len(graphs) == end - start, "unequal lengths of graphs and labels"
+        yield graphs, labels[start:end].tolist(), source_paths[start:end].tolist()
+
+
+def write_batches(
+        projects_paths: List[str], writer: Union[BatchWriter, ColumnarWriter], log_file: str, shuffle: bool = True
+) -> None:
+    """Load all graphs to memory and write them by batches"""
+    graphs = []
+    labels = []
+    source_paths = []
+    print("load graphs to memory...")
+    for project_path, n_graphs, _ in tqdm(_collect_converted_projects(projects_paths, log_file)):
+        for cur_graphs, cur_labels, cur_source_paths in _load_project_slices(project_path, n_graphs, max(1, n_graphs)):
+            graphs += cur_graphs
+            labels += cur_labels
+            source_paths += cur_source_paths
+    print(f"total number of graphs: {len(graphs)}")
+
+    if shuffle:
+        order = np.random.permutation(len(graphs))
+        graphs = [graphs[i] for i in order]
+        labels = [labels[i] for i in order]
+        source_paths = [source_paths[i] for i in order]
+
+    print(f"save batches...")
+    writer.add(graphs, labels, source_paths)
+    writer.close()
+
+
+def _flush_shards(shards_path: str, shard_buffers: List[Tuple[List, List, List]], shard_parts: List[int]) -> None:
+    for shard_id, (graphs, labels, source_paths) in enumerate(shard_buffers):
+        if len(graphs) == 0:
+            continue
+        part_path = os.path.join(shards_path, f'shard_{shard_id}_{shard_parts[shard_id]}')
+        save_graphs(f'{part_path}.dgl', graphs)
+        with open(f'{part_path}.pkl', 'wb') as pkl_file:
+            dump({'labels': labels, 'source_paths': source_paths}, pkl_file)
+        shard_parts[shard_id] += 1
+        graphs.clear()
+        labels.clear()
+        source_paths.clear()
+
+
+def write_batches_streaming(
+        projects_paths: List[str], writer: Union[BatchWriter, ColumnarWriter], log_file: str, shuffle: bool = True,
+        memory_budget: int = 4 * 1024 ** 3
+) -> None:
+    """Write graphs by batches without loading the whole holdout to memory.
+    Shuffling is done externally in two passes: firstly, each graph is scattered to a random shard file,
+    then each shard is loaded, permuted and written by batches. Concatenation of permuted shards
+    is a uniformly random permutation of all graphs. The number of shards is chosen
+    so that one shard fits into the memory budget.
+
+    :param projects_paths: paths to converted projects
+    :param writer: writer of batches
+    :param log_file: path to file for logging failures
+    :param shuffle: if True, than shuffle graphs from all projects
+    :param memory_budget: approximate size of memory in bytes available for graphs
+    """
+    projects = _collect_converted_projects(projects_paths, log_file)
+    n_graphs = sum(project[1] for project in projects)
+    total_memory = sum(project[2] for project in projects) * _MEMORY_PER_DISK_BYTE
+    print(f"total number of graphs: {n_graphs}")
+    if n_graphs == 0:
+        return
+    # half of the budget is for loaded graphs, another half for buffers
+    graphs_in_budget = max(1, int(n_graphs * memory_budget / (2 * total_memory)))
+
+    if not shuffle:
+        print("save batches...")
+        for project_path, project_graphs, _ in tqdm(projects):
+            for graphs, labels, source_paths in _load_project_slices(project_path, project_graphs, graphs_in_budget):
+                writer.add(graphs, labels, source_paths)
+        writer.close()
+        return
+
+    n_shards = ceil(n_graphs / graphs_in_budget)
+    shards_path = os.path.join(writer.output_path, _SHARDS_FOLDER)
+    create_folder(shards_path)
+    shard_buffers = [([], [], []) for _ in range(n_shards)]
+    shard_parts = [0 for _ in range(n_shards)]
+    n_buffered = 0
+
+    print(f"scatter graphs to {n_shards} shards...")
+    for project_path, project_graphs, _ in tqdm(projects):
+        for graphs, labels, source_paths in _load_project_slices(project_path, project_graphs, graphs_in_budget):
+            for graph, label, source_path, shard_id in zip(
+                    graphs, labels, source_paths, np.random.randint(n_shards, size=len(graphs))
+            ):
+                shard_buffers[shard_id][0].append(graph)
+                shard_buffers[shard_id][1].append(label)
+                shard_buffers[shard_id][2].append(source_path)
+            n_buffered += len(graphs)
+            if n_buffered >= graphs_in_budget:
+                _flush_shards(shards_path, shard_buffers, shard_parts)
+                n_buffered = 0
+    _flush_shards(shards_path, shard_buffers, shard_parts)
+
+    print("shuffle shards and save batches...")
+    for shard_id in tqdm(range(n_shards)):
+        graphs, labels, source_paths = [], [], []
+        for part in range(shard_parts[shard_id]):
+            part_path = os.path.join(shards_path, f'shard_{shard_id}_{part}')
+            graphs += load_graphs(f'{part_path}.dgl')[0]
+            with open(f'{part_path}.pkl', 'rb') as pkl_file:
+                pkl_data = load(pkl_file)
+            labels += pkl_data['labels']
+            source_paths += pkl_data['source_paths']
+            os.remove(f'{part_path}.dgl')
+            os.remove(f'{part_path}.pkl')
+        order = np.random.permutation(len(graphs))
+        writer.add([graphs[i] for i in order], [labels[i] for i in order], [source_paths[i] for i in order])
+    writer.close()
+    rmtree(shards_path)
@@ -1,204 +1,582 @@
 import os
 import re
+from dataclasses import dataclass
 from datetime import datetime
-from multiprocessing import Pool, cpu_count
-from pickle import dump, load
-from typing import Dict
+from itertools import chain, count
+from multiprocessing import Pool, SimpleQueue, active_children, cpu_count
+from pickle import dump
+from queue import Empty, Queue
+from typing import Any, Dict, Tuple, List, Iterator, Union, Callable
 
 import numpy as np
 import pandas as pd
-from dgl import DGLGraph, batch, unbatch
-from dgl.data.utils import save_graphs, load_graphs
+import torch
+from dgl import DGLGraph
+from dgl.data.utils import save_graphs
 from tqdm.auto import tqdm
 
-from utils.common import UNK, PAD, SOS, EOS
-
-
-def convert_dot_to_dgl(dot_path: str) -> DGLGraph:
+from data_preprocessing.batch_writer import BatchWriter, ColumnarWriter, write_batches, write_batches_streaming
+from data_preprocessing.manifest import Manifest, DONE, FAILED, get_folder_stats, hash_folder, hash_object
+from utils.columnar_format import get_compact_dtype
+from utils.common import UNK, PAD, SOS, EOS, create_folder, segment_sizes_to_slices
+from utils.tree_operations import ROOT_TO_LEAVES, LEAVES_TO_ROOT
+
+# entry of convert manifest, that corresponds to the written batches
+_BATCHES_MANIFEST_KEY = '<batches>'
+# outputs of converted project, they aren't inputs of the conversion
+_CONVERTED_FILES = ['converted.dgl', 'converted.pkl']
+# seconds without finished tasks, after which workers of tasks in flight are checked to be alive
+_WORKERS_CHECK_INTERVAL = 1.
+
+
+def read_dot_edges(dot_path: str) -> Tuple[int, np.ndarray, np.ndarray]:
+    """Read edges of the tree stored in DOT file.
+    Each line between the header and the closing bracket looks like "parent -- {child_1 child_2 ... };",
+    so after replacing every non-digit symbol with a space and every line break with -1 separator,
+    the whole file is parsed by a single numpy call.
+
+    :param dot_path: path to DOT file
+    :return: Tuple[
+        number of nodes in the tree
+        [number of edges] int32 array with source nodes
+        [number of edges] int32 array with destination nodes
+    ]
+    """
     with open(dot_path, 'r') as dot_file:
         lines = dot_file.readlines()
-    edges = []
-    for line in lines[1:-1]:
-        edges.append([int(i) for i in re.findall(r'\d+', line)])
+    body = re.sub(r'[^\d\n]+', ' ', ''.join(lines[1:-1])).replace('\n', ' -1 ')
+    numbers = np.fromstring(body, dtype=np.int64, sep=' ')
+
+    is_separator = numbers == -1
+    # line number for each node id
+    line_ids = np.cumsum(is_separator)[~is_separator]
+    numbers = numbers[~is_separator]
+    # the first number in each line is a parent, the rest are its children
+    is_parent = np.ones_like(numbers, dtype=np.bool_)
+    is_parent[1:] = line_ids[1:] != line_ids[:-1]
+    parents = numbers[is_parent]
+
+    src = parents[np.cumsum(is_parent) - 1][~is_parent]
+    dst = numbers[~is_parent]
+    return int(parents.max()) + 1, src.astype(np.int32), dst.astype(np.int32)
+
+
+def edges_to_dgl(n_nodes: int, src: np.ndarray, dst: np.ndarray) -> DGLGraph:
     g_dgl = DGLGraph()
-    g_dgl.add_nodes(max(edges)[0] + 1)
-    for e in edges:
-        if len(e) > 1:
-            g_dgl.add_edges(e[0], e[1:])
+    g_dgl.add_nodes(n_nodes)
+    g_dgl.add_edges(src.astype(np.int64), dst.astype(np.int64))
     return g_dgl
 
 
-def _move_tokens_to_leaves(graph: DGLGraph, pad_token_index: int, pad_type_index: int) -> DGLGraph:
-    old_token = graph.ndata['token'].numpy()
-    n_old_nodes = old_token.shape[0]
+def convert_dot_to_dgl(dot_path: str) -> DGLGraph:
+    return edges_to_dgl(*read_dot_edges(dot_path))
+
+
+def _move_tokens_to_leaves(
+        n_nodes: np.ndarray, n_edges: np.ndarray, src: np.ndarray, dst: np.ndarray,
+        token: np.ndarray, node_type: np.ndarray, pad_token_index: int, pad_type_index: int
+) -> Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+    """Move tokens to new leaves for all graphs at once.
+    Graphs are described by flat arrays: nodes and edges of graphs go one after another,
+    while edges are numbered inside their graph. Each not padded token of a node with not padded type
+    becomes a new leaf of this node, and the node keeps only padding. Nodes with padded type keep their first token.
+    New nodes and edges of each graph are appended after the old ones in the row-major order of the token matrix.
+
+    :return: number of nodes and edges in each graph, edges, token with shape [total nodes, 1], and type
+    """
+    n_graphs = n_nodes.shape[0]
+    graph_ids = np.repeat(np.arange(n_graphs), n_nodes)
+    type_mask = node_type != pad_type_index
+    mask = np.logical_and(token != pad_token_index, type_mask.reshape(-1, 1))
+    # nonzero goes in row-major order, so parents are sorted by graphs
+    parents, _ = np.nonzero(mask)
+    new_graph_ids = graph_ids[parents]
+    n_new_nodes = np.bincount(new_graph_ids, minlength=n_graphs)
+
+    node_offsets = np.cumsum(n_nodes) - n_nodes
+    new_node_offsets = np.cumsum(n_new_nodes) - n_new_nodes
+    new_src = parents - node_offsets[new_graph_ids]
+    new_dst = n_nodes[new_graph_ids] + np.arange(parents.shape[0]) - new_node_offsets[new_graph_ids]
+
+    # stable sort by graph id places new nodes and edges of each graph right after the old ones
+    node_order = np.argsort(np.concatenate([graph_ids, new_graph_ids]), kind='stable')
+    edge_graph_ids = np.repeat(np.arange(n_graphs), n_edges)
+    edge_order = np.argsort(np.concatenate([edge_graph_ids, new_graph_ids]), kind='stable')
+
+    old_token = np.where(type_mask, pad_token_index, token[:, 0])
+    new_token = np.concatenate([old_token, token[mask]])[node_order].reshape(-1, 1)
+    new_type = np.concatenate([node_type, np.full(parents.shape[0], pad_type_index, dtype=node_type.dtype)])
+    new_src = np.concatenate([src, new_src.astype(src.dtype)])[edge_order]
+    new_dst = np.concatenate([dst, new_dst.astype(dst.dtype)])[edge_order]
+    return n_nodes + n_new_nodes, n_edges + n_new_nodes, new_src, new_dst, new_token, new_type[node_order]
+
+
+def _encode_values(data: pd.Series, to_id: Dict) -> np.ndarray:
+    return data.map(to_id).fillna(to_id[UNK]).to_numpy(dtype=np.int32)
+
+
+def _encode_sequences(data: pd.Series, to_id: Dict, max_len: int, is_wrap: bool, delimiter: str = '|') -> np.ndarray:
+    """Split each value into subtokens and encode them with ids.
+    Instead of processing values one by one, all subtokens are exploded into one series,
+    mapped to ids at once and scattered into the padded matrix by their row and position.
+
+    :param data: series with values, non string values are encoded as a padding sequence
+    :param to_id: dict for converting subtokens to ids
+    :param max_len: length of each encoded sequence, longer sequences are truncated
+    :param is_wrap: if True, than add SOS and EOS to each sequence
+    :param delimiter: used in values to divide into subtokens
+    :return: [len of data, max len] int32 matrix with padded sequences
+    """
+    if max_len <= 0:
+        raise ValueError(f"max len of split sequences should be positive, but got {max_len}")
+    encoded = np.full((len(data), max_len), to_id[PAD], dtype=np.int32)
+
+    data = data.reset_index(drop=True)
+    data = data[data.map(lambda _v: isinstance(_v, str))]
+    if data.empty:
+        return encoded
+    subtokens = data.str.split(delimiter).explode()
+    rows = subtokens.index.to_numpy()
+    positions = subtokens.groupby(level=0).cumcount().to_numpy()
+    ids = _encode_values(subtokens, to_id)
+
+    if is_wrap:
+        str_rows = data.index.to_numpy()
+        encoded[str_rows, 0] = to_id[SOS]
+        positions = positions + 1
+        eos_positions = np.bincount(rows, minlength=len(encoded))[str_rows] + 1
+        is_fit = eos_positions < max_len
+        encoded[str_rows[is_fit], eos_positions[is_fit]] = to_id[EOS]
+
+    is_fit = positions < max_len
+    encoded[rows[is_fit], positions[is_fit]] = ids[is_fit]
+    return encoded
+
+
+@dataclass
+class ProjectDescription:
+    # [number of nodes, max token len or 1] ordered by AST and node id
+    token: np.ndarray
+    # [number of nodes] ordered by AST and node id
+    type: np.ndarray
+    # [number of ASTs, max label len] or [number of ASTs] ordered by AST
+    label: np.ndarray
+    # [number of ASTs] ordered by AST
+    source_file: np.ndarray
+
+
+def prepare_project_description(project_path: str, asts: List[str], token_to_id: Dict, type_to_id: Dict,
+                                label_to_id: Dict, is_split: bool, max_token_len: int = -1, max_label_len: int = -1,
+                                wrap_tokens: bool = False, wrap_labels: bool = False, delimiter: str = '|',
+                                chunk_size: int = 100_000) -> ProjectDescription:
+    """Encode node description of project with ids from vocabularies.
+    The description is read in chunks, and only compact encoded arrays are kept in memory.
+
+    :param project_path: path to the project with description.csv file
+    :param asts: names of DOT files in the order of converting, nodes of other files are skipped
+    :param chunk_size: number of description rows processed at once
+    :return: encoded features of nodes and ASTs
+    """
+    ast_index = pd.Series(np.arange(len(asts), dtype=np.int32), index=asts)
+    node_ast, node_id, token, node_type = [], [], [], []
+    label_ast, label, source_file = [], [], []
+
+    # dtypes are fixed, otherwise they are inferred for each chunk, e.g. chunk of numeric tokens is read as numbers
+    description_reader = pd.read_csv(
+        os.path.join(project_path, 'description.csv'), chunksize=chunk_size,
+        usecols=['dot_file', 'source_file', 'label', 'node_id', 'token', 'type'],
+        dtype={'dot_file': str, 'source_file': str, 'label': str, 'token': str, 'type': str}
+    )
+    for description in description_reader:
+        description = description.reset_index(drop=True)
+        cur_ast = description['dot_file'].map(ast_index).fillna(-1).to_numpy(dtype=np.int32)
+        description = description[cur_ast != -1]
+        cur_ast = cur_ast[cur_ast != -1]
+        is_root = (description['node_id'] == 0).to_numpy()
+
+        node_ast.append(cur_ast)
+        node_id.append(description['node_id'].to_numpy(dtype=np.int32))
+        node_type.append(_encode_values(description['type'], type_to_id))
+        label_ast.append(cur_ast[is_root])
+        source_file.append(description['source_file'][is_root].to_numpy())
+        # convert token and label
+        if is_split:
+            token.append(_encode_sequences(description['token'], token_to_id, max_token_len, wrap_tokens, delimiter))
+            label.append(_encode_sequences(
+                description['label'][is_root], label_to_id, max_label_len, wrap_labels, delimiter
+            ))
+        else:
+            token.append(_encode_values(description['token'], token_to_id).reshape(-1, 1))
+            label.append(_encode_values(description['label'][is_root], label_to_id))
+
+    node_order = np.lexsort((np.concatenate(node_id), np.concatenate(node_ast)))
+    label_order = np.argsort(np.concatenate(label_ast), kind='stable')
+    return ProjectDescription(
+        token=np.concatenate(token)[node_order],
+        type=np.concatenate(node_type)[node_order],
+        label=np.concatenate(label)[label_order],
+        source_file=np.concatenate(source_file)[label_order].astype(str)
+    )
 
-    type_mask = graph.ndata['type'].numpy() != pad_type_index
-    type_mask = np.tile(type_mask.reshape(-1, 1), old_token.shape[1])
-    mask = np.logical_and(old_token != pad_token_index, type_mask)
-    n_new_nodes = mask.sum()
 
-    new_token = np.full((n_old_nodes + n_new_nodes, 1), pad_token_index, dtype=np.int)
-    new_token[:n_old_nodes] = np.where(~type_mask, old_token, pad_token_index)[:, [0]]
-    new_token[n_old_nodes:] = old_token[mask].reshape(-1, 1)
+def _get_project_asts(project_path: str) -> List[str]:
+    asts = os.listdir(os.path.join(project_path, 'asts'))
+    asts.sort(key=lambda _ast: int(re.findall(r'\d+', _ast)[0]))
+    return asts
 
-    us, _ = np.nonzero(mask)
-    vs = np.arange(n_new_nodes) + n_old_nodes
 
-    graph.add_nodes(n_new_nodes)
-    graph.add_edges(us, vs)
+def _save_converted_project(project_path: str, description: ProjectDescription,
+                            edges: List[Tuple[int, np.ndarray, np.ndarray]], token_to_leaves: bool,
+                            pad_token_index: int, pad_type_index: int) -> None:
+    n_nodes = np.array([ast_edges[0] for ast_edges in edges], dtype=np.int64)
+    n_edges = np.array([ast_edges[1].shape[0] for ast_edges in edges], dtype=np.int64)
+    src = np.concatenate([ast_edges[1] for ast_edges in edges])
+    dst = np.concatenate([ast_edges[2] for ast_edges in edges])
+    token, node_type = description.token, description.type
 
-    graph.ndata['type'][n_old_nodes:] = pad_type_index
-    graph.ndata['token'] = new_token
-    return graph
+    if token_to_leaves:
+        n_nodes, n_edges, src, dst, token, node_type = _move_tokens_to_leaves(
+            n_nodes, n_edges, src, dst, token, node_type, pad_token_index, pad_type_index
+        )
 
+    token = torch.from_numpy(token.astype(np.int64))
+    node_type = torch.from_numpy(node_type.astype(np.int64))
+    graphs = []
+    for node_slice, edge_slice in zip(segment_sizes_to_slices(n_nodes), segment_sizes_to_slices(n_edges)):
+        graph = edges_to_dgl(node_slice.stop - node_slice.start, src[edge_slice], dst[edge_slice])
+        graph.ndata['token'] = token[node_slice]
+        graph.ndata['type'] = node_type[node_slice]
+        graphs.append(graph)
 
-def _split_token(data: pd.Series, to_id: Dict, max_len: int, is_wrap: bool, delimiter: str = '|') -> pd.Series:
-    unk_id = to_id[UNK]
-    pad_id = to_id[PAD]
+    labels = description.label.astype(np.int64)
+    source_paths = description.source_file
 
-    def split_val(val):
-        if is_wrap:
-            return [SOS] + val.split(delimiter) + [EOS]
-        else:
-            return val.split(delimiter)
-
-    data = data.apply(
-        lambda _token:
-        [to_id.get(t, unk_id) for t in split_val(_token)[:max_len]]
-        if isinstance(_token, str) else []
-    ).apply(
-        lambda _l: _l + [pad_id] * (max_len - len(_l))
-    )
-    return data
-
-
-def prepare_project_description(project_path: str, token_to_id: Dict, type_to_id: Dict, label_to_id: Dict,
-                                is_split: bool, max_token_len: int = -1, max_label_len: int = -1,
-                                wrap_tokens: bool = False, wrap_labels: bool = False, delimiter: str = '|'
-                                ) -> pd.DataFrame:
-    description = pd.read_csv(os.path.join(project_path, 'description.csv')).sort_values(['dot_file', 'node_id'])
-
-    unk_type_id = type_to_id[UNK]
-    description['type_feature'] = description['type'].apply(lambda _type: type_to_id.get(_type, unk_type_id))
-    # convert token and label
-    if is_split:
-        description['token_feature'] = _split_token(description['token'], token_to_id, max_token_len, wrap_tokens,
-                                                    delimiter)
-        description['label_feature'] = _split_token(description['label'], label_to_id, max_label_len, wrap_labels,
-                                                    delimiter)
-    else:
-        unk_token_id = token_to_id[UNK]
-        unk_label_id = label_to_id[UNK]
-        description['token_feature'] = description['token'].apply(lambda _token: token_to_id.get(_token, unk_token_id))
-        description['label_feature'] = description['label'].apply(lambda _label: label_to_id.get(_label, unk_label_id))
-
-    return description
+    save_graphs(os.path.join(project_path, 'converted.dgl'), graphs)
+    with open(os.path.join(project_path, 'converted.pkl'), 'wb') as pkl_file:
+        dump({
+            'labels': labels, 'source_paths': source_paths
+        }, pkl_file)
 
 
 def convert_project(project_path: str, token_to_id: Dict, type_to_id: Dict, label_to_id: Dict,
                     token_to_leaves: bool, is_split: bool, max_token_len: int = -1, max_label_len: int = -1,
-                    wrap_tokens: bool = False, wrap_labels: bool = False, delimiter: str = '|', n_jobs: int = -1):
+                    wrap_tokens: bool = False, wrap_labels: bool = False, delimiter: str = '|', n_jobs: int = -1,
+                    dot_chunk_size: int = 256):
+    asts = _get_project_asts(project_path)
+
     print("node description preparation")
     description = prepare_project_description(
-        project_path, token_to_id, type_to_id, label_to_id, is_split,
+        project_path, asts, token_to_id, type_to_id, label_to_id, is_split,
         max_token_len, max_label_len, wrap_tokens, wrap_labels, delimiter
     )
 
-    asts = os.listdir(os.path.join(project_path, 'asts'))
-    asts.sort(key=lambda _ast: int(re.findall(r'\d+', _ast)[0]))
-
     print("converting to dgl format...")
     n_jobs = cpu_count() if n_jobs == -1 else n_jobs
+    # workers return compact edge arrays instead of pickled graphs, several DOT files per task
     with Pool(n_jobs) as pool:
-        results = pool.imap(convert_dot_to_dgl, [os.path.join(project_path, 'asts', ast) for ast in asts])
-        graphs = [g for g in tqdm(results, total=len(asts))]
+        results = pool.imap(
+            read_dot_edges, [os.path.join(project_path, 'asts', ast) for ast in asts], chunksize=dot_chunk_size
+        )
+        edges = list(tqdm(results, total=len(asts)))
 
-    description_ordered = description.set_index('dot_file').loc[asts]
-    graphs = batch(graphs)
-    graphs.ndata['token'] = np.vstack(description_ordered['token_feature'])
-    graphs.ndata['type'] = description_ordered['type_feature'].to_numpy()
-    graphs = unbatch(graphs)
+    _save_converted_project(project_path, description, edges, token_to_leaves, token_to_id[PAD], type_to_id[PAD])
 
-    if token_to_leaves:
-        print("move tokens to leaves...")
-        graphs = [_move_tokens_to_leaves(g, token_to_id[PAD], type_to_id[PAD]) for g in tqdm(graphs)]
 
-    mask_per_ast = description_ordered['node_id'] == 0
-    labels = np.stack(description_ordered[mask_per_ast]['label_feature'].values)
-    source_paths = np.stack(description_ordered[mask_per_ast]['source_file'].values)
+# vocabularies are passed to each worker of converting pool once, instead of pickling them for each task
+_worker_vocabulary = {}
+_worker_started_tasks = []
 
-    save_graphs(os.path.join(project_path, 'converted.dgl'), graphs)
-    with open(os.path.join(project_path, 'converted.pkl'), 'wb') as pkl_file:
-        dump({
-            'labels': labels, 'source_paths': source_paths
-        }, pkl_file)
 
+def _init_convert_worker(token_to_id: Dict, type_to_id: Dict, label_to_id: Dict, started_tasks: SimpleQueue) -> None:
+    _worker_vocabulary.update(token_to_id=token_to_id, type_to_id=type_to_id, label_to_id=label_to_id)
+    _worker_started_tasks.append(started_tasks)
+
+
+def _run_convert_task(task_id: int, func: Callable, args: Tuple) -> Any:
+    # the task is reported before running, so a task of the killed worker is known
+    _worker_started_tasks[0].put((task_id, os.getpid()))
+    return func(*args)
+
+
+def _save_project_task(project_path: str, asts: List[str], edges: List[Tuple[int, np.ndarray, np.ndarray]],
+                       token_to_leaves: bool, description_params: Dict) -> None:
+    # description is prepared by the worker that saves the project, so it isn't passed between processes
+    description = prepare_project_description(project_path, asts, **_worker_vocabulary, **description_params)
+    _save_converted_project(
+        project_path, description, edges, token_to_leaves,
+        _worker_vocabulary['token_to_id'][PAD], _worker_vocabulary['type_to_id'][PAD]
+    )
+
+
+def _read_dot_files_task(dot_paths: List[str]) -> List[Tuple[int, np.ndarray, np.ndarray]]:
+    return [read_dot_edges(dot_path) for dot_path in dot_paths]
+
+
+def _get_project_size(project_path: str) -> int:
+    description_path = os.path.join(project_path, 'description.csv')
+    return os.path.getsize(description_path) if os.path.exists(description_path) else 0
+
+
+def _log_convert_failure(log_file: str, project_path: str, err: BaseException) -> None:
+    with open(log_file, 'a') as file:
+        file.write(f"can't convert {project_path} project, failed with\n{err}\n")
 
-def _convert_project_safe(project_path: str, log_file: str,  **kwargs):
-    if os.path.exists(os.path.join(project_path, 'converted.dgl')):
-        return
-    try:
-        convert_project(project_path, **kwargs)
-    except Exception as err:
-        with open(log_file, 'a') as log_file:
-            log_file.write(f"can't convert {project_path} project, failed with\n{err}")
+
+def _remove_converted_project(project_path: str) -> None:
+    """Remove outputs of the previous conversion, so they aren't written to batches instead of the failed one"""
+    for file_name in _CONVERTED_FILES:
+        file_path = os.path.join(project_path, file_name)
+        if os.path.exists(file_path):
+            os.remove(file_path)
+
+
+@dataclass
+class _ConvertingProject:
+    asts: List[str]
+    n_parts: int
+    edges: List = None
+    n_done_parts: int = 0
+    n_tasks_in_flight: int = 0
+    is_failed: bool = False
+
+
+def convert_projects(projects_paths: List[str], log_file: str, token_to_id: Dict, type_to_id: Dict,
+                     label_to_id: Dict, token_to_leaves: bool, n_jobs: int = -1, dot_chunk_size: int = 256,
+                     on_finished: Callable[[str, bool], None] = None, **description_params) -> List[str]:
+    """Convert projects with a single pool of workers.
+    DOT files of each project are read by independent tasks in chunks. Once all chunks of the project are ready,
+    another task prepares its description, assembles graphs and saves them. Projects are scheduled
+    from the largest to the smallest, and the number of tasks in flight is bounded, so ready parts don't pile up
+    in memory. A failure of any task only skips the corresponding project and is written to the log file.
+    A task of a worker, that was killed (e.g. out of memory), never returns, so it is failed once its worker is gone.
+
+    :param projects_paths: paths to projects that should be converted
+    :param log_file: path to file for logging failures
+    :param n_jobs: number of workers, -1 corresponds to the number of cpu
+    :param dot_chunk_size: number of DOT files read by one task
+    :param on_finished: callback, that is called with path to project and success flag once it is finished
+    :param description_params: params for preparing project description, see prepare_project_description
+    :return: list of successfully converted projects
+    """
+    n_jobs = cpu_count() if n_jobs == -1 else n_jobs
+    projects = {}
+    finished_parts = Queue()
+    # project and part of each task in flight by its id, and pid of the worker for started tasks
+    tasks_in_flight = {}
+    task_workers = {}
+    task_ids = count()
+    started_tasks = SimpleQueue()
+
+    def finish(project_path: str, is_converted: bool) -> None:
+        progress_bar.update()
+        if on_finished is not None:
+            on_finished(project_path, is_converted)
+
+    def generate_tasks() -> Iterator[Tuple[str, Union[str, int], Callable, Tuple]]:
+        for project_path in sorted(projects_paths, key=_get_project_size, reverse=True):
+            try:
+                asts = _get_project_asts(project_path)
+            except Exception as err:
+                _log_convert_failure(log_file, project_path, err)
+                _remove_converted_project(project_path)
+                finish(project_path, False)
+                continue
+            dot_paths = [os.path.join(project_path, 'asts', ast) for ast in asts]
+            dot_chunks = [dot_paths[i:i + dot_chunk_size] for i in range(0, len(dot_paths), dot_chunk_size)]
+            project = _ConvertingProject(asts=asts, n_parts=len(dot_chunks), edges=[None] * len(dot_chunks))
+            projects[project_path] = project
+
+            if len(dot_chunks) == 0:
+                yield project_path, 'save', _save_project_task, (
+                    project_path, asts, [], token_to_leaves, description_params
+                )
+            for chunk_id, dot_chunk in enumerate(dot_chunks):
+                # the rest of chunks of the failed project aren't read
+                if project.is_failed:
+                    break
+                yield project_path, chunk_id, _read_dot_files_task, (dot_chunk,)
+
+    def submit(project_path: str, part: Union[str, int], func: Callable, args: Tuple) -> None:
+        task_id = next(task_ids)
+        tasks_in_flight[task_id] = project_path, part
+        projects[project_path].n_tasks_in_flight += 1
+        pool.apply_async(
+            _run_convert_task, (task_id, func, args),
+            callback=lambda result: finished_parts.put((task_id, result, None)),
+            error_callback=lambda err: finished_parts.put((task_id, None, err))
+        )
+
+    def fail_tasks_of_dead_workers() -> None:
+        alive_pids = {process.pid for process in active_children()}
+        for task_id, pid in list(task_workers.items()):
+            if pid not in alive_pids:
+                del task_workers[task_id]
+                finished_parts.put((task_id, None, RuntimeError(f"worker {pid} died while running the task")))
+
+    converted_projects = []
+    max_tasks_in_flight = 2 * n_jobs
+    tasks = generate_tasks()
+    progress_bar = tqdm(total=len(projects_paths))
+    with Pool(
+            n_jobs, initializer=_init_convert_worker, initargs=(token_to_id, type_to_id, label_to_id, started_tasks)
+    ) as pool:
+        while True:
+            for task in tasks:
+                submit(*task)
+                if len(tasks_in_flight) >= max_tasks_in_flight:
+                    break
+            if len(tasks_in_flight) == 0:
+                break
+
+            # queue of started tasks is read on every step, so it doesn't fill up and block workers
+            while not started_tasks.empty():
+                task_id, pid = started_tasks.get()
+                if task_id in tasks_in_flight:
+                    task_workers[task_id] = pid
+            try:
+                task_id, result, err = finished_parts.get(timeout=_WORKERS_CHECK_INTERVAL)
+            except Empty:
+                fail_tasks_of_dead_workers()
+                continue
+            # result of the task, that was already failed with its worker, is ignored
+            if task_id not in tasks_in_flight:
+                continue
+            project_path, part = tasks_in_flight.pop(task_id)
+            task_workers.pop(task_id, None)
+            project = projects[project_path]
+            project.n_tasks_in_flight -= 1
+            if err is not None and not project.is_failed:
+                _log_convert_failure(log_file, project_path, err)
+                _remove_converted_project(project_path)
+                project.is_failed, project.edges = True, None
+                finish(project_path, False)
+            if project.is_failed:
+                # the failed project is forgotten once all its tasks in flight are returned
+                if project.n_tasks_in_flight == 0:
+                    del projects[project_path]
+                continue
+
+            if part == 'save':
+                converted_projects.append(project_path)
+                del projects[project_path]
+                finish(project_path, True)
+                continue
+            project.edges[part] = result
+            project.n_done_parts += 1
+
+            if project.n_done_parts == project.n_parts:
+                # saving task goes right after tasks in flight, so the assembled project leaves memory soon
+                submit(project_path, 'save', _save_project_task, (
+                    project_path, project.asts, list(chain.from_iterable(project.edges)), token_to_leaves,
+                    description_params
+                ))
+                project.edges = None
+    progress_bar.close()
+    return converted_projects
+
+
+def _get_project_inputs_stats(project_path: str) -> Dict[str, List[int]]:
+    return get_folder_stats(project_path, exclude=_CONVERTED_FILES)
+
+
+def _get_project_inputs_fingerprint(project_path: str) -> str:
+    return hash_folder(project_path, exclude=_CONVERTED_FILES)
 
 
 def convert_holdout(holdout_path: str, output_path: str, batch_size: int,
                     token_to_id: Dict, type_to_id: Dict, label_to_id: Dict,
                     tokens_to_leaves: bool = False, is_split: bool = False,
                     max_token_len: int = -1, max_label_len: int = -1, wrap_tokens: bool = False,
-                    wrap_labels: bool = False, delimiter: str = '|', shuffle: bool = True, n_jobs: int = -1) -> str:
+                    wrap_labels: bool = False, delimiter: str = '|', shuffle: bool = True, n_jobs: int = -1,
+                    streaming: bool = False, memory_budget: int = 4 * 1024 ** 3, output_format: str = 'dgl',
+                    orientation: str = LEAVES_TO_ROOT) -> None:
+    """Convert projects of the holdout and write them by batches to the output folder.
+    Output format is either 'dgl' with batch_N.dgl and batch_N.pkl files
+    or 'columnar' with memory mappable flat arrays, see utils.columnar_format.
+    Converted projects store trees from root to leaves, batches are written in the passed orientation,
+    by default the one that encoders expect, so the loader doesn't reverse edges.
+    Fingerprints of projects inputs, vocabulary and conversion params are stored in a manifest next to the holdout,
+    so only changed or failed projects are converted again. Content of projects is hashed again only
+    if sizes or modification times of their files changed. Outputs of failed projects are removed,
+    only successfully converted projects are written. Batches are rewritten only if any project changed.
+    """
+    if output_format not in ['dgl', 'columnar']:
+        raise ValueError(f"unknown output format {output_format}")
+    if orientation not in [ROOT_TO_LEAVES, LEAVES_TO_ROOT]:
+        raise ValueError(f"unknown orientation of trees {orientation}")
     log_file = os.path.join('logs', f"convert_{datetime.now().strftime('%Y_%m_%d_%H:%M:%S')}.txt")
 
-    projects_paths = [os.path.join(holdout_path, project, 'java') for project in os.listdir(holdout_path)]
+    projects = os.listdir(holdout_path)
+    projects_paths = [os.path.join(holdout_path, project, 'java') for project in projects]
+    project_by_path = dict(zip(projects_paths, projects))
 
-    print("converting projects...")
-    for project_path in tqdm(projects_paths):
-        print(f"converting {project_path}")
-        _convert_project_safe(
-            project_path, log_file, token_to_id=token_to_id, type_to_id=type_to_id, label_to_id=label_to_id,
-            token_to_leaves=tokens_to_leaves, is_split=is_split, max_token_len=max_token_len,
-            max_label_len=max_label_len, wrap_tokens=wrap_tokens, wrap_labels=wrap_labels, delimiter=delimiter,
-            n_jobs=n_jobs
+    manifest = Manifest(f'{holdout_path.rstrip(os.sep)}_convert_manifest.json')
+    manifest.retain(projects + [_BATCHES_MANIFEST_KEY])
+    params_fingerprint = hash_object((
+        token_to_id, type_to_id, label_to_id, tokens_to_leaves, is_split,
+        max_token_len, max_label_len, wrap_tokens, wrap_labels, delimiter
+    ))
+    with Pool(cpu_count() if n_jobs == -1 else n_jobs) as pool:
+        inputs_stats = pool.map(_get_project_inputs_stats, projects_paths)
+        inputs_fingerprints = [
+            manifest.get_folder_hash(project_by_path[project_path], project_stats)
+            for project_path, project_stats in zip(projects_paths, inputs_stats)
+        ]
+        # content is read only for projects with changed sizes or modification times of files
+        changed_ids = [i for i, inputs_fingerprint in enumerate(inputs_fingerprints) if inputs_fingerprint is None]
+        print(f"hashing inputs of {len(changed_ids)} changed projects...")
+        changed_fingerprints = pool.map(_get_project_inputs_fingerprint, [projects_paths[i] for i in changed_ids])
+    for i, inputs_fingerprint in zip(changed_ids, changed_fingerprints):
+        manifest.set_folder_hash(project_by_path[projects_paths[i]], inputs_stats[i], inputs_fingerprint)
+        inputs_fingerprints[i] = inputs_fingerprint
+    fingerprints = {
+        project_path: hash_object((inputs_fingerprint, params_fingerprint))
+        for project_path, inputs_fingerprint in zip(projects_paths, inputs_fingerprints)
+    }
+
+    projects_to_convert = [
+        project_path for project_path in projects_paths
+        if not manifest.is_done(project_by_path[project_path], fingerprints[project_path])
+        or not os.path.exists(os.path.join(project_path, 'converted.dgl'))
+    ]
+    print(f"converting {len(projects_to_convert)} projects, {len(projects) - len(projects_to_convert)} are up to date...")
+    try:
+        convert_projects(
+            projects_to_convert, log_file, token_to_id, type_to_id, label_to_id, tokens_to_leaves, n_jobs,
+            on_finished=lambda project_path, is_converted: manifest.mark(
+                project_by_path[project_path], fingerprints[project_path], DONE if is_converted else FAILED
+            ),
+            is_split=is_split, max_token_len=max_token_len, max_label_len=max_label_len,
+            wrap_tokens=wrap_tokens, wrap_labels=wrap_labels, delimiter=delimiter
         )
+    finally:
+        manifest.save()
+
+    # only successfully converted projects are written, so the fingerprint describes the written batches
+    converted_paths = [
+        project_path for project_path in sorted(projects_paths)
+        if manifest.is_done(project_by_path[project_path], fingerprints[project_path])
+    ]
+    batches_fingerprint = hash_object((
+        [fingerprints[project_path] for project_path in converted_paths],
+        batch_size, shuffle, output_format, orientation
+    ))
+    if manifest.is_done(_BATCHES_MANIFEST_KEY, batches_fingerprint) and os.path.exists(output_path):
+        print("batches are up to date")
+        return
 
-    graphs = []
-    labels = []
-    source_paths = []
-    print("load graphs to memory...")
-    for project_path in tqdm(projects_paths):
-        graph_path = os.path.join(project_path, 'converted.dgl')
-        labels_path = os.path.join(project_path, 'converted.pkl')
-        if not os.path.exists(graph_path) or not os.path.exists(labels_path):
-            with open(log_file, 'a') as file:
-                file.write(f"can't load graphs for {project_path} project\n")
-            continue
-        cur_graphs, _ = load_graphs(graph_path)
-        with open(labels_path, 'rb') as pkl_file:
-            pkl_data = load(pkl_file)
-            cur_labels, cur_source_paths = pkl_data['labels'], pkl_data['source_paths']
-        graphs += cur_graphs
-        labels += cur_labels.tolist()
-        source_paths += cur_source_paths.tolist()
-    assert len(graphs) == len(labels), "unequal lengths of graphs and labels"
-    assert len(graphs) == len(source_paths), "unequal lengths of graphs and source paths"
-    print(f"total number of graphs: {len(graphs)}")
-
-    if shuffle:
-        order = np.random.permutation(len(graphs))
-        graphs = [graphs[i] for i in order]
-        labels = [labels[i] for i in order]
-        source_paths = [source_paths[i] for i in order]
-
-    print(f"save batches...")
-    n_batches = len(graphs) // batch_size + (1 if len(graphs) % batch_size > 0 else 0)
-    for batch_num in tqdm(range(n_batches)):
-        current_slice = slice(batch_num * batch_size, min((batch_num + 1) * batch_size, len(graphs)))
-        output_graph_path = os.path.join(output_path, f'batch_{batch_num}.dgl')
-        output_labels_path = os.path.join(output_path, f'batch_{batch_num}.pkl')
-        save_graphs(output_graph_path, graphs[current_slice])
-        with open(output_labels_path, 'wb') as pkl_file:
-            dump({
-                'labels': np.array(labels[current_slice]), 'source_paths': source_paths[current_slice]
-            }, pkl_file)
+    create_folder(output_path)
+    if output_format == 'columnar':
+        writer = ColumnarWriter(
+            output_path, get_compact_dtype(len(token_to_id)), get_compact_dtype(len(type_to_id)),
+            get_compact_dtype(len(label_to_id)), orientation
+        )
+    else:
+        writer = BatchWriter(output_path, batch_size, orientation)
+    if streaming:
+        write_batches_streaming(converted_paths, writer, log_file, shuffle, memory_budget)
+    else:
+        write_batches(converted_paths, writer, log_file, shuffle)
+    print(f"saved {writer.n_graphs} graphs to {output_path}")
+    manifest.mark(_BATCHES_MANIFEST_KEY, batches_fingerprint, DONE)
+    manifest.save()
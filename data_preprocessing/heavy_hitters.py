@@ -0,0 +1,115 @@
+from collections import Counter
+from typing import List, Tuple, Dict
+from zlib import crc32
+
+import numpy as np
+
+
+class CountMinSketch:
+    """Count-Min sketch over string keys.
+    Estimation never underestimates the true count, the overestimate is bounded by total / width
+    with probability depending on the depth.
+    Hashing is based on crc32, so sketches built in different processes are compatible.
+    Counts are stored in int32 to save memory and saturate at its maximum instead of overflow.
+    """
+
+    _max_count = np.iinfo(np.int32).max
+
+    def __init__(self, width: int = 2 ** 20, depth: int = 4):
+        self.width = width
+        self.depth = depth
+        self.table = np.zeros((depth, width), dtype=np.int32)
+
+    def _hash(self, keys: List[str]) -> np.ndarray:
+        encoded = [key.encode() for key in keys]
+        return np.array(
+            [[crc32(key, seed) for key in encoded] for seed in range(self.depth)], dtype=np.int64
+        ) % self.width
+
+    def update(self, counter: Dict[str, int]) -> None:
+        if len(counter) == 0:
+            return
+        keys = list(counter.keys())
+        counts = np.fromiter(counter.values(), dtype=np.int64, count=len(counter))
+        for row, indexes in enumerate(self._hash(keys)):
+            cells, inverse = np.unique(indexes, return_inverse=True)
+            updated = self.table[row, cells].astype(np.int64) + np.bincount(inverse, weights=counts).astype(np.int64)
+            self.table[row, cells] = np.minimum(updated, self._max_count)
+
+    def estimate(self, keys: List[str]) -> np.ndarray:
+        if len(keys) == 0:
+            return np.zeros(0, dtype=np.int64)
+        return self.table[np.arange(self.depth)[:, None], self._hash(keys)].min(axis=0).astype(np.int64)
+
+
+class HeavyHittersCounter:
+    """Approximate counter of most common values with memory proportional to the capacity.
+    Counts are stored in a Misra-Gries summary: when there are more than twice the capacity values,
+    the (capacity + 1)-th largest count is subtracted from all counts and non-positive ones are dropped.
+    Each count underestimates the true one at most by total / (capacity + 1),
+    so every value occurring more often is kept. Values with equal counts in the summary
+    are ordered by the estimation from count-min sketch, its width is a small multiple of the capacity,
+    so the sketch takes less memory than the summary. Without the sketch (zero width)
+    equal counts keep the order of insertion and counts of the summary are returned.
+
+    Counter supports the same update and most_common methods as collections.Counter,
+    that allows to use it as a drop-in replacement when only top of values is needed.
+    """
+
+    def __init__(self, capacity: int, sketch_width: int = None, sketch_depth: int = 4):
+        if capacity <= 0:
+            raise ValueError(f"capacity of heavy hitters counter should be positive, but got {capacity}")
+        self.capacity = capacity
+        if sketch_width is None:
+            sketch_width = 2 * capacity
+        self.sketch = CountMinSketch(sketch_width, sketch_depth) if sketch_width > 0 else None
+        self._counts = Counter()
+        self._n_distinct_lower_bound = 0
+
+    def __len__(self) -> int:
+        return max(len(self._counts), self._n_distinct_lower_bound)
+
+    def update(self, counter: Dict[str, int]) -> None:
+        self._counts.update(counter)
+        if self.sketch is not None:
+            self.sketch.update(counter)
+        if len(self._counts) > 2 * self.capacity:
+            self._compress()
+
+    def _compress(self) -> None:
+        self._n_distinct_lower_bound = max(self._n_distinct_lower_bound, len(self._counts))
+        counts = np.fromiter(self._counts.values(), dtype=np.int64, count=len(self._counts))
+        threshold = np.partition(counts, -(self.capacity + 1))[-(self.capacity + 1)]
+        self._counts = Counter({
+            value: count - threshold for value, count in self._counts.items() if count > threshold
+        })
+
+    def most_common(self, n: int = None) -> List[Tuple[str, int]]:
+        values = list(self._counts.keys())
+        counts = np.fromiter(self._counts.values(), dtype=np.int64, count=len(values))
+        estimations = self.sketch.estimate(values) if self.sketch is not None else counts
+        # sort by counts, then by estimations, both descending, stable sort keeps insertion order for full ties
+        order = sorted(range(len(values)), key=lambda i: (-counts[i], -estimations[i]))
+        if n is not None:
+            order = order[:n]
+        return [(values[i], int(estimations[i])) for i in order]
+
+
+def compare_top_values(exact: Counter, approximate: HeavyHittersCounter, n: int) -> Dict[str, float]:
+    """Compare n most common values selected by exact and approximate counters
+
+    :param exact: exact counter
+    :param approximate: approximate counter filled with the same values
+    :param n: number of most common values to compare
+    :return: dict with share of exact top values found by approximation (recall)
+    and share of occurrences covered by approximate top in relation to exact top (coverage)
+    """
+    exact_top = exact.most_common(n)
+    approximate_top = {value for value, _ in approximate.most_common(n)}
+    exact_occurrences = sum(count for _, count in exact_top)
+    approximate_occurrences = sum(exact[value] for value in approximate_top)
+    return {
+        'recall': len(approximate_top & {value for value, _ in exact_top}) / max(1, len(exact_top)),
+        'coverage': approximate_occurrences / max(1, exact_occurrences)
+    }
+
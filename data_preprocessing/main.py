@@ -5,7 +5,9 @@ from pickle import load as pickle_load
 from data_preprocessing.data_information import JavaSmallDataset, JavaMediumDataset, JavaLargeDataset, JavaTestDataset
 from data_preprocessing.dot2dgl import convert_holdout
 from data_preprocessing.preprocess_steps import download_dataset, build_dataset_asts, collect_vocabulary, upload_dataset
+from utils.columnar_format import is_columnar_dataset, load_columnar_dataset
 from utils.common import create_folder, fix_seed
+from utils.tree_operations import LEAVES_TO_ROOT, ROOT_TO_LEAVES
 
 DATA_FOLDER = 'data'
 VOCABULARY_NAME = 'vocabulary.pkl'
@@ -36,7 +38,7 @@ def main(args: Namespace) -> None:
             raise RuntimeError("download and extract data before building ast")
         if not os.path.exists(ASTMINER_PATH):
             raise RuntimeError(f"can't find astminer-cli in this location {ASTMINER_PATH}")
-        build_dataset_asts(dataset_info, dataset_path, ASTMINER_PATH)
+        build_dataset_asts(dataset_info, dataset_path, ASTMINER_PATH, args.n_jobs, args.astminer_memory)
 
     if args.collect_vocabulary:
         train_asts = os.path.join(dataset_path, f'{dataset_info.holdout_folders[0]}_asts')
@@ -44,7 +46,8 @@ def main(args: Namespace) -> None:
             raise RuntimeError("build training asts before collecting vocabulary")
         collect_vocabulary(
             train_asts, vocabulary_path, args.n_tokens, args.n_types, args.n_labels,
-            args.split_vocabulary, args.wrap_tokens, args.wrap_labels, '|'
+            args.split_vocabulary, args.wrap_tokens, args.wrap_labels, '|', args.n_jobs,
+            args.approximate_vocabulary, args.vocabulary_capacity_factor, args.vocabulary_sample
         )
 
     if args.convert:
@@ -58,10 +61,11 @@ def main(args: Namespace) -> None:
             if not os.path.exists(ast_folder):
                 raise RuntimeError(f"build asts for {holdout} before converting it to DGL format")
             output_folder = os.path.join(dataset_path, f'{holdout}_preprocessed')
-            create_folder(output_folder)
             convert_holdout(ast_folder, output_folder, args.batch_size, token_to_id, type_to_id, label_to_id,
                             args.tokens_to_leaves, args.split_vocabulary, args.max_token_len, args.max_label_len,
-                            args.wrap_tokens, args.wrap_labels, '|', True, args.n_jobs)
+                            args.wrap_tokens, args.wrap_labels, '|', True, args.n_jobs,
+                            args.streaming, args.memory_budget * 1024 ** 2, args.format,
+                            args.orientation)
 
     if args.upload:
         if not all([os.path.exists(os.path.join(dataset_path, f'{holdout}_preprocessed'))
@@ -73,7 +77,11 @@ def main(args: Namespace) -> None:
                           for holdout in dataset_info.holdout_folders]
     if all([os.path.exists(path) for path in preprocessed_paths]):
         for holdout, path in zip(dataset_info.holdout_folders, preprocessed_paths):
-            number_of_batches = len(os.listdir(path))
+            if is_columnar_dataset(path):
+                index, _ = load_columnar_dataset(path)
+                print(f"There are {index['n_graphs']} graphs in {holdout} data")
+                continue
+            number_of_batches = len([file for file in os.listdir(path) if file.endswith('.dgl')])
             print(f"There are {number_of_batches} batches in {holdout} data")
 
 
@@ -83,6 +91,8 @@ if __name__ == '__main__':
     arg_parser.add_argument('--download', action='store_true')
 
     arg_parser.add_argument('--build_ast', action='store_true')
+    arg_parser.add_argument('--astminer_memory', type=int, default=None,
+                            help="total heap in MB for concurrent astminer processes, by default 80%% of memory")
 
     arg_parser.add_argument('--collect_vocabulary', action='store_true')
     arg_parser.add_argument('--n_tokens', type=int, default=-1)
@@ -91,6 +101,12 @@ if __name__ == '__main__':
     arg_parser.add_argument('--split_vocabulary', action='store_true')
     arg_parser.add_argument('--wrap_labels', action='store_true')
     arg_parser.add_argument('--wrap_tokens', action='store_true')
+    arg_parser.add_argument('--approximate_vocabulary', action='store_true',
+                            help="count most common values with memory bounded by vocabulary size")
+    arg_parser.add_argument('--vocabulary_capacity_factor', type=int, default=4,
+                            help="number of values kept by approximate counter in relation to vocabulary size")
+    arg_parser.add_argument('--vocabulary_sample', type=int, default=50,
+                            help="number of projects to compare approximate vocabulary with exact one")
 
     arg_parser.add_argument('--convert', action='store_true')
     arg_parser.add_argument('--n_jobs', type=int, default=-1)
@@ -98,6 +114,12 @@ if __name__ == '__main__':
     arg_parser.add_argument('--tokens_to_leaves', action='store_true')
     arg_parser.add_argument('--max_token_len', type=int, default=-1)
     arg_parser.add_argument('--max_label_len', type=int, default=-1)
+    arg_parser.add_argument('--streaming', action='store_true', help="shuffle and save batches with bounded memory")
+    arg_parser.add_argument('--memory_budget', type=int, default=4096, help="memory budget for streaming in MB")
+    arg_parser.add_argument('--format', choices=['dgl', 'columnar'], default='dgl',
+                            help="batches of DGL graphs or memory mappable columnar arrays")
+    arg_parser.add_argument('--orientation', choices=[LEAVES_TO_ROOT, ROOT_TO_LEAVES], default=LEAVES_TO_ROOT,
+                            help="direction of edges in saved trees")
 
     arg_parser.add_argument('--upload', action='store_true')
     arg_parser.add_argument('--store', choices=['s3', 'drive'], default='drive')
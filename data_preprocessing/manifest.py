@@ -0,0 +1,128 @@
+import json
+import os
+from hashlib import blake2b
+from pickle import dumps as pickle_dumps
+from threading import Lock
+from time import time
+from typing import Any, Dict, Iterable, List, Optional
+
+_HASH_BLOCK_SIZE = 1024 * 1024
+_MANIFEST_VERSION = 1
+
+DONE = 'done'
+FAILED = 'failed'
+
+
+def hash_files(paths: Iterable[str], root: str = None) -> str:
+    """Hash content and names of files, names are taken relative to the root if it is passed"""
+    hasher = blake2b(digest_size=16)
+    for path in paths:
+        hasher.update((os.path.relpath(path, root) if root is not None else path).encode())
+        with open(path, 'rb') as file:
+            for block in iter(lambda: file.read(_HASH_BLOCK_SIZE), b''):
+                hasher.update(block)
+    return hasher.hexdigest()
+
+
+def list_folder_files(folder_path: str, exclude: Iterable[str] = ()) -> List[str]:
+    """Recursively list files in the folder in a deterministic order, skipping files with excluded names"""
+    exclude = set(exclude)
+    files = []
+    for root, dirs, names in os.walk(folder_path):
+        dirs.sort()
+        files += [os.path.join(root, name) for name in sorted(names) if name not in exclude]
+    return files
+
+
+def hash_folder(folder_path: str, exclude: Iterable[str] = ()) -> str:
+    return hash_files(list_folder_files(folder_path, exclude), folder_path)
+
+
+def get_folder_stats(folder_path: str, exclude: Iterable[str] = ()) -> Dict[str, List[int]]:
+    """Size and modification time in nanoseconds of each file in the folder, keyed by path relative to the folder"""
+    stats = {}
+    for path in list_folder_files(folder_path, exclude):
+        file_stat = os.stat(path)
+        stats[os.path.relpath(path, folder_path)] = [file_stat.st_size, file_stat.st_mtime_ns]
+    return stats
+
+
+def hash_object(obj: Any) -> str:
+    """Hash any picklable object, e.g. vocabulary or parameters of the step"""
+    return blake2b(pickle_dumps(obj), digest_size=16).hexdigest()
+
+
+class Manifest:
+    """Manifest of a preprocessing step.
+    For each processed item it stores a fingerprint of the inputs, that were used, and the status of processing.
+    The item should be processed again only if it failed or its fingerprint has changed.
+    Hashes of input folders are cached with sizes and modification times of their files,
+    so content of unchanged folders isn't read again.
+    Manifest is stored in a json file, that is replaced atomically, so an interrupted run
+    can be resumed from the last save. To avoid rewriting the file after each item,
+    saving happens no more often than once per save interval; call save at the end of the step.
+    """
+
+    def __init__(self, path: str, save_interval: float = 10.):
+        self.path = path
+        self.save_interval = save_interval
+        self._entries = {}
+        self._folder_hashes = {}
+        self._last_save = time()
+        self._lock = Lock()
+        if os.path.exists(path):
+            with open(path, 'r') as manifest_file:
+                content = json.load(manifest_file)
+            if content.get('version') == _MANIFEST_VERSION:
+                self._entries = content['entries']
+                self._folder_hashes = content.get('folder_hashes', {})
+
+    def is_done(self, key: str, fingerprint: str) -> bool:
+        entry = self._entries.get(key)
+        return entry is not None and entry['status'] == DONE and entry['fingerprint'] == fingerprint
+
+    def mark(self, key: str, fingerprint: str, status: str) -> None:
+        with self._lock:
+            self._entries[key] = {'fingerprint': fingerprint, 'status': status}
+            if time() - self._last_save >= self.save_interval:
+                self._save()
+
+    def get_folder_hash(self, key: str, folder_stats: Dict[str, List[int]]) -> Optional[str]:
+        """Cached hash of the item folder, None if files of the folder have changed since it was hashed"""
+        cached = self._folder_hashes.get(key)
+        if cached is None or cached['stats'] != folder_stats:
+            return None
+        return cached['hash']
+
+    def set_folder_hash(self, key: str, folder_stats: Dict[str, List[int]], folder_hash: str) -> None:
+        with self._lock:
+            self._folder_hashes[key] = {'stats': folder_stats, 'hash': folder_hash}
+
+    def hash_folder(self, key: str, folder_path: str, exclude: Iterable[str] = ()) -> str:
+        """Hash of the item folder, its content is read only if size or modification time of any file changed"""
+        folder_stats = get_folder_stats(folder_path, exclude)
+        folder_hash = self.get_folder_hash(key, folder_stats)
+        if folder_hash is None:
+            folder_hash = hash_folder(folder_path, exclude)
+            self.set_folder_hash(key, folder_stats, folder_hash)
+        return folder_hash
+
+    def retain(self, keys: Iterable[str]) -> None:
+        """Remove entries of items that are not presented anymore"""
+        keys = set(keys)
+        with self._lock:
+            self._entries = {key: entry for key, entry in self._entries.items() if key in keys}
+            self._folder_hashes = {key: cached for key, cached in self._folder_hashes.items() if key in keys}
+
+    def save(self) -> None:
+        with self._lock:
+            self._save()
+
+    def _save(self) -> None:
+        tmp_path = f'{self.path}.tmp'
+        with open(tmp_path, 'w') as manifest_file:
+            json.dump({
+                'version': _MANIFEST_VERSION, 'entries': self._entries, 'folder_hashes': self._folder_hashes
+            }, manifest_file)
+        os.replace(tmp_path, self.path)
+        self._last_save = time()
@@ -1,18 +1,37 @@
 import os
 from collections import Counter
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from itertools import chain
+from multiprocessing import Pool, cpu_count
 from pickle import dump as pickle_dump
+from shutil import rmtree
 from subprocess import run as subprocess_run
-from typing import List
+from threading import Condition
+from time import time
+from typing import List, Tuple, Dict, Union
 
+import numpy as np
 import pandas as pd
 from requests import get
 from tqdm.auto import tqdm
 
 from data_information import IDatasetInfo
 from data_preprocessing.drive_workers import upload_file as drive_upload_file
+from data_preprocessing.heavy_hitters import HeavyHittersCounter, compare_top_values
+from data_preprocessing.manifest import (
+    Manifest, DONE, FAILED, hash_files, hash_object, list_folder_files
+)
 from data_preprocessing.s3_worker import upload_file as s3_upload_file
 from utils.common import extract_tar_gz, create_folder, UNK, PAD, SOS, EOS
 
+_VOCABULARY_COLUMNS = ['token', 'type', 'label']
+
+# heap sizes of astminer JVM in MB
+_ASTMINER_BASE_HEAP = 1024
+_ASTMINER_MIN_HEAP = 2 * 1024
+_ASTMINER_MAX_HEAP = 30 * 1024
+_ASTMINER_HEAP_PER_SOURCE_BYTE = 20
+
 
 def _download_dataset_archive(dataset_info: IDatasetInfo, dataset_path: str, block_size: int = 1024) -> str:
     r = get(dataset_info.url, stream=True)
@@ -37,8 +56,15 @@ def download_dataset(dataset_info: IDatasetInfo, dataset_path: str) -> None:
     os.remove(tar_file_path)
 
 
-def build_asts(input_path: str, output_path: str, astminer_path: str, astminer_params: List[str]) -> bool:
-    completed_process = subprocess_run(['java', '-Xmx30g', '-jar', astminer_path, 'parse', '--project',
+def build_asts(
+        input_path: str, output_path: str, astminer_path: str, astminer_params: List[str], heap_size: int = 30 * 1024
+) -> bool:
+    """Run astminer for the project
+
+    :param heap_size: maximum heap size of JVM in MB
+    :return: True if asts were built successfully
+    """
+    completed_process = subprocess_run(['java', f'-Xmx{heap_size}m', '-jar', astminer_path, 'parse', '--project',
                                         input_path, '--output', output_path, *astminer_params])
     if completed_process.returncode != 0:
         print(f"can't build ASTs for project {input_path}, failed with:\n{completed_process.stdout}")
@@ -46,44 +72,172 @@ def build_asts(input_path: str, output_path: str, astminer_path: str, astminer_p
     return True
 
 
-def build_projects_asts(projects_folder: str, output_folder: str, astminer_path: str, astminer_params: List[str]) -> int:
+def _get_folder_size(folder_path: str) -> int:
+    return sum(os.path.getsize(path) for path in list_folder_files(folder_path))
+
+
+def _get_total_memory() -> int:
+    """Total physical memory in MB"""
+    return os.sysconf('SC_PAGE_SIZE') * os.sysconf('SC_PHYS_PAGES') // 1024 ** 2
+
+
+def _estimate_astminer_heap(project_size: int, memory_budget: int) -> int:
+    """Estimate heap size in MB for parsing the project with astminer, it is clamped by the memory budget"""
+    heap_size = _ASTMINER_BASE_HEAP + _ASTMINER_HEAP_PER_SOURCE_BYTE * project_size // 1024 ** 2
+    return int(min(max(heap_size, _ASTMINER_MIN_HEAP), _ASTMINER_MAX_HEAP, memory_budget))
+
+
+class _MemoryBudget:
+    """Admission controller: block until the requested amount of memory is available"""
+
+    def __init__(self, total: int):
+        self.available = total
+        self._condition = Condition()
+
+    def acquire(self, amount: int) -> None:
+        with self._condition:
+            self._condition.wait_for(lambda: self.available >= amount)
+            self.available -= amount
+
+    def release(self, amount: int) -> None:
+        with self._condition:
+            self.available += amount
+            self._condition.notify_all()
+
+
+def build_projects_asts(
+        projects_folder: str, output_folder: str, astminer_path: str, astminer_params: List[str],
+        manifest: Manifest = None, n_jobs: int = -1, memory_budget: int = None, report_path: str = None
+) -> int:
+    """Build asts for each project in the folder running several astminer processes concurrently.
+    Heap of each process is estimated from the size of the project sources, a process is launched
+    only when its heap fits into the memory budget together with heaps of already running processes.
+    Projects are scheduled from the largest to the smallest, so the largest one doesn't finish the build alone.
+    If manifest is passed, projects with unchanged sources, astminer and its params,
+    that were successfully built before, are skipped.
+
+    :param n_jobs: maximum number of concurrent astminer processes, -1 corresponds to the number of cpu
+    :param memory_budget: total memory in MB for all astminer processes, by default 80% of physical memory
+    :param report_path: path to csv file for per-project report with heap size, elapsed time, and status
+    :return: number of projects with successfully built asts
+    """
     print(f"build asts for projects in {projects_folder} folder")
+    n_jobs = cpu_count() if n_jobs == -1 else n_jobs
+    memory_budget = int(0.8 * _get_total_memory()) if memory_budget is None else memory_budget
+    budget = _MemoryBudget(memory_budget)
     projects = os.listdir(projects_folder)
-    successful_builds = 0
-    for project in tqdm(projects):
-        print(f"build asts for {project} project")
+    projects_sizes = {project: _get_folder_size(os.path.join(projects_folder, project)) for project in projects}
+    astminer_fingerprint = hash_files([astminer_path], os.path.dirname(astminer_path))
+
+    def build_project(project: str) -> Dict:
         project_path = os.path.join(projects_folder, project)
         output_path = os.path.join(output_folder, project)
-        create_folder(output_path)
-        if build_asts(project_path, output_path, astminer_path, astminer_params):
-            successful_builds += 1
-    print(f"create asts for {successful_builds} out of {len(projects)} projects")
+        fingerprint = None
+        if manifest is not None:
+            # content of sources is hashed again only if their sizes or modification times changed
+            sources_hash = manifest.hash_folder(project, project_path)
+            fingerprint = hash_object((sources_hash, astminer_fingerprint, astminer_params))
+            if manifest.is_done(project, fingerprint) and os.path.exists(output_path):
+                return {'project': project, 'heap_size': 0, 'time': 0., 'status': 'skipped'}
+        heap_size = _estimate_astminer_heap(projects_sizes[project], memory_budget)
+        budget.acquire(heap_size)
+        start_time = time()
+        try:
+            create_folder(output_path)
+            is_built = build_asts(project_path, output_path, astminer_path, astminer_params, heap_size)
+        except Exception as err:
+            print(f"can't build ASTs for project {project_path}, failed with:\n{err}")
+            is_built = False
+        finally:
+            budget.release(heap_size)
+        if manifest is not None:
+            manifest.mark(project, fingerprint, DONE if is_built else FAILED)
+        return {
+            'project': project, 'heap_size': heap_size, 'time': time() - start_time,
+            'status': DONE if is_built else FAILED
+        }
+
+    start_time = time()
+    with ThreadPoolExecutor(n_jobs) as executor:
+        futures = [
+            executor.submit(build_project, project)
+            for project in sorted(projects, key=lambda p: projects_sizes[p], reverse=True)
+        ]
+        report = [future.result() for future in tqdm(as_completed(futures), total=len(futures))]
+    report = pd.DataFrame(report, columns=['project', 'heap_size', 'time', 'status'])
+    report['size'] = report['project'].map(projects_sizes)
+    if report_path is not None:
+        report.sort_values('time', ascending=False).to_csv(report_path, index=False)
+
+    successful_builds = int((report['status'] != FAILED).sum())
+    print(f"create asts for {successful_builds} out of {len(projects)} projects "
+          f"({(report['status'] == 'skipped').sum()} are up to date) in {time() - start_time:.0f}s")
     return successful_builds
 
 
-def build_dataset_asts(dataset_info: IDatasetInfo, dataset_path: str, astminer_path: str) -> None:
+def build_dataset_asts(
+        dataset_info: IDatasetInfo, dataset_path: str, astminer_path: str, n_jobs: int = -1, memory_budget: int = None
+) -> None:
     for holdout in dataset_info.holdout_folders:
         holdout_folder = os.path.join(dataset_path, holdout)
         output_folder = os.path.join(dataset_path, f'{holdout}_asts')
-        create_folder(output_folder)
-        build_projects_asts(holdout_folder, output_folder, astminer_path, dataset_info.astminer_params)
+        create_folder(output_folder, is_clean=False)
+        manifest = Manifest(os.path.join(dataset_path, f'{holdout}_asts_manifest.json'))
+        # remove asts of projects that are not presented in the holdout anymore
+        projects = set(os.listdir(holdout_folder))
+        for project in os.listdir(output_folder):
+            if project not in projects:
+                rmtree(os.path.join(output_folder, project))
+        manifest.retain(projects)
+        try:
+            build_projects_asts(
+                holdout_folder, output_folder, astminer_path, dataset_info.astminer_params, manifest, n_jobs,
+                memory_budget, os.path.join(dataset_path, f'{holdout}_asts_report.csv')
+            )
+        finally:
+            manifest.save()
 
 
 def _update_vocab_counter(counter: Counter, values: List, is_split: bool = False, delimiter: str = '|') -> Counter:
     values = filter(lambda t: isinstance(t, str), values)
     if is_split:
-        _values = map(lambda t: t.split(delimiter), values)
-        values = []
-        for _sv in _values:
-            values += _sv
+        values = chain.from_iterable(map(lambda t: t.split(delimiter), values))
     counter.update(values)
     return counter
 
 
+def _count_project_vocabulary(args: Tuple[str, bool, str]) -> Dict[str, Union[Counter, Exception]]:
+    """Count tokens, types, and labels of the project reading its description once
+
+    :param args: path to the description, is split values or not and the delimiter
+    :return: dict with counter or exception for each column
+    """
+    description_path, is_split, delimiter = args
+    try:
+        project_description = pd.read_csv(description_path)
+    except Exception as err:
+        return {column: err for column in _VOCABULARY_COLUMNS}
+    counters = {}
+    for column in _VOCABULARY_COLUMNS:
+        try:
+            counters[column] = _update_vocab_counter(Counter(), project_description[column], is_split, delimiter)
+        except Exception as err:
+            counters[column] = err
+    return counters
+
+
 def collect_vocabulary(
         train_path: str, vocabulary_path: str, n_tokens: int = -1, n_types: int = -1, n_labels: int = -1,
-        is_split: bool = False, wrap_tokens: bool = False, wrap_labels: bool = False, delimiter: str = '|'
+        is_split: bool = False, wrap_tokens: bool = False, wrap_labels: bool = False, delimiter: str = '|',
+        n_jobs: int = -1, approximate: bool = False, capacity_factor: int = 4, n_sample_projects: int = 50
 ):
+    """Collect vocabulary of tokens, types, and labels from training holdout and save it to the disk
+
+    :param approximate: if True, then count values with bounded memory for columns with fixed vocabulary size
+    :param capacity_factor: number of values kept by the approximate counter in relation to vocabulary size
+    :param n_sample_projects: number of projects to compare approximate vocabulary with exact one,
+        vocabulary size and capacity of the approximate counter on them are scaled down to their share of projects
+    """
     token_to_id = {UNK: 0, PAD: 1}
     type_to_id = {UNK: 0, PAD: 1}
     label_to_id = {UNK: 0, PAD: 1}
@@ -97,21 +251,52 @@ def collect_vocabulary(
 
     projects = os.listdir(train_path)
     print("collect vocabulary from training holdout")
+    counters = {column: Counter() for column in _VOCABULARY_COLUMNS}
+    sample_counters = {}
+    sample_n_max = {}
+    if approximate:
+        sample_projects = set(np.random.permutation(len(projects))[:n_sample_projects])
+        sample_share = len(sample_projects) / max(1, len(projects))
+        for column, n_max in zip(_VOCABULARY_COLUMNS, [n_tokens, n_types, n_labels]):
+            if n_max == -1:
+                continue
+            counters[column] = HeavyHittersCounter(capacity_factor * n_max)
+            # with the full capacity sample counter would never compress values, so it's scaled to the sample,
+            # the sketch only orders equal counts, so it isn't built for the sample counter
+            sample_n_max[column] = max(1, int(round(n_max * sample_share)))
+            sample_counters[column] = (
+                Counter(), HeavyHittersCounter(capacity_factor * sample_n_max[column], sketch_width=0)
+            )
+    n_jobs = cpu_count() if n_jobs == -1 else n_jobs
+    with Pool(n_jobs) as pool:
+        results = pool.imap(_count_project_vocabulary, [
+            (os.path.join(train_path, project, 'java', 'description.csv'), is_split, delimiter) for project in projects
+        ])
+        # merging in the order of projects keeps the order of equally common values
+        for project_id, (project, project_counters) in tqdm(enumerate(zip(projects, results)), total=len(projects)):
+            for column, project_counter in project_counters.items():
+                if isinstance(project_counter, Exception):
+                    print(f"failed to read {column} description for {project} project\n"
+                          f"error: {project_counter}")
+                    continue
+                counters[column].update(project_counter)
+                if column in sample_counters and project_id in sample_projects:
+                    for sample_counter in sample_counters[column]:
+                        sample_counter.update(project_counter)
+
+    for column, n_max in sample_n_max.items():
+        comparison = compare_top_values(*sample_counters[column], n_max)
+        print(f"approximate top {n_max} {column} on {len(sample_projects)} sampled projects: "
+              f"recall of exact top {comparison['recall']:.4f}, coverage of occurrences {comparison['coverage']:.4f}")
+
     for id_dict, n_max, column in [
         (token_to_id, n_tokens, 'token'), (type_to_id, n_types, 'type'), (label_to_id, n_labels, 'label')
     ]:
-        print(f"collecting {column} vocabulary...")
-        counter = Counter()
-        for project in tqdm(projects):
-            try:
-                project_description = pd.read_csv(os.path.join(train_path, project, 'java', 'description.csv'))
-                counter = _update_vocab_counter(counter, project_description[column], is_split, delimiter)
-            except Exception as err:
-                print(f"failed to read description for {project} project\n"
-                      f"error: {err}")
+        counter = counters[column]
         if n_max == -1:
             n_max = len(counter)
-        print(f"found {len(counter)} {column}, use {n_max} most common")
+        print(f"found {'at least ' if isinstance(counter, HeavyHittersCounter) else ''}{len(counter)} {column}, "
+              f"use {n_max} most common")
         st_index = len(id_dict)
         id_dict.update(
             [(token, num + st_index) for num, (token, _) in enumerate(counter.most_common(n_max))]
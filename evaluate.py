@@ -2,12 +2,12 @@ from argparse import ArgumentParser
 from json import load as json_load
 from typing import Dict
 
-import torch
 import torch.nn as nn
 
 from data_loaders import TreeDGLDataset
 from model.tree2seq import Tree2Seq
-from trainer import evaluate_on_dataset
+from trainer import create_evaluation_loader, evaluate_on_dataset
+from utils.checkpoint_writer import load_checkpoint
 from utils.common import fix_seed, get_device, PAD
 
 
@@ -16,21 +16,28 @@ def evaluate(params: Dict) -> None:
     device = get_device()
     print(f"using {device} device")
 
-    checkpoint = torch.load(params['model'], map_location=device)
+    checkpoint = load_checkpoint(params['model'], map_location=device)
 
     print('model initializing...')
     # create model
     model = Tree2Seq(**checkpoint['configuration']).to(device)
     model.load_state_dict(checkpoint['state_dict'])
 
-    evaluation_set = TreeDGLDataset(params['dataset'], params['batch_size'], device, True)
+    evaluation_set = TreeDGLDataset(
+        params['dataset'], params['batch_size'], device, True,
+        max_batch_nodes=params.get('max_batch_nodes', -1), label_pad_index=model.label_to_id[PAD]
+    )
 
     # define loss function
     criterion = nn.CrossEntropyLoss(ignore_index=model.label_to_id[PAD]).to(device)
 
     # evaluation loop
     print("ok, let's evaluate it")
-    eval_epoch_info = evaluate_on_dataset(evaluation_set, model, criterion)
+    loader = create_evaluation_loader(evaluation_set, params.get('n_workers', 0), params.get('prefetch_depth', 2))
+    try:
+        eval_epoch_info = evaluate_on_dataset(loader, model, criterion)
+    finally:
+        loader.close()
 
     print(eval_epoch_info.get_state_dict())
 
@@ -8,6 +8,7 @@ from dgl.data.utils import load_graphs
 from data_preprocessing.dot2dgl import convert_project
 from data_preprocessing.preprocess_steps import build_asts
 from model.tree2seq import Tree2Seq
+from utils.checkpoint_writer import load_checkpoint
 from utils.common import fix_seed, get_device, create_folder, EOS
 
 TMP_FOLDER = '.tmp'
@@ -23,7 +24,7 @@ def interactive(path_to_function: str, path_to_model: str):
 
     # load model
     print("loading model...")
-    checkpoint = torch.load(path_to_model, map_location=device)
+    checkpoint = load_checkpoint(path_to_model, map_location=device)
 
     model = Tree2Seq(**checkpoint['configuration']).to(device)
     model.load_state_dict(checkpoint['state_dict'])
@@ -1,6 +1,6 @@
 from typing import Dict
 
-from .logger import AbstractLogger, PrintLogger
+from .logger import AbstractLogger, PrintLogger, SilentLogger
 from .file_logger import FileLogger
 from .wandb_logger import WandBLogger
 
@@ -11,8 +11,10 @@ known_loggers: Dict[str, AbstractLogger.__class__] = {
 }
 
 
-def create_logger(logger_name: str, log_dir: str, checkpoints_dir: str, config: Dict) -> AbstractLogger:
+def create_logger(logger_name: str, log_dir: str, checkpoints_dir: str, config: Dict, rank: int = 0) -> AbstractLogger:
     if logger_name not in known_loggers.keys():
         raise ValueError(f"Unknown logger: {logger_name}, use one of {known_loggers.keys()}")
+    if rank != 0:
+        return SilentLogger(log_dir, checkpoints_dir, config)
     logger_class = known_loggers[logger_name]
     return logger_class(log_dir, checkpoints_dir, config)
@@ -18,7 +18,7 @@ class FileLogger(AbstractLogger):
         with open(self.log_file, 'a') as logging_file:
             logging_file.write(self._create_log_message(state_dict, batch_id, is_train))
 
-    def save_model(self, output_name: str, configuration: Dict) -> str:
+    def save_model(self, output_name: str, configuration: Dict, score: float = None) -> str:
         saving_path = join_path(self.checkpoints_dir, output_name)
-        self._save_conf_to_disk(saving_path, configuration)
+        self._save_conf_to_disk(saving_path, configuration, score)
         return saving_path
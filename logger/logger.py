@@ -1,9 +1,8 @@
 from datetime import datetime
-from os.path import join as join_path
+from os.path import dirname, join as join_path
 from typing import Dict
 
-import torch
-
+from utils.checkpoint_writer import CheckpointWriter, VOCABULARY_NAME, split_vocabulary
 from utils.common import create_folder
 
 
@@ -21,6 +20,7 @@ class AbstractLogger:
         self.checkpoints_dir = join_path(checkpoints_dir, self.timestamp)
         create_folder(self.checkpoints_dir)
         self.add_to_saving('config', config)
+        self._checkpoint_writer = CheckpointWriter(config.get('keep_checkpoints', -1))
 
     def _create_log_message(self, state_dict: Dict, batch_id: int, is_train: bool) -> str:
         log_info = f"{'train' if is_train else 'validation'} {batch_id}:\n" + \
@@ -30,14 +30,28 @@ class AbstractLogger:
             log_info = self._dividing_line + log_info
         return log_info
 
-    def _save_conf_to_disk(self, output_path: str, configuration: Dict):
+    def _save_conf_to_disk(self, output_path: str, configuration: Dict, score: float = None):
+        """Save checkpoint in background, vocabularies of model are stored once per folder,
+        use utils.checkpoint_writer.load_checkpoint to load checkpoint with them
+        """
         configuration.update(self._additional_save_info)
-        torch.save(configuration, output_path)
+        configuration, vocabulary = split_vocabulary(configuration)
+        if len(vocabulary) > 0:
+            self._checkpoint_writer.save_once(vocabulary, join_path(dirname(output_path), VOCABULARY_NAME))
+        self._checkpoint_writer.save(configuration, output_path, score)
+
+    def set_score(self, output_name: str, score: float) -> None:
+        """Set score of the saved checkpoint, e.g. when it's evaluated after saving"""
+        self._checkpoint_writer.set_score(join_path(self.checkpoints_dir, output_name), score)
+
+    def close(self) -> None:
+        """Wait until all checkpoints are written"""
+        self._checkpoint_writer.close()
 
     def log(self, state_dict: Dict, batch_id: int, is_train: bool = True) -> None:
         raise NotImplementedError
 
-    def save_model(self, output_name: str, configuration: Dict) -> str:
+    def save_model(self, output_name: str, configuration: Dict, score: float = None) -> str:
         raise NotImplementedError
 
 
@@ -50,7 +64,30 @@ class PrintLogger(AbstractLogger):
     def log(self, state_dict: Dict, batch_id: int, is_train: bool = True) -> None:
         print(self._create_log_message(state_dict, batch_id, is_train))
 
-    def save_model(self, output_name: str, configuration: Dict) -> str:
+    def save_model(self, output_name: str, configuration: Dict, score: float = None) -> str:
         saving_path = join_path(self.checkpoints_dir, output_name)
-        self._save_conf_to_disk(saving_path, configuration)
+        self._save_conf_to_disk(saving_path, configuration, score)
         return saving_path
+
+
+class SilentLogger(AbstractLogger):
+    """Logger for non-main processes of distributed training: metrics are logged
+    and checkpoints are saved only by the main process, that has the same model.
+    """
+    name = 'silent'
+
+    def __init__(self, log_dir: str, checkpoints_dir: str, config: Dict):
+        # don't create folders, since the main process does it
+        pass
+
+    def log(self, state_dict: Dict, batch_id: int, is_train: bool = True) -> None:
+        pass
+
+    def save_model(self, output_name: str, configuration: Dict, score: float = None) -> str:
+        return ''
+
+    def set_score(self, output_name: str, score: float) -> None:
+        pass
+
+    def close(self) -> None:
+        pass
@@ -13,6 +13,8 @@ class WandBLogger(AbstractLogger):
         super().__init__(log_dir, checkpoints_dir, config)
         resume = config.get('resume_wandb_id', False)
         wandb.init(project=config['wandb_project'], config=config, resume=resume)
+        # checkpoints are uploaded after they are written in background
+        self._checkpoint_writer.on_saved = wandb.save
 
     def log(self, state_dict: Dict, batch_id: int, is_train: bool = True) -> None:
         group = 'train' if is_train else 'validation'
@@ -20,8 +22,10 @@ class WandBLogger(AbstractLogger):
         state_dict['batch_id'] = batch_id
         wandb.log(state_dict)
 
-    def save_model(self, output_name: str, configuration: Dict) -> str:
+    def save_model(self, output_name: str, configuration: Dict, score: float = None) -> str:
         saving_path = join_path(wandb.run.dir, output_name)
-        self._save_conf_to_disk(saving_path, configuration)
-        wandb.save(saving_path)
+        self._save_conf_to_disk(saving_path, configuration, score)
         return saving_path
+
+    def set_score(self, output_name: str, score: float) -> None:
+        self._checkpoint_writer.set_score(join_path(wandb.run.dir, output_name), score)
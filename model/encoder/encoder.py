@@ -4,6 +4,7 @@ import dgl
 import torch
 from torch import nn
 
+from utils.level_schedule import LevelSchedule
 from utils.tree_operations import get_root_indexes
 
 
@@ -16,7 +17,8 @@ class ITreeEncoder(nn.Module):
         self.h_emb = h_emb
         self.h_enc = h_enc
 
-    def forward(self, graph: dgl.DGLGraph) -> torch.Tensor:
+    def forward(self, graph: dgl.DGLGraph, schedule: LevelSchedule = None) -> torch.Tensor:
+        """Encode nodes of batched graph, the level schedule is passed if the batch is loaded with it"""
         raise NotImplementedError
 
 
@@ -35,11 +37,13 @@ class Encoder(nn.Module):
             raise ValueError(f"unknown encoder: {self.encoder_name}")
         self.encoder = self._known_tree_encoders[self.encoder_name](self.h_emb, self.h_enc, **params)
 
-    def forward(self, graph: dgl.DGLGraph) -> Tuple[Union[torch.Tensor, Tuple[torch.Tensor, ...]], torch.LongTensor]:
+    def forward(
+            self, graph: dgl.DGLGraph, schedule: LevelSchedule = None
+    ) -> Tuple[Union[torch.Tensor, Tuple[torch.Tensor, ...]], torch.LongTensor]:
         """Produce new states for each node in given graph"""
         root_indexes = get_root_indexes(graph.batch_num_nodes)
         root_indexes = graph.ndata['x'].new_tensor(root_indexes, dtype=torch.long, requires_grad=False)
-        return self.encoder(graph), root_indexes
+        return self.encoder(graph, schedule), root_indexes
 
     @staticmethod
     def register_tree_encoder(tree_encoder: ITreeEncoder):
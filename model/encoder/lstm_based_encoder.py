@@ -1,4 +1,4 @@
-from typing import Dict, Union, Tuple
+from typing import Union, Tuple
 
 import dgl
 import torch
@@ -6,10 +6,15 @@ from torch import nn
 
 from model.encoder import ITreeEncoder
 from model.encoder.treelstm.treelstm import ChildSumTreeLSTMCell, TreeLSTM
-from utils.tree_operations import get_root_indexes
+from utils.level_schedule import LevelSchedule, get_level_schedule
 
 
 class DfsLSTM(ITreeEncoder):
+    """Propagate states from root to leaves: state of each node is computed by LSTM cell
+    from its embedding and the state of its parent.
+    Batched graph is directed from leaves to root, so instead of building the reversed graph
+    parents and depths of nodes are taken from the level schedule, that is built once for the batch.
+    """
 
     name = "DfsLSTM"
 
@@ -18,42 +23,23 @@ class DfsLSTM(ITreeEncoder):
         self.lstm = nn.LSTMCell(self.h_emb, self.h_enc)
         self.dropout = nn.Dropout(dropout)
 
-    def message_func(self, edges: dgl.EdgeBatch) -> Dict:
-        # [bs; h size]
-        h = edges.src['h']
-        c = edges.src['c']
-        # [bs; x size]
-        x = edges.dst['x']
-        h_cur, c_cur = self.lstm(x, (h, c))
-        return {
-            'h': h_cur,
-            'c': c_cur
-        }
-
-    @staticmethod
-    def reduce_func(nodes: dgl.NodeBatch) -> Dict:
-        return {
-            'h': nodes.mailbox['h'].squeeze(1),
-            'c': nodes.mailbox['c'].squeeze(1)
-        }
-
-    def forward(self, graph: dgl.DGLGraph) -> Union[torch.Tensor, Tuple[torch.Tensor, ...]]:
-        graph.ndata['x'] = self.dropout(graph.ndata['x'])
-        root_indexes = graph.ndata['x'].new_tensor(
-            get_root_indexes(graph.batch_num_nodes), dtype=torch.long, requires_grad=False
-        )
-        graph.ndata['h'] = graph.ndata['x'].new_zeros((graph.number_of_nodes(), self.h_enc))
-        graph.ndata['c'] = graph.ndata['x'].new_zeros((graph.number_of_nodes(), self.h_enc))
-        graph.ndata['h'][root_indexes], graph.ndata['c'][root_indexes] = \
-            self.lstm(graph.ndata['x'][root_indexes])
+    def forward(
+            self, graph: dgl.DGLGraph, schedule: LevelSchedule = None
+    ) -> Union[torch.Tensor, Tuple[torch.Tensor, ...]]:
+        x = self.dropout(graph.ndata['x'])
+        schedule = get_level_schedule(graph, x.device, schedule)
+        parent = schedule.parents
+        h = x.new_zeros((graph.number_of_nodes(), self.h_enc))
+        c = x.new_zeros((graph.number_of_nodes(), self.h_enc))
 
-        dgl.prop_edges_dfs(
-            graph, root_indexes, True,
-            message_func=self.message_func,
-            reduce_func=self.reduce_func
-        )
+        # the first depth contains roots, each next depth contains children of the previous one
+        for depth, nodes in enumerate(schedule.depth_levels):
+            if depth == 0:
+                h[nodes], c[nodes] = self.lstm(x[nodes])
+            else:
+                h[nodes], c[nodes] = self.lstm(x[nodes], (h[parent[nodes]], c[parent[nodes]]))
 
-        return graph.ndata.pop('h'), graph.ndata.pop('c')
+        return h, c
 
 
 class TwoOrderLSTM(ITreeEncoder):
@@ -73,9 +59,13 @@ class TwoOrderLSTM(ITreeEncoder):
         self.linear_h = nn.Linear(self.h_enc, self.h_enc)
         self.linear_c = nn.Linear(self.h_enc, self.h_enc)
 
-    def forward(self, graph: dgl.DGLGraph) -> Union[torch.Tensor, Tuple[torch.Tensor, ...]]:
-        h_tree_lstm, c_tree_lstm = self.tree_lstm(graph)
-        h_dfs_lstm, c_dfs_lstm = self.dfs_lstm(graph)
+    def forward(
+            self, graph: dgl.DGLGraph, schedule: LevelSchedule = None
+    ) -> Union[torch.Tensor, Tuple[torch.Tensor, ...]]:
+        # both encoders use the same schedule, so it's built once if the batch is loaded without it
+        schedule = get_level_schedule(graph, graph.ndata['x'].device, schedule)
+        h_tree_lstm, c_tree_lstm = self.tree_lstm(graph, schedule)
+        h_dfs_lstm, c_dfs_lstm = self.dfs_lstm(graph, schedule)
 
         h = self.blend_alpha[0] * h_tree_lstm + (1 - self.blend_alpha[0]) * h_dfs_lstm
         c = self.blend_alpha[1] * c_tree_lstm + (1 - self.blend_alpha[1]) * c_dfs_lstm
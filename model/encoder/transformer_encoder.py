@@ -5,6 +5,7 @@ import torch
 import torch.nn as nn
 
 from model.encoder import ITreeEncoder
+from utils.level_schedule import LevelSchedule
 
 
 class TransformerEncoder(ITreeEncoder):
@@ -46,10 +47,11 @@ class TransformerEncoder(ITreeEncoder):
         h = self.norm(nodes.data['x'] + nodes.data['h'])
         return {'h': h}
 
-    def forward(self, graph: dgl.DGLGraph) -> torch.Tensor:
+    def forward(self, graph: dgl.DGLGraph, schedule: LevelSchedule = None) -> torch.Tensor:
         """Apply transformer encoder
 
         :param graph: batched dgl graph
+        :param schedule: unused, nodes are propagated by DGL in topological order
         :return: encoded nodes [number of nodes, hidden size]
         """
         graph.ndata['h'] = graph.ndata['x'].new_zeros((graph.number_of_nodes(), self.h_enc))
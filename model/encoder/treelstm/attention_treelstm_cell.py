@@ -1,6 +1,5 @@
 from typing import Dict
 
-import dgl
 import torch
 from torch import nn
 
@@ -22,29 +21,27 @@ class LuongAttentionTreeLSTMCell(ITreeLSTMCell):
 
         self.W = nn.Linear(self.h_size, self.x_size, bias=False)
 
-    def get_message_func(self):
-        def message_func(edges: dgl.EdgeBatch) -> Dict:
-            # [bs; 1; x size]
-            scores = self.W(edges.src['h']).unsqueeze(1)
-            # [bs; 1]
-            scores = torch.bmm(scores, edges.dst['x'].unsqueeze(2)).view(-1)
-
-            return {
-                'c': edges.src['c'],
-                'scores': scores,
-                'h': edges.src['h']
-            }
-        return message_func
-
-    def _reduce_func(self, nodes: dgl.NodeBatch) -> Dict:
+    def message(self, src: Dict[str, torch.Tensor], dst: Dict[str, torch.Tensor]) -> Dict[str, torch.Tensor]:
+        # [bs; 1; x size]
+        scores = self.W(src['h']).unsqueeze(1)
+        # [bs; 1]
+        scores = torch.bmm(scores, dst['x'].unsqueeze(2)).view(-1)
+
+        return {
+            'c': src['c'],
+            'scores': scores,
+            'h': src['h']
+        }
+
+    def reduce(self, mailbox: Dict[str, torch.Tensor], data: Dict[str, torch.Tensor]) -> Dict[str, torch.Tensor]:
         # [bs; n_children]
-        scores = nodes.mailbox['scores']
+        scores = mailbox['scores']
         # [bs * n children; 1]
         align = nn.functional.softmax(scores, dim=-1).view(-1, 1)
 
-        h_shape = nodes.mailbox['h'].shape
+        h_shape = mailbox['h'].shape
         # [bs * n children; h size]
-        h_attn = nodes.mailbox['h'].view(-1, h_shape[-1])
+        h_attn = mailbox['h'].view(-1, h_shape[-1])
         h_attn = h_attn * align
         h_attn = h_attn.view(h_shape)
 
@@ -54,17 +51,14 @@ class LuongAttentionTreeLSTMCell(ITreeLSTMCell):
         h_f = self.U_f(h_attn)
 
         # [bs; n children; h size]
-        fc = torch.sigmoid(h_f + nodes.data['x_f'].unsqueeze(1))
-        fc = fc * nodes.mailbox['c']
+        fc = torch.sigmoid(h_f + data['x_f'].unsqueeze(1))
+        fc = fc * mailbox['c']
 
         return {
             'Uh_sum': self.U_iou(h_iou),
             'fc_sum': torch.sum(fc, dim=1)
         }
 
-    def get_reduce_func(self):
-        return self._reduce_func
-
 
 class SelfAttentionTreeLSTMCell(ITreeLSTMCell):
 
@@ -77,29 +71,24 @@ class SelfAttentionTreeLSTMCell(ITreeLSTMCell):
         self.U_iou = nn.Linear(self.h_size, 3 * self.h_size)
         self.U_f = nn.Linear(self.h_size, self.h_size)
 
-    def get_message_func(self):
-        def message_func(edges: dgl.EdgeBatch) -> Dict:
-            f = torch.sigmoid(edges.dst['x_f'] + self.U_f(edges.src['h']))
-            return {
-                'fc': edges.src['c'] * f,
-                'h': edges.src['h']
-            }
-        return message_func
+    def message(self, src: Dict[str, torch.Tensor], dst: Dict[str, torch.Tensor]) -> Dict[str, torch.Tensor]:
+        f = torch.sigmoid(dst['x_f'] + self.U_f(src['h']))
+        return {
+            'fc': src['c'] * f,
+            'h': src['h']
+        }
 
-    def _reduce_func(self, nodes: dgl.NodeBatch) -> Dict:
+    def reduce(self, mailbox: Dict[str, torch.Tensor], data: Dict[str, torch.Tensor]) -> Dict[str, torch.Tensor]:
         # [1, bs, x size]
-        query = nodes.data['x'].unsqueeze(0)
+        query = data['x'].unsqueeze(0)
         # [n children, bs, h size]
-        key_value = nodes.mailbox['h'].transpose(0, 1)
+        key_value = mailbox['h'].transpose(0, 1)
 
         # [bs, h size]
         h_attn = self.mha(query, key_value, key_value)[0].squeeze(0)
-        fc_sum = torch.sum(nodes.mailbox['fc'], 1)
+        fc_sum = torch.sum(mailbox['fc'], 1)
 
         return {
             'Uh_sum': self.U_iou(h_attn),  # name for using with super functions
             'fc_sum': fc_sum
         }
-
-    def get_reduce_func(self):
-        return self._reduce_func
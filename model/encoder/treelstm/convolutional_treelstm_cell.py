@@ -1,6 +1,5 @@
 from typing import Dict
 
-import dgl
 import torch
 from torch import nn
 
@@ -20,25 +19,20 @@ class ConvolutionalTreeLSTMCell(ITreeLSTMCell):
         self.U_iou = nn.Linear(self.h_size, 3 * self.h_size)
         self.U_f = nn.Linear(self.h_size, self.h_size)
 
-    def get_message_func(self):
-        def message_func(edges: dgl.EdgeBatch) -> Dict:
-            f = torch.sigmoid(edges.dst['x_f'] + self.U_f(edges.src['h']))
-            return {
-                'fc': edges.src['c'] * f,
-                'h': edges.src['h']
-            }
-        return message_func
+    def message(self, src: Dict[str, torch.Tensor], dst: Dict[str, torch.Tensor]) -> Dict[str, torch.Tensor]:
+        f = torch.sigmoid(dst['x_f'] + self.U_f(src['h']))
+        return {
+            'fc': src['c'] * f,
+            'h': src['h']
+        }
 
-    def _reduce_func(self, nodes: dgl.NodeBatch) -> Dict:
+    def reduce(self, mailbox: Dict[str, torch.Tensor], data: Dict[str, torch.Tensor]) -> Dict[str, torch.Tensor]:
         # [bs; 1; n children; h size]
-        h = nodes.mailbox['h'].unsqueeze(1)
+        h = mailbox['h'].unsqueeze(1)
         # [bs; h size]
         h = self.convolution(h).max(2)[0].squeeze(1)
 
         return {
             'Uh_sum': self.U_iou(h),
-            'fc_sum': nodes.mailbox['fc'].sum(1)
+            'fc_sum': mailbox['fc'].sum(1)
         }
-
-    def get_reduce_func(self):
-        return self._reduce_func
@@ -22,27 +22,31 @@ class SequenceTreeLSTMCell(ITreeLSTMCell):
             self.U_iou = nn.Linear(self.h_size, 3 * self.h_size, bias=False)
             self.U_f = nn.Linear(self.h_size, self.h_size, bias=False)
 
+    def message(self, src: Dict[str, torch.Tensor], dst: Dict[str, torch.Tensor]) -> Dict[str, torch.Tensor]:
+        return {
+            'h': src['h'],
+            'c': src['c']
+        }
+
     def get_message_func(self):
         return [dgl.function.copy_u('h', 'h'), dgl.function.copy_u('c', 'c')]
 
-    def get_reduce_func(self):
-        def reduce_func(nodes: dgl.NodeBatch) -> Dict:
-            # [n children; bs; h size]
-            h = nodes.mailbox['h'].transpose(0, 1)
-
-            # [n children; bs; h size * 1 or 2]
-            h_lstm = self.lstm(h)[0]
-            # [bs; n children; h size]
-            h_f = self.U_f(h_lstm).transpose(0, 1)
-            # [bs; 3 * h size]
-            h_iou = self.U_iou(h_lstm[-1])
-
-            # [bs; n children; h size]
-            fc = torch.sigmoid(h_f + nodes.data['x_f'].unsqueeze(1))
-            fc = fc * nodes.mailbox['c']
-
-            return {
-                'Uh_sum': h_iou,
-                'fc_sum': torch.sum(fc, dim=1)
-            }
-        return reduce_func
+    def reduce(self, mailbox: Dict[str, torch.Tensor], data: Dict[str, torch.Tensor]) -> Dict[str, torch.Tensor]:
+        # [n children; bs; h size]
+        h = mailbox['h'].transpose(0, 1)
+
+        # [n children; bs; h size * 1 or 2]
+        h_lstm = self.lstm(h)[0]
+        # [bs; n children; h size]
+        h_f = self.U_f(h_lstm).transpose(0, 1)
+        # [bs; 3 * h size]
+        h_iou = self.U_iou(h_lstm[-1])
+
+        # [bs; n children; h size]
+        fc = torch.sigmoid(h_f + data['x_f'].unsqueeze(1))
+        fc = fc * mailbox['c']
+
+        return {
+            'Uh_sum': h_iou,
+            'fc_sum': torch.sum(fc, dim=1)
+        }
@@ -5,6 +5,7 @@ import torch
 import torch.nn as nn
 
 from model.encoder import ITreeEncoder
+from utils.level_schedule import LevelSchedule, TreeLevel, get_level_schedule
 
 
 class ITreeLSTMCell(nn.Module):
@@ -22,79 +23,269 @@ class ITreeLSTMCell(nn.Module):
         self.W_f = nn.Linear(self.x_size, self.h_size, bias=False)
         self.b_f = nn.Parameter(torch.zeros((1, h_size)), requires_grad=True)
 
-    def get_message_func(self):
+    def message(self, src: Dict[str, torch.Tensor], dst: Dict[str, torch.Tensor]) -> Dict[str, torch.Tensor]:
+        """Compute messages of edges
+
+        :param src: features of children, h and c [n edges; h size]
+        :param dst: features of parents, x [n edges; x size] and x_f [n edges; h size]
+        :return: dict with messages [n edges; ...]
+        """
         raise NotImplementedError
 
-    def get_reduce_func(self):
+    def reduce(self, mailbox: Dict[str, torch.Tensor], data: Dict[str, torch.Tensor]) -> Dict[str, torch.Tensor]:
+        """Reduce messages of children for nodes with the same number of children
+
+        :param mailbox: messages [n nodes; n children; ...]
+        :param data: features of nodes, x [n nodes; x size] and x_f [n nodes; h size]
+        :return: dict with Uh_sum [n nodes; 3 * h size] and fc_sum [n nodes; h size]
+        """
         raise NotImplementedError
 
+    def get_message_func(self):
+        def message_func(edges: dgl.EdgeBatch) -> Dict:
+            return self.message(edges.src, edges.dst)
+        return message_func
+
+    def get_reduce_func(self):
+        def reduce_func(nodes: dgl.NodeBatch) -> Dict:
+            return self.reduce(nodes.mailbox, nodes.data)
+        return reduce_func
+
+    def reduce_children(
+            self, level: TreeLevel, children: Dict[str, torch.Tensor], parents: Dict[str, torch.Tensor]
+    ) -> Dict[str, torch.Tensor]:
+        """Reduce children of level nodes in level schedule engine.
+        Messages are computed for all edges of the level at once, and reduced for each bucket of nodes
+        with the same number of children, like DGL does it.
+
+        :param level: level of the schedule
+        :param children: features of children, h and c [n edges to level; h size]
+        :param parents: features of level nodes, x [n nodes in level; x size] and x_f [n nodes in level; h size]
+        :return: dict with Uh_sum [n nodes in level; 3 * h size] and fc_sum [n nodes in level; h size]
+        """
+        edge_parents = {key: value.index_select(0, level.edge_parents) for key, value in parents.items()}
+        messages = self.message(children, edge_parents)
+        reduced = [self.reduce(mailbox, data) for mailbox, data in level.split_by_degree(messages, parents)]
+        return {key: torch.cat([bucket[key] for bucket in reduced], dim=0) for key in ['Uh_sum', 'fc_sum']}
+
+    @staticmethod
+    def apply_node(
+            x_iou: torch.Tensor, uh_sum: torch.Tensor = None, fc_sum: torch.Tensor = None
+    ) -> Tuple[torch.Tensor, torch.Tensor]:
+        """Compute states of nodes, sums of children are omitted for leaves
+
+        :param x_iou: [n nodes; 3 * h size] input parts of gates
+        :param uh_sum: [n nodes; 3 * h size] children parts of gates
+        :param fc_sum: [n nodes; h size] sum of children memory multiplied by forget gates
+        :return: h and c [n nodes; h size]
+        """
+        iou = x_iou if uh_sum is None else x_iou + uh_sum
+        i, o, u = torch.chunk(iou, 3, 1)
+        i, o, u = torch.sigmoid(i), torch.sigmoid(o), torch.tanh(u)
+
+        c = i * u if fc_sum is None else i * u + fc_sum
+        h = o * torch.tanh(c)
+        return h, c
+
     @staticmethod
     def get_apply_node_func():
         def apply_node_func(nodes: dgl.NodeBatch) -> Dict:
-            iou = nodes.data['x_iou'] + nodes.data['Uh_sum']
-            i, o, u = torch.chunk(iou, 3, 1)
-            i, o, u = torch.sigmoid(i), torch.sigmoid(o), torch.tanh(u)
-
-            c = i * u + nodes.data['fc_sum']
-            h = o * torch.tanh(c)
-
+            h, c = ITreeLSTMCell.apply_node(nodes.data['x_iou'], nodes.data['Uh_sum'], nodes.data['fc_sum'])
             return {'h': h, 'c': c}
         return apply_node_func
 
-    def init_matrices(self, graph: dgl.DGLGraph) -> dgl.DGLGraph:
+    def project_inputs(self, x: torch.Tensor) -> Tuple[torch.Tensor, torch.Tensor]:
+        """Compute input parts of gates
+
+        :param x: [n nodes; x size]
+        :return: x_iou [n nodes; 3 * h size] and x_f [n nodes; h size]
+        """
+        # both parts are computed by one matrix multiplication
+        weight = torch.cat([self.W_iou.weight, self.W_f.weight], dim=0)
+        x_gates = torch.addmm(torch.cat([self.b_iou, self.b_f], dim=1), x, weight.t())
+        return x_gates[:, :3 * self.h_size], x_gates[:, 3 * self.h_size:]
+
+    def init_matrices(self, graph: dgl.DGLGraph, leaves: torch.LongTensor) -> dgl.DGLGraph:
+        """Compute input parts of gates and states of leaves,
+        states of other nodes are computed by propagation over them
+
+        :param graph: batched graph with input of the cell in x
+        :param leaves: indexes of leaves
+        :return: graph with x_iou, x_f, h and c
+        """
         number_of_nodes = graph.number_of_nodes()
-        graph.ndata['x_iou'] = self.W_iou(graph.ndata['x']) + self.b_iou
-        graph.ndata['x_f'] = self.W_f(graph.ndata['x']) + self.b_f
-        graph.ndata['h'] = graph.ndata['x'].new_zeros((number_of_nodes, self.h_size))
-        graph.ndata['c'] = graph.ndata['x'].new_zeros((number_of_nodes, self.h_size))
-        graph.ndata['Uh_sum'] = graph.ndata['x'].new_zeros((number_of_nodes, 3 * self.h_size))
-        graph.ndata['fc_sum'] = graph.ndata['x'].new_zeros((number_of_nodes, self.h_size))
+        x_iou, x_f = self.project_inputs(graph.ndata['x'])
+        leaves_h, leaves_c = self.apply_node(x_iou.index_select(0, leaves))
+        graph.ndata['x_iou'], graph.ndata['x_f'] = x_iou, x_f
+        graph.ndata['h'] = x_iou.new_zeros((number_of_nodes, self.h_size)).index_copy(0, leaves, leaves_h)
+        graph.ndata['c'] = x_iou.new_zeros((number_of_nodes, self.h_size)).index_copy(0, leaves, leaves_c)
         return graph
 
+    def compute_level(
+            self, level: TreeLevel, x: torch.Tensor, x_iou: torch.Tensor, x_f: torch.Tensor,
+            h_children: torch.Tensor, c_children: torch.Tensor
+    ) -> Tuple[torch.Tensor, torch.Tensor]:
+        """Compute states of nodes of one internal level
+
+        :param level: level of the schedule
+        :param x: [n nodes in level; x size] input of the cell
+        :param x_iou: [n nodes in level; 3 * h size] input parts of gates
+        :param x_f: [n nodes in level; h size]
+        :param h_children: [n edges to level; h size] states of children in the order of level edges
+        :param c_children: [n edges to level; h size]
+        :return: h and c [n nodes in level; h size]
+        """
+        reduced = self.reduce_children(level, {'h': h_children, 'c': c_children}, {'x': x, 'x_f': x_f})
+        return self.apply_node(x_iou, reduced['Uh_sum'], reduced['fc_sum'])
+
+    def propagate_levels(self, x: torch.Tensor, schedule: LevelSchedule) -> Tuple[torch.Tensor, torch.Tensor]:
+        """Compute states of all nodes level by level.
+        Nodes are in level order of the schedule, so inputs are split by levels once per batch,
+        and their gradients are concatenated once in backward instead of being scattered for each level.
+        States are written to slices of buffers allocated once per batch.
+
+        :param x: [n nodes; x size] input of the cell in level order
+        :param schedule: level schedule of the batched graph
+        :return: h and c [n nodes; h size] in level order
+        """
+        x_iou, x_f = self.project_inputs(x)
+        sizes = schedule.sizes
+        levels_x, levels_x_iou, levels_x_f = torch.split(x, sizes), torch.split(x_iou, sizes), torch.split(x_f, sizes)
+        h = x.new_empty((x.shape[0], self.h_size))
+        c = x.new_empty((x.shape[0], self.h_size))
+
+        # all leaves are computed at once, they don't have children to reduce
+        leaves = schedule.levels[0].positions
+        h[leaves], c[leaves] = self.apply_node(levels_x_iou[0])
+
+        for level_id, level in enumerate(schedule.internal_levels, 1):
+            nodes = level.positions
+            # gathered states of children don't need original values for backward, so states are updated inplace
+            h[nodes], c[nodes] = self.compute_level(
+                level, levels_x[level_id], levels_x_iou[level_id], levels_x_f[level_id],
+                h.index_select(0, level.children), c.index_select(0, level.children)
+            )
+
+        return h, c
+
 
 class TreeLSTM(ITreeEncoder):
+    """Encode trees by Tree-LSTM, states are propagated from leaves to root level by level.
+    Engines of propagation:
+    dgl -- dgl.prop_nodes with message and reduce functions of the cell,
+    levels -- nodes are stored in level order, so each level reads and writes slices of states,
+    and only states of children are gathered,
+    wavefront -- as levels, but each level is computed by all layers before the next one.
+    In all engines level schedule of the batch is used, that is loaded with the batch or built once in forward,
+    states of all leaves are computed at once, and only internal nodes are propagated.
+    """
 
     name = "TreeLSTM"
     _known_tree_lstm_cells = {}
+    _known_engines = ['dgl', 'levels', 'wavefront']
 
     def __init__(
             self, h_emb: int, h_enc: int, cell: Dict,
-            dropout: float = 0., n_layers: int = 1, residual: bool = False
+            dropout: float = 0., n_layers: int = 1, residual: bool = False, engine: str = 'dgl'
     ):
         super().__init__(h_emb, h_enc)
         if cell['name'] not in self._known_tree_lstm_cells:
             raise ValueError(f"unknown TreeLSTM cell: {cell['name']}")
+        if engine not in self._known_engines:
+            raise ValueError(f"unknown TreeLSTM engine: {engine}")
         self.dropout = nn.Dropout(dropout)
         self.n_layers = n_layers
         self.residual = residual
+        self.engine = engine
 
         self.norm = nn.ModuleList([nn.LayerNorm(h_enc) for _ in range(self.n_layers)])
         self.cell = nn.ModuleList([
             self._known_tree_lstm_cells[cell['name']](self.h_emb, self.h_enc, **cell['params']) for _ in range(self.n_layers)
         ])
 
-    def forward(self, graph: dgl.DGLGraph) -> Tuple[torch.Tensor, torch.Tensor]:
+    def forward(self, graph: dgl.DGLGraph, schedule: LevelSchedule = None) -> Tuple[torch.Tensor, torch.Tensor]:
         x = self.dropout(graph.ndata['x'])
+        schedule = get_level_schedule(graph, x.device, schedule)
+        if self.engine != 'dgl':
+            # nodes are propagated in level order of the schedule and returned in the order of the graph
+            x, c = self._propagate_in_level_order(x.index_select(0, schedule.order), schedule)
+            return x.index_select(0, schedule.positions), c.index_select(0, schedule.positions)
 
         for layer in range(self.n_layers):
             graph.ndata['x'] = x
-
-            graph = self.cell[layer].init_matrices(graph)
-            dgl.prop_nodes_topo(
+            graph = self.cell[layer].init_matrices(graph, schedule.leaves)
+            # DGL takes nodes on CPU
+            dgl.prop_nodes(
                 graph,
+                [level.nodes.cpu() for level in schedule.internal_levels],
                 reduce_func=self.cell[layer].get_reduce_func(),
                 message_func=self.cell[layer].get_message_func(),
                 apply_node_func=self.cell[layer].get_apply_node_func()
             )
+            h, c = graph.ndata.pop('h'), graph.ndata.pop('c')
+            x = self._get_layer_output(layer, h, x)
+
+        return x, c
 
-            if self.residual:
-                x = self.norm[layer](graph.ndata.pop('h') + x)
-            else:
-                x = graph.ndata.pop('h')
+    def _propagate_in_level_order(self, x: torch.Tensor, schedule: LevelSchedule) -> Tuple[torch.Tensor, torch.Tensor]:
+        """Propagate by levels or wavefront engine
 
-        c = graph.ndata.pop('c')
+        :param x: [n nodes; h emb] input of the first layer in level order
+        :param schedule: level schedule of the batched graph
+        :return: output of the last layer and its memory states [n nodes; h enc] in level order
+        """
+        if self.engine == 'wavefront':
+            return self._propagate_wavefront(x, schedule)
+        for layer in range(self.n_layers):
+            h, c = self.cell[layer].propagate_levels(x, schedule)
+            x = self._get_layer_output(layer, h, x)
         return x, c
 
+    def _get_layer_output(self, layer: int, h: torch.Tensor, x: torch.Tensor) -> torch.Tensor:
+        if self.residual:
+            return self.norm[layer](h + x)
+        return h
+
+    def _propagate_wavefront(self, x: torch.Tensor, schedule: LevelSchedule) -> Tuple[torch.Tensor, torch.Tensor]:
+        """Compute all layers level by level. The next layer at a node needs only the output of the previous layer
+        at it and own states of children, so the level is computed by all layers at once,
+        states of children for all layers are gathered and scattered together,
+        and inputs of next layers aren't gathered from all nodes.
+
+        :param x: [n nodes; h emb] input of the first layer in level order
+        :param schedule: level schedule of the batched graph
+        :return: output of the last layer and its memory states [n nodes; h enc] in level order
+        """
+        n_nodes = x.shape[0]
+        # states of all layers, [n layers; n nodes; h enc]
+        h = x.new_empty((self.n_layers, n_nodes, self.h_enc))
+        c = x.new_empty((self.n_layers, n_nodes, self.h_enc))
+        # outputs aren't read by next levels, so they are concatenated at the end
+        outputs = []
+
+        for level_id, (level, level_x) in enumerate(zip(schedule.levels, torch.split(x, schedule.sizes))):
+            nodes = level.positions
+            if level_id > 0:
+                # [n layers; n edges to level; h enc]
+                h_children, c_children = h.index_select(1, level.children), c.index_select(1, level.children)
+            level_h, level_c = [], []
+            for layer in range(self.n_layers):
+                x_iou, x_f = self.cell[layer].project_inputs(level_x)
+                if level_id == 0:
+                    layer_h, layer_c = self.cell[layer].apply_node(x_iou)
+                else:
+                    layer_h, layer_c = self.cell[layer].compute_level(
+                        level, level_x, x_iou, x_f, h_children[layer], c_children[layer]
+                    )
+                level_h.append(layer_h)
+                level_c.append(layer_c)
+                level_x = self._get_layer_output(layer, layer_h, level_x)
+            # each write into states costs a copy of their gradient in backward, so layers are written at once
+            h[:, nodes], c[:, nodes] = torch.stack(level_h), torch.stack(level_c)
+            outputs.append(level_x)
+
+        return torch.cat(outputs), c[-1]
+
     @staticmethod
     def register_cell(tree_lstm_cell: ITreeLSTMCell):
         if not issubclass(tree_lstm_cell, ITreeLSTMCell):
@@ -119,16 +310,124 @@ class ChildSumTreeLSTMCell(ITreeLSTMCell):
         self.U_iou = nn.Linear(self.h_size, 3 * self.h_size, bias=False)
         self.U_f = nn.Linear(self.h_size, self.h_size, bias=False)
 
-    def get_message_func(self):
-        def message_func(edges: dgl.EdgeBatch) -> Dict:
-            h_f = self.U_f(edges.src['h'])
-            x_f = edges.dst['x_f']
-            f = torch.sigmoid(x_f + h_f)
-            return {
-                'Uh': self.U_iou(edges.src['h']),
-                'fc': edges.src['c'] * f
-            }
-        return message_func
+    def message(self, src: Dict[str, torch.Tensor], dst: Dict[str, torch.Tensor]) -> Dict[str, torch.Tensor]:
+        f = torch.sigmoid(dst['x_f'] + self.U_f(src['h']))
+        return {
+            'Uh': self.U_iou(src['h']),
+            'fc': src['c'] * f
+        }
+
+    def reduce(self, mailbox: Dict[str, torch.Tensor], data: Dict[str, torch.Tensor]) -> Dict[str, torch.Tensor]:
+        return {
+            'Uh_sum': torch.sum(mailbox['Uh'], dim=1),
+            'fc_sum': torch.sum(mailbox['fc'], dim=1)
+        }
+
+    def get_reduce_func(self):
+        return [dgl.function.sum('Uh', 'Uh_sum'), dgl.function.sum('fc', 'fc_sum')]
+
+    def reduce_children(
+            self, level: TreeLevel, children: Dict[str, torch.Tensor], parents: Dict[str, torch.Tensor]
+    ) -> Dict[str, torch.Tensor]:
+        # sums don't need mailboxes, children are scattered to parents
+        # and U_iou is applied once to the sum of children states
+        n_nodes = level.nodes.shape[0]
+        f = torch.sigmoid(parents['x_f'].index_select(0, level.edge_parents) + self.U_f(children['h']))
+        h_sum = children['h'].new_zeros((n_nodes, self.h_size)).index_add_(0, level.edge_parents, children['h'])
+        fc_sum = children['c'].new_zeros((n_nodes, self.h_size)).index_add_(0, level.edge_parents, children['c'] * f)
+        return {
+            'Uh_sum': self.U_iou(h_sum),
+            'fc_sum': fc_sum
+        }
+
+
+class FusedChildSumTreeLSTMCell(ITreeLSTMCell):
+    """ChildSum cell with concatenated matrices of gates: input parts of all gates are computed
+    by one matrix multiplication for all nodes, and messages of children by one multiplication for all edges.
+    In level schedule engine U_iou is applied to sums of children states instead of each child,
+    since it needs less operations, and only U_f is applied to each edge.
+    Weights of ChildSum cell are concatenated on loading, so its checkpoints can be used with this cell.
+    """
+
+    name = "FusedChildSum"
+
+    def __init__(self, x_size, h_size):
+        super().__init__(x_size, h_size)
+        # separate matrices of the interface are replaced by concatenated ones, [iou, f] order
+        del self.W_iou, self.b_iou, self.W_f, self.b_f
+        self.W = nn.Linear(self.x_size, 4 * self.h_size, bias=False)
+        self.b = nn.Parameter(torch.zeros(1, 4 * self.h_size), requires_grad=True)
+        self.U = nn.Linear(self.h_size, 4 * self.h_size, bias=False)
+        self._register_load_state_dict_pre_hook(self._concatenate_child_sum_weights)
+
+    @staticmethod
+    def _concatenate_child_sum_weights(state_dict: Dict, prefix: str, *args) -> None:
+        for fused_name, names, dim in [
+            ('W.weight', ['W_iou.weight', 'W_f.weight'], 0),
+            ('b', ['b_iou', 'b_f'], 1),
+            ('U.weight', ['U_iou.weight', 'U_f.weight'], 0)
+        ]:
+            if all(prefix + name in state_dict for name in names):
+                state_dict[prefix + fused_name] = torch.cat([state_dict.pop(prefix + name) for name in names], dim=dim)
+
+    def project_inputs(self, x: torch.Tensor) -> Tuple[torch.Tensor, torch.Tensor]:
+        x_gates = torch.addmm(self.b, x, self.W.weight.t())
+        return x_gates[:, :3 * self.h_size], x_gates[:, 3 * self.h_size:]
+
+    def message(self, src: Dict[str, torch.Tensor], dst: Dict[str, torch.Tensor]) -> Dict[str, torch.Tensor]:
+        h_gates = self.U(src['h'])
+        f = torch.sigmoid(dst['x_f'] + h_gates[:, 3 * self.h_size:])
+        return {
+            'Uh': h_gates[:, :3 * self.h_size],
+            'fc': src['c'] * f
+        }
+
+    def reduce(self, mailbox: Dict[str, torch.Tensor], data: Dict[str, torch.Tensor]) -> Dict[str, torch.Tensor]:
+        return {
+            'Uh_sum': torch.sum(mailbox['Uh'], dim=1),
+            'fc_sum': torch.sum(mailbox['fc'], dim=1)
+        }
 
     def get_reduce_func(self):
         return [dgl.function.sum('Uh', 'Uh_sum'), dgl.function.sum('fc', 'fc_sum')]
+
+    def compute_level(
+            self, level: TreeLevel, x: torch.Tensor, x_iou: torch.Tensor, x_f: torch.Tensor,
+            h_children: torch.Tensor, c_children: torch.Tensor
+    ) -> Tuple[torch.Tensor, torch.Tensor]:
+        h_size, n_nodes = self.h_size, level.nodes.shape[0]
+        u_iou, u_f = self.U.weight[:3 * h_size], self.U.weight[3 * h_size:]
+        # forget gate for each child, [n edges; h size]
+        f = torch.sigmoid(torch.addmm(x_f.index_select(0, level.edge_parents), h_children, u_f.t()))
+        fc_children = c_children * f
+        fc_sum = fc_children.new_zeros((n_nodes, h_size)).index_add_(0, level.edge_parents, fc_children)
+        # U_iou is linear, so it's applied to sums of children states, [n nodes; 3 * h size]
+        h_sum = h_children.new_zeros((n_nodes, h_size)).index_add_(0, level.edge_parents, h_children)
+        iou = torch.addmm(x_iou, h_sum, u_iou.t())
+
+        i, o, u = torch.chunk(iou, 3, 1)
+        i, o, u = torch.sigmoid(i), torch.sigmoid(o), torch.tanh(u)
+        c = i * u + fc_sum
+        h = o * torch.tanh(c)
+        return h, c
+
+    def propagate_levels(self, x: torch.Tensor, schedule: LevelSchedule) -> Tuple[torch.Tensor, torch.Tensor]:
+        h_size = self.h_size
+        # [n nodes; 4 * h size], input parts of all gates
+        x_gates = torch.addmm(self.b, x, self.W.weight.t())
+        # only states are stored for all nodes, sums of children are computed for one level at a time
+        h = x.new_empty((x.shape[0], h_size))
+        c = x.new_empty((x.shape[0], h_size))
+        levels_gates = torch.split(x_gates, schedule.sizes)
+
+        leaves = schedule.levels[0].positions
+        h[leaves], c[leaves] = self.apply_node(levels_gates[0][:, :3 * h_size])
+
+        for level_id, level in enumerate(schedule.internal_levels, 1):
+            nodes, level_gates = level.positions, levels_gates[level_id]
+            h[nodes], c[nodes] = self.compute_level(
+                level, None, level_gates[:, :3 * h_size], level_gates[:, 3 * h_size:],
+                h.index_select(0, level.children), c.index_select(0, level.children)
+            )
+
+        return h, c
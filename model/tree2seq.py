@@ -7,6 +7,7 @@ from dgl import DGLGraph
 from model.decoder import Decoder
 from model.embedding import Embedding
 from model.encoder import Encoder
+from utils.level_schedule import LevelSchedule
 
 
 class Tree2Seq(nn.Module):
@@ -36,15 +37,16 @@ class Tree2Seq(nn.Module):
             label_to_id=self.label_to_id, **self.decoder_info
         )
 
-    def forward(self, graph: DGLGraph, labels: torch.Tensor) -> torch.Tensor:
+    def forward(self, graph: DGLGraph, labels: torch.Tensor, schedule: LevelSchedule = None) -> torch.Tensor:
         """Predict sequence of tokens for given batched graph
 
         :param graph: the batched graph
         :param labels: [batch size] string labels of each example
+        :param schedule: level schedule of the graph, it's built by encoders if they need it and it isn't passed
         :return: logits [the longest sequence, batch size, vocab size]
         """
         return self.decoder(
-            *self.encoder(self.embedding(graph)), labels
+            *self.encoder(self.embedding(graph), schedule), labels
         )
 
     @staticmethod
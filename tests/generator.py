@@ -1,4 +1,7 @@
+from collections import deque
+
 import dgl
+import numpy
 
 
 def generate_node_with_children(number_of_children: int, edges_to_root: bool = True) -> dgl.DGLGraph:
@@ -34,3 +37,45 @@ def generate_tree(height: int, branch_factor: int, edges_to_root: bool = True) -
         else:
             g.add_edges(u, v)
     return g
+
+
+def generate_random_tree(
+        n_nodes: int, max_depth: int, max_branch_factor: int, random_state: numpy.random.RandomState,
+        leaf_probability: float = 0.4, edges_to_root: bool = True
+) -> dgl.DGLGraph:
+    """create random tree shaped like AST: internal nodes have different number of children,
+    a part of nodes on each level are leaves (tokens), and deeper nodes are leaves more often
+    node numeration from root to leaves level by level, so the root is the first node
+
+    :param n_nodes: maximum number of nodes, the tree is smaller if it stops growing before
+    :param max_depth: maximum depth of tree, the root is on the first level
+    :param max_branch_factor: maximum number of children of each node
+    :param random_state: source of randomness
+    :param leaf_probability: probability of a node on the second level to be a leaf
+    :param edges_to_root: direct edges to root or not
+    :return: dgl graph
+    """
+    parents, depth = [], [1]
+    queue = deque([0])
+    while len(queue) > 0 and len(depth) < n_nodes:
+        node = queue.popleft()
+        if depth[node] >= max_depth:
+            continue
+        # the root is always expanded, other nodes become leaves more often with depth
+        if node > 0 and random_state.rand() < leaf_probability * (1 + (depth[node] - 2) / max_depth):
+            continue
+        n_children = min(random_state.randint(1, max_branch_factor + 1), n_nodes - len(depth))
+        for _ in range(n_children):
+            queue.append(len(depth))
+            parents.append(node)
+            depth.append(depth[node] + 1)
+
+    g = dgl.DGLGraph()
+    g.add_nodes(len(depth))
+    children = list(range(1, len(depth)))
+    if len(children) > 0:
+        if edges_to_root:
+            g.add_edges(children, parents)
+        else:
+            g.add_edges(parents, children)
+    return g
@@ -0,0 +1,73 @@
+import os
+import unittest
+from tempfile import TemporaryDirectory
+
+import torch
+
+from utils.checkpoint_writer import CheckpointWriter, VOCABULARY_NAME, load_checkpoint, split_vocabulary
+
+
+class CheckpointWriterTest(unittest.TestCase):
+
+    def test_rotation_keeps_last_and_best(self):
+        with TemporaryDirectory() as folder:
+            writer = CheckpointWriter(keep_last=2)
+            weights = torch.zeros(3)
+            for i, score in enumerate([0.1, 0.5, None, 0.2, None]):
+                weights += 1
+                writer.save({'state_dict': {'weights': weights}}, os.path.join(folder, f'epoch_{i}.pt'), score)
+            # snapshot is taken on saving, so later changes are not written
+            weights.zero_()
+            writer.close()
+
+            self.assertListEqual(['epoch_1.pt', 'epoch_3.pt', 'epoch_4.pt'], sorted(os.listdir(folder)))
+            checkpoint = torch.load(os.path.join(folder, 'epoch_4.pt'))
+            self.assertListEqual([5., 5., 5.], checkpoint['state_dict']['weights'].tolist())
+
+    def test_score_set_after_saving(self):
+        with TemporaryDirectory() as folder:
+            writer = CheckpointWriter(keep_last=1)
+            paths = [os.path.join(folder, f'epoch_{i}.pt') for i in range(4)]
+            # scores of asynchronous evaluation arrive after saving of the next checkpoints
+            writer.save({'epoch': 0}, paths[0])
+            writer.save({'epoch': 1}, paths[1])
+            writer.set_score(paths[1], 0.5)
+            writer.save({'epoch': 2}, paths[2])
+            writer.set_score(paths[2], 0.7)
+            writer.save({'epoch': 3}, paths[3])
+            # score of removed checkpoint is ignored
+            writer.set_score(paths[0], 0.9)
+            writer.close()
+
+            self.assertListEqual(['epoch_2.pt', 'epoch_3.pt'], sorted(os.listdir(folder)))
+
+    def test_rotation_of_rewritten_checkpoints(self):
+        with TemporaryDirectory() as folder:
+            writer = CheckpointWriter(keep_last=3)
+            # batch ids restart every epoch, so batch checkpoints are rewritten
+            for epoch in range(2):
+                for name in ['batch_10.pt', 'batch_20.pt', f'epoch_{epoch}.pt']:
+                    writer.save({'epoch': epoch}, os.path.join(folder, name))
+            writer.close()
+
+            self.assertListEqual(['batch_10.pt', 'batch_20.pt', 'epoch_1.pt'], sorted(os.listdir(folder)))
+            self.assertEqual(1, torch.load(os.path.join(folder, 'batch_10.pt'))['epoch'])
+
+    def test_vocabulary_is_saved_once(self):
+        with TemporaryDirectory() as folder:
+            writer = CheckpointWriter()
+            configuration = {'hidden_states': 1, 'token_to_id': {'a': 0}, 'type_to_id': {}, 'label_to_id': {'b': 0}}
+            for i in range(3):
+                checkpoint, vocabulary = split_vocabulary({'configuration': configuration, 'batch_id': i})
+                writer.save_once(vocabulary, os.path.join(folder, VOCABULARY_NAME))
+                writer.save(checkpoint, os.path.join(folder, f'batch_{i}.pt'))
+            writer.close()
+
+            self.assertDictEqual({'hidden_states': 1}, torch.load(os.path.join(folder, 'batch_2.pt'))['configuration'])
+            checkpoint = load_checkpoint(os.path.join(folder, 'batch_2.pt'))
+            self.assertDictEqual(configuration, checkpoint['configuration'])
+            self.assertEqual(2, checkpoint['batch_id'])
+
+
+if __name__ == '__main__':
+    unittest.main()
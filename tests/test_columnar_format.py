@@ -0,0 +1,55 @@
+import unittest
+from tempfile import TemporaryDirectory
+
+import numpy as np
+import torch
+from dgl import DGLGraph
+
+from data_preprocessing.batch_writer import ColumnarWriter
+from utils.columnar_format import (
+    NODE_OFFSETS, EDGE_OFFSETS, SRC, DST, TOKEN, TYPE, LABEL, get_compact_dtype, is_columnar_dataset,
+    load_columnar_dataset
+)
+
+
+def _create_graph(n_nodes: int, src: list, dst: list, first_token: int) -> DGLGraph:
+    graph = DGLGraph()
+    graph.add_nodes(n_nodes)
+    graph.add_edges(src, dst)
+    graph.ndata['token'] = torch.arange(first_token, first_token + 2 * n_nodes).view(n_nodes, 2)
+    graph.ndata['type'] = torch.full((n_nodes,), first_token, dtype=torch.long)
+    return graph
+
+
+class ColumnarFormatTest(unittest.TestCase):
+
+    def test_compact_dtype(self):
+        self.assertEqual(np.int16, get_compact_dtype(100))
+        self.assertEqual(np.int16, get_compact_dtype(2 ** 15))
+        self.assertEqual(np.int32, get_compact_dtype(2 ** 15 + 1))
+
+    def test_writing_and_loading(self):
+        with TemporaryDirectory() as tmp_dir:
+            writer = ColumnarWriter(tmp_dir, np.int16, np.int16, np.int32)
+            self.assertFalse(is_columnar_dataset(tmp_dir))
+            writer.add([_create_graph(3, [0, 0], [1, 2], 10)], [[1, 2]], ['a.java'])
+            writer.add([_create_graph(2, [0], [1], 20), _create_graph(1, [], [], 30)], [[3, 4], [5, 6]],
+                       ['b.java', 'c.java'])
+            writer.close()
+
+            self.assertTrue(is_columnar_dataset(tmp_dir))
+            index, columns = load_columnar_dataset(tmp_dir)
+            self.assertEqual(3, index['n_graphs'])
+            self.assertListEqual([0, 3, 5, 6], columns[NODE_OFFSETS].tolist())
+            self.assertListEqual([0, 2, 3, 3], columns[EDGE_OFFSETS].tolist())
+            self.assertListEqual([0, 0, 0], columns[SRC].tolist())
+            self.assertListEqual([1, 2, 1], columns[DST].tolist())
+            self.assertEqual((6, 2), columns[TOKEN].shape)
+            self.assertEqual(np.int16, columns[TOKEN].dtype)
+            self.assertListEqual([20, 21], columns[TOKEN][3].tolist())
+            self.assertListEqual([10, 10, 10, 20, 20, 30], columns[TYPE].tolist())
+            self.assertListEqual([[1, 2], [3, 4], [5, 6]], columns[LABEL].tolist())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,65 @@
+import os
+import unittest
+from tempfile import TemporaryDirectory
+
+import dgl
+import numpy as np
+import torch
+import torch.distributed as dist
+import torch.multiprocessing as mp
+
+from model.encoder.treelstm import TreeLSTM
+from tests.generator import generate_random_tree
+from utils.common import fix_seed
+from utils.distributed import shard_batch_order, wrap_model
+
+N_PROCESSES = 2
+
+
+def _train_process(rank: int, init_file: str, output_folder: str) -> None:
+    dist.init_process_group('gloo', init_method=f'file://{init_file}', rank=rank, world_size=N_PROCESSES)
+    try:
+        fix_seed()
+        # layer norms are created, but not used without residual connections
+        tree_lstm = TreeLSTM(8, 8, {'name': 'ChildSum', 'params': {}}, residual=False, engine='levels')
+        model = wrap_model(tree_lstm, torch.device('cpu'))
+        optimizer = torch.optim.SGD(model.parameters(), lr=0.1)
+        random_state = np.random.RandomState(rank)
+        for _ in range(3):
+            graph = dgl.batch([generate_random_tree(20, 4, 3, random_state) for _ in range(4)])
+            graph.ndata['x'] = torch.rand(graph.number_of_nodes(), 8)
+            optimizer.zero_grad()
+            h, c = model(graph)
+            (h.sum() + c.sum()).backward()
+            optimizer.step()
+        torch.save(tree_lstm.state_dict(), os.path.join(output_folder, f'rank_{rank}.pt'))
+    finally:
+        dist.destroy_process_group()
+
+
+class DistributedTest(unittest.TestCase):
+
+    def test_sharding_of_batches(self):
+        order = [4, 2, 7, 0, 1, 3, 6, 5, 8, 9, 10]
+        shards = [shard_batch_order(order, rank, 3) for rank in range(3)]
+
+        self.assertListEqual([[4, 0, 6], [2, 1, 5], [7, 3, 8]], shards)
+        # all processes make the same number of steps, the tail is dropped
+        self.assertListEqual(sorted(order[:9]), sorted(sum(shards, [])))
+
+    def test_single_process(self):
+        order = [3, 1, 2, 0]
+        self.assertListEqual(order, shard_batch_order(order, 0, 1))
+
+    def test_training_with_unused_parameters(self):
+        with TemporaryDirectory() as folder:
+            mp.spawn(_train_process, args=(os.path.join(folder, 'init'), folder), nprocs=N_PROCESSES)
+
+            state_dicts = [torch.load(os.path.join(folder, f'rank_{rank}.pt')) for rank in range(N_PROCESSES)]
+        # processes train on different batches, but gradients are averaged, so models stay the same
+        for name, value in state_dicts[0].items():
+            self.assertTrue(torch.equal(value, state_dicts[1][name]), f"{name} is different in processes")
+
+
+if __name__ == '__main__':
+    unittest.main()
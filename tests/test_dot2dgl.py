@@ -0,0 +1,206 @@
+import os
+import unittest
+from tempfile import TemporaryDirectory
+from unittest.mock import patch
+
+import numpy as np
+import pandas as pd
+
+from data_preprocessing.dot2dgl import (
+    read_dot_edges, convert_dot_to_dgl, convert_holdout, convert_projects, prepare_project_description,
+    _encode_sequences, _move_tokens_to_leaves, _read_dot_files_task
+)
+from utils.columnar_format import load_columnar_dataset
+from utils.common import UNK, PAD, SOS, EOS
+
+
+def _read_dot_files_or_exit(dot_paths):
+    # worker reading the killed project exits without returning anything, as if it was killed by the system
+    if any('killed' in dot_path for dot_path in dot_paths):
+        os._exit(1)
+    return _read_dot_files_task(dot_paths)
+
+
+class DotToDGLTest(unittest.TestCase):
+
+    _dot_content = "digraph 42 {\n" \
+                   "0 -- {1 2 3};\n" \
+                   "1 -- {4 5 };\n" \
+                   "2 -- {};\n" \
+                   "3 -- {6};\n" \
+                   "4 -- {};\n" \
+                   "5 -- {};\n" \
+                   "6 -- {};\n" \
+                   "}\n"
+
+    def test_reading_dot_edges(self):
+        with TemporaryDirectory() as tmp_dir:
+            dot_path = os.path.join(tmp_dir, 'tree.dot')
+            with open(dot_path, 'w') as dot_file:
+                dot_file.write(self._dot_content)
+            n_nodes, src, dst = read_dot_edges(dot_path)
+
+        self.assertEqual(7, n_nodes)
+        self.assertListEqual([0, 0, 0, 1, 1, 3], src.tolist())
+        self.assertListEqual([1, 2, 3, 4, 5, 6], dst.tolist())
+
+    def test_converting_dot_to_dgl(self):
+        with TemporaryDirectory() as tmp_dir:
+            dot_path = os.path.join(tmp_dir, 'tree.dot')
+            with open(dot_path, 'w') as dot_file:
+                dot_file.write(self._dot_content)
+            graph = convert_dot_to_dgl(dot_path)
+
+        self.assertEqual(7, graph.number_of_nodes())
+        us, vs = graph.all_edges(order='eid')
+        self.assertListEqual([0, 0, 0, 1, 1, 3], us.tolist())
+        self.assertListEqual([1, 2, 3, 4, 5, 6], vs.tolist())
+
+    def test_encoding_sequences(self):
+        to_id = {UNK: 0, PAD: 1, SOS: 2, EOS: 3, 'get': 4, 'name': 5}
+        data = pd.Series(['get|name', 'get|value|name|get', np.nan, 'name'])
+
+        correct_encoding = np.array([
+            [4, 5, 1, 1],
+            [4, 0, 5, 4],
+            [1, 1, 1, 1],
+            [5, 1, 1, 1]
+        ])
+        self.assertTrue(np.array_equal(correct_encoding, _encode_sequences(data, to_id, 4, False)))
+
+        correct_wrapped_encoding = np.array([
+            [2, 4, 5, 3],
+            [2, 4, 0, 5],
+            [1, 1, 1, 1],
+            [2, 5, 3, 1]
+        ])
+        self.assertTrue(np.array_equal(correct_wrapped_encoding, _encode_sequences(data, to_id, 4, True)))
+
+    def test_moving_tokens_to_leaves(self):
+        # two graphs: 0 -> 1, 0 -> 2 and 0 -> 1, padding index is 1 for both tokens and types
+        n_nodes = np.array([3, 2])
+        n_edges = np.array([2, 1])
+        src = np.array([0, 0, 0], dtype=np.int32)
+        dst = np.array([1, 2, 1], dtype=np.int32)
+        token = np.array([
+            [4, 5],
+            [6, 1],
+            [7, 8],
+            [9, 1],
+            [4, 4]
+        ])
+        node_type = np.array([2, 2, 1, 3, 3])
+
+        new_n_nodes, new_n_edges, new_src, new_dst, new_token, new_type = _move_tokens_to_leaves(
+            n_nodes, n_edges, src, dst, token, node_type, 1, 1
+        )
+
+        self.assertListEqual([6, 5], new_n_nodes.tolist())
+        self.assertListEqual([5, 4], new_n_edges.tolist())
+        self.assertListEqual([0, 0, 0, 0, 1, 0, 0, 1, 1], new_src.tolist())
+        self.assertListEqual([1, 2, 3, 4, 5, 1, 2, 3, 4], new_dst.tolist())
+        self.assertListEqual([1, 1, 7, 4, 5, 6, 1, 1, 9, 4, 4], new_token.reshape(-1).tolist())
+        self.assertListEqual([2, 2, 1, 1, 1, 1, 3, 3, 1, 1, 1], new_type.tolist())
+
+    def test_description_chunks_with_numeric_tokens(self):
+        to_id = {UNK: 0, PAD: 1, '0': 2, '1': 3, 'name': 4, 'Literal': 5}
+        with TemporaryDirectory() as tmp_dir:
+            pd.DataFrame({
+                'dot_file': ['ast_0.dot'] * 2 + ['ast_1.dot'] * 2, 'source_file': ['Main.java'] * 4,
+                'label': ['0', '0', 'name', 'name'], 'node_id': [0, 1, 0, 1], 'token': ['0', '1', 'name', '1'],
+                'type': ['Literal'] * 4
+            }).to_csv(os.path.join(tmp_dir, 'description.csv'), index=False)
+            # the first chunk has only numeric values
+            description = prepare_project_description(
+                tmp_dir, ['ast_0.dot', 'ast_1.dot'], to_id, to_id, to_id, False, chunk_size=2
+            )
+
+        self.assertListEqual([2, 3, 4, 3], description.token.reshape(-1).tolist())
+        self.assertListEqual([2, 4], description.label.tolist())
+
+    def _create_project(self, project_path: str, dot_contents: list, with_description: bool) -> None:
+        os.makedirs(os.path.join(project_path, 'asts'))
+        for i, dot_content in enumerate(dot_contents):
+            with open(os.path.join(project_path, 'asts', f'ast_{i}.dot'), 'w') as dot_file:
+                dot_file.write(dot_content)
+        if with_description:
+            pd.DataFrame({
+                'dot_file': ['ast_0.dot'] * 7, 'source_file': ['Main.java'] * 7, 'label': ['get'] * 7,
+                'node_id': range(7), 'token': ['name'] * 7, 'type': ['Method'] * 7
+            }).to_csv(os.path.join(project_path, 'description.csv'), index=False)
+
+    def test_converting_projects(self):
+        to_id = {UNK: 0, PAD: 1, 'get': 2, 'name': 3, 'Method': 4}
+        with TemporaryDirectory() as tmp_dir:
+            good_path, broken_path, undescribed_path = [
+                os.path.join(tmp_dir, project) for project in ['good', 'broken', 'undescribed']
+            ]
+            self._create_project(good_path, [self._dot_content], True)
+            # reading of the first chunk fails, the rest of them are skipped
+            self._create_project(broken_path, ["digraph {\n}\n"] * 4, True)
+            # saving fails after all chunks are read
+            self._create_project(undescribed_path, [self._dot_content], False)
+            log_file = os.path.join(tmp_dir, 'log.txt')
+            finished = {}
+
+            converted_projects = convert_projects(
+                [good_path, broken_path, undescribed_path], log_file, to_id, to_id, to_id, False, n_jobs=2,
+                dot_chunk_size=1, on_finished=finished.__setitem__, is_split=False
+            )
+
+            self.assertListEqual([good_path], converted_projects)
+            self.assertDictEqual({good_path: True, broken_path: False, undescribed_path: False}, finished)
+            self.assertTrue(os.path.exists(os.path.join(good_path, 'converted.dgl')))
+            with open(log_file) as file:
+                log = file.read()
+            self.assertIn(broken_path, log)
+            self.assertIn(undescribed_path, log)
+
+    def test_killed_worker_fails_its_project(self):
+        to_id = {UNK: 0, PAD: 1, 'get': 2, 'name': 3, 'Method': 4}
+        with TemporaryDirectory() as tmp_dir:
+            good_path, killed_path = [os.path.join(tmp_dir, project) for project in ['good', 'killed']]
+            self._create_project(good_path, [self._dot_content], True)
+            self._create_project(killed_path, [self._dot_content], True)
+            log_file = os.path.join(tmp_dir, 'log.txt')
+            finished = {}
+
+            with patch('data_preprocessing.dot2dgl._read_dot_files_task', _read_dot_files_or_exit):
+                converted_projects = convert_projects(
+                    [good_path, killed_path], log_file, to_id, to_id, to_id, False, n_jobs=2,
+                    dot_chunk_size=1, on_finished=finished.__setitem__, is_split=False
+                )
+
+            self.assertListEqual([good_path], converted_projects)
+            self.assertDictEqual({good_path: True, killed_path: False}, finished)
+            with open(log_file) as file:
+                self.assertIn(killed_path, file.read())
+
+    def test_failed_reconversion_is_not_written(self):
+        to_id = {UNK: 0, PAD: 1, 'get': 2, 'name': 3, 'Method': 4}
+        with TemporaryDirectory() as tmp_dir:
+            holdout_path, output_path = os.path.join(tmp_dir, 'test'), os.path.join(tmp_dir, 'test_converted')
+            first_path, second_path = [os.path.join(holdout_path, project, 'java') for project in ['first', 'second']]
+            self._create_project(first_path, [self._dot_content], True)
+            self._create_project(second_path, [self._dot_content], True)
+            cwd = os.getcwd()
+            os.chdir(tmp_dir)
+            os.mkdir('logs')
+            try:
+                convert_holdout(holdout_path, output_path, 10, to_id, to_id, to_id, n_jobs=1, output_format='columnar')
+                self.assertEqual(2, load_columnar_dataset(output_path)[0]['n_graphs'])
+
+                # the changed project fails to convert, its previous outputs are not written
+                with open(os.path.join(second_path, 'asts', 'ast_0.dot'), 'w') as dot_file:
+                    dot_file.write("digraph {\n}\n")
+                convert_holdout(holdout_path, output_path, 10, to_id, to_id, to_id, n_jobs=1, output_format='columnar')
+            finally:
+                os.chdir(cwd)
+
+            self.assertEqual(1, load_columnar_dataset(output_path)[0]['n_graphs'])
+            self.assertFalse(os.path.exists(os.path.join(second_path, 'converted.dgl')))
+            self.assertTrue(os.path.exists(os.path.join(first_path, 'converted.dgl')))
+
+
+if __name__ == '__main__':
+    unittest.main()
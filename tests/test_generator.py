@@ -0,0 +1,37 @@
+import unittest
+
+import numpy as np
+
+from tests.generator import generate_random_tree
+from utils.tree_operations import LEAVES_TO_ROOT, get_trees_statistics
+
+
+class GeneratorTest(unittest.TestCase):
+
+    def test_random_tree_limits(self):
+        random_state = np.random.RandomState(7)
+        for _ in range(20):
+            tree = generate_random_tree(100, 6, 4, random_state)
+            src, dst = tree.all_edges()
+            statistics = get_trees_statistics(
+                np.array([tree.number_of_nodes()]), np.array([tree.number_of_edges()]),
+                src.numpy(), dst.numpy(), LEAVES_TO_ROOT
+            )
+
+            self.assertLessEqual(tree.number_of_nodes(), 100)
+            # each node except the root has exactly one parent, and parents are numbered before children
+            self.assertListEqual(list(range(1, tree.number_of_nodes())), sorted(src.tolist()))
+            self.assertTrue((dst < src).all())
+            self.assertLessEqual(statistics['depth'][0], 6)
+            self.assertLessEqual(statistics['max_degree'][0], 4)
+
+    def test_random_tree_is_reproducible(self):
+        first = generate_random_tree(50, 5, 3, np.random.RandomState(1))
+        second = generate_random_tree(50, 5, 3, np.random.RandomState(1))
+
+        self.assertListEqual(first.all_edges()[0].tolist(), second.all_edges()[0].tolist())
+        self.assertListEqual(first.all_edges()[1].tolist(), second.all_edges()[1].tolist())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,82 @@
+import unittest
+from collections import Counter
+
+import numpy as np
+
+from data_preprocessing.heavy_hitters import CountMinSketch, HeavyHittersCounter, compare_top_values
+
+
+class HeavyHittersTest(unittest.TestCase):
+
+    @staticmethod
+    def _generate_counters(n_counters: int, n_values: int, size: int):
+        np.random.seed(7)
+        # zipf-like distribution similar to tokens frequencies
+        probabilities = 1 / np.arange(1, n_values + 1)
+        probabilities /= probabilities.sum()
+        return [
+            Counter(f'value_{v}' for v in np.random.choice(n_values, size, p=probabilities))
+            for _ in range(n_counters)
+        ]
+
+    def test_sketch_overestimates(self):
+        counters = self._generate_counters(5, 1000, 2000)
+        exact = Counter()
+        sketch = CountMinSketch(width=256, depth=3)
+        for counter in counters:
+            exact.update(counter)
+            sketch.update(counter)
+        keys = list(exact.keys())
+        estimations = sketch.estimate(keys)
+        self.assertTrue(all(estimation >= exact[key] for key, estimation in zip(keys, estimations)))
+
+    def test_sketch_saturates(self):
+        sketch = CountMinSketch(width=16, depth=2)
+        max_count = np.iinfo(np.int32).max
+        for _ in range(3):
+            sketch.update({'a': max_count // 2 + 1, 'b': 1})
+        self.assertEqual(np.int32, sketch.table.dtype)
+        self.assertListEqual([max_count, 3], sketch.estimate(['a', 'b']).tolist())
+
+    def test_counter_without_sketch(self):
+        counter = Counter({'a': 5, 'b': 3, 'c': 3, 'd': 1})
+        approximate = HeavyHittersCounter(capacity=10, sketch_width=0)
+        approximate.update(counter)
+        self.assertIsNone(approximate.sketch)
+        self.assertListEqual(counter.most_common(), approximate.most_common())
+
+    def test_frequent_values_are_kept(self):
+        counters = self._generate_counters(20, 5000, 1000)
+        exact = Counter()
+        approximate = HeavyHittersCounter(capacity=50)
+        for counter in counters:
+            exact.update(counter)
+            approximate.update(counter)
+        self.assertLessEqual(len(approximate._counts), 2 * approximate.capacity)
+
+        total = sum(exact.values())
+        kept = {value for value, _ in approximate.most_common()}
+        for value, count in exact.items():
+            if count > total / (approximate.capacity + 1):
+                self.assertIn(value, kept)
+
+    def test_comparing_top_values(self):
+        counters = self._generate_counters(10, 2000, 1000)
+        exact = Counter()
+        approximate = HeavyHittersCounter(capacity=40)
+        for counter in counters:
+            exact.update(counter)
+            approximate.update(counter)
+        comparison = compare_top_values(exact, approximate, 10)
+        self.assertEqual(1., comparison['recall'])
+        self.assertEqual(1., comparison['coverage'])
+
+    def test_small_vocabulary_is_exact(self):
+        counter = Counter({'a': 5, 'b': 3, 'c': 3, 'd': 1})
+        approximate = HeavyHittersCounter(capacity=10)
+        approximate.update(counter)
+        self.assertListEqual(counter.most_common(), approximate.most_common())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,40 @@
+import unittest
+
+from data_loaders.lru_cache import LRUCache
+
+
+class LRUCacheTest(unittest.TestCase):
+
+    def test_eviction_of_least_recently_used(self):
+        cache = LRUCache(budget=10)
+        loads = []
+
+        def loader(key: str, size: int):
+            def load():
+                loads.append(key)
+                return key.upper(), size
+            return load
+
+        self.assertEqual('A', cache.get('a', loader('a', 4)))
+        self.assertEqual('B', cache.get('b', loader('b', 4)))
+        self.assertEqual('A', cache.get('a', loader('a', 4)))
+        # "b" is the least recently used, so it is evicted
+        self.assertEqual('C', cache.get('c', loader('c', 4)))
+        self.assertEqual('A', cache.get('a', loader('a', 4)))
+        self.assertEqual('B', cache.get('b', loader('b', 4)))
+
+        self.assertListEqual(['a', 'b', 'c', 'b'], loads)
+        self.assertLessEqual(cache.size, cache.budget)
+        self.assertDictEqual({'cache_hits': 2, 'cache_misses': 4}, cache.get_state_dict())
+
+    def test_value_larger_than_budget(self):
+        cache = LRUCache(budget=10)
+        cache.get('small', lambda: (1, 5), 'group')
+        self.assertEqual(2, cache.get('large', lambda: (2, 20), 'group'))
+        self.assertEqual(1, cache.get('small', lambda: (3, 5), 'group'))
+        self.assertEqual(5, cache.size)
+        self.assertDictEqual({'group_hits': 1, 'group_misses': 2}, cache.get_state_dict())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,67 @@
+import os
+import unittest
+from tempfile import TemporaryDirectory
+
+from data_preprocessing.manifest import Manifest, DONE, FAILED, hash_folder, get_folder_stats
+
+
+class ManifestTest(unittest.TestCase):
+
+    def test_resuming_from_saved_manifest(self):
+        with TemporaryDirectory() as tmp_dir:
+            manifest_path = os.path.join(tmp_dir, 'manifest.json')
+            manifest = Manifest(manifest_path)
+            manifest.mark('first', 'aaa', DONE)
+            manifest.mark('second', 'bbb', FAILED)
+            manifest.save()
+
+            manifest = Manifest(manifest_path)
+            self.assertTrue(manifest.is_done('first', 'aaa'))
+            self.assertFalse(manifest.is_done('first', 'ccc'))
+            self.assertFalse(manifest.is_done('second', 'bbb'))
+            self.assertFalse(manifest.is_done('third', 'aaa'))
+
+            manifest.retain(['second'])
+            self.assertFalse(manifest.is_done('first', 'aaa'))
+
+    def test_folder_hash_depends_on_content(self):
+        with TemporaryDirectory() as tmp_dir:
+            os.mkdir(os.path.join(tmp_dir, 'asts'))
+            with open(os.path.join(tmp_dir, 'asts', 'ast_0.dot'), 'w') as dot_file:
+                dot_file.write("digraph {\n0 -- {};\n}\n")
+            initial_hash = hash_folder(tmp_dir)
+
+            with open(os.path.join(tmp_dir, 'converted.dgl'), 'w') as output_file:
+                output_file.write("output")
+            self.assertEqual(initial_hash, hash_folder(tmp_dir, exclude=['converted.dgl']))
+            self.assertNotEqual(initial_hash, hash_folder(tmp_dir))
+
+            with open(os.path.join(tmp_dir, 'asts', 'ast_0.dot'), 'a') as dot_file:
+                dot_file.write("\n")
+            self.assertNotEqual(initial_hash, hash_folder(tmp_dir, exclude=['converted.dgl']))
+
+    def test_folder_hash_is_cached_by_stats(self):
+        with TemporaryDirectory() as tmp_dir:
+            file_path = os.path.join(tmp_dir, 'ast_0.dot')
+            with open(file_path, 'w') as dot_file:
+                dot_file.write("digraph {\n0 -- {};\n}\n")
+            manifest_path = os.path.join(tmp_dir, 'manifest.json')
+            manifest = Manifest(manifest_path)
+            initial_hash = manifest.hash_folder('project', tmp_dir, exclude=['manifest.json'])
+            manifest.save()
+
+            # content with the same size and modification time isn't read again
+            file_stat = os.stat(file_path)
+            with open(file_path, 'w') as dot_file:
+                dot_file.write("digraph {\n1 -- {};\n}\n")
+            os.utime(file_path, ns=(file_stat.st_atime_ns, file_stat.st_mtime_ns))
+            manifest = Manifest(manifest_path)
+            self.assertEqual(initial_hash, manifest.hash_folder('project', tmp_dir, exclude=['manifest.json']))
+
+            os.utime(file_path, ns=(file_stat.st_atime_ns, file_stat.st_mtime_ns + 1))
+            self.assertIsNone(manifest.get_folder_hash('project', get_folder_stats(tmp_dir, exclude=['manifest.json'])))
+            self.assertNotEqual(initial_hash, manifest.hash_folder('project', tmp_dir, exclude=['manifest.json']))
+
+
+if __name__ == '__main__':
+    unittest.main()
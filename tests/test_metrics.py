@@ -2,7 +2,8 @@ import unittest
 
 import torch
 
-from utils.metrics import calculate_batch_statistics, calculate_metrics
+from utils.learning_info import LearningInfo
+from utils.metrics import calculate_batch_statistics, calculate_batch_statistics_vectorized, calculate_metrics
 
 
 class MetricsTest(unittest.TestCase):
@@ -28,6 +29,31 @@ class MetricsTest(unittest.TestCase):
         for statistic in ['true_positive', 'false_positive', 'false_negative']:
             self.assertEqual(true_statistics[statistic], test_statistics[statistic])
 
+    def test_vectorized_stats(self):
+        torch.manual_seed(7)
+        for _ in range(20):
+            # small vocabulary gives a lot of duplicates and skipped tokens
+            original_tokens = torch.randint(-1, 6, (16, 5))
+            predicted_tokens = torch.randint(-1, 6, (16, 7))
+            true_statistics = calculate_batch_statistics(original_tokens, predicted_tokens, [-1, 0])
+            test_statistics = calculate_batch_statistics_vectorized(original_tokens, predicted_tokens, [-1, 0])
+            for statistic in ['true_positive', 'false_positive', 'false_negative']:
+                self.assertEqual(true_statistics[statistic], test_statistics[statistic].item())
+
+    def test_accumulating_tensors(self):
+        learning_info = LearningInfo()
+        learning_info.accumulate_info({
+            'loss': torch.tensor(1.5),
+            'statistics': {'true_positive': torch.tensor(3), 'false_positive': torch.tensor(1), 'false_negative': 0}
+        })
+        learning_info.accumulate_info({
+            'loss': 0.5, 'statistics': {'true_positive': 1, 'false_positive': 1, 'false_negative': torch.tensor(4)}
+        })
+        state_dict = learning_info.get_state_dict()
+        self.assertAlmostEqual(1.0, state_dict['loss'])
+        self.assertAlmostEqual(4 / 6, state_dict['precision'])
+        self.assertAlmostEqual(0.5, state_dict['recall'])
+
     def test_calculating_zero_metrics(self):
         statistics = {
             'true_positive': 0,
@@ -0,0 +1,36 @@
+import unittest
+
+import numpy as np
+
+from data_loaders.node_budget_sampler import plan_node_budget_batches
+
+
+class NodeBudgetSamplerTest(unittest.TestCase):
+
+    def test_each_tree_in_one_batch(self):
+        rng = np.random.RandomState(7)
+        n_nodes = rng.randint(1, 100, 500)
+        depth = rng.randint(1, 20, 500)
+        tree_indexes = np.arange(1000, 1500)
+        batches = plan_node_budget_batches(tree_indexes, n_nodes, depth, 300)
+
+        all_trees = np.concatenate(batches)
+        self.assertListEqual(sorted(all_trees.tolist()), tree_indexes.tolist())
+        for batch in batches:
+            self.assertLessEqual(n_nodes[batch - 1000].sum(), 300)
+
+    def test_grouping_by_depth(self):
+        n_nodes = np.array([10, 10, 10, 10])
+        depth = np.array([5, 1, 5, 1])
+        batches = plan_node_budget_batches(np.arange(4), n_nodes, depth, 20)
+        self.assertListEqual([batch.tolist() for batch in batches], [[1, 3], [0, 2]])
+
+    def test_large_tree(self):
+        n_nodes = np.array([5, 50, 5])
+        depth = np.array([2, 2, 3])
+        batches = plan_node_budget_batches(np.arange(3), n_nodes, depth, 20)
+        self.assertListEqual([batch.tolist() for batch in batches], [[0], [1], [2]])
+
+    def test_empty(self):
+        empty = np.array([], dtype=np.int64)
+        self.assertListEqual(plan_node_budget_batches(empty, empty, empty, 20), [])
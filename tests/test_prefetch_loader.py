@@ -0,0 +1,42 @@
+import unittest
+from tempfile import TemporaryDirectory
+
+import torch
+
+from data_loaders import PrefetchLoader, TreeDGLDataset
+from tests.test_tree_dgl_dataset import _write_dataset
+
+
+class PrefetchLoaderTest(unittest.TestCase):
+
+    def test_persistent_workers(self):
+        with TemporaryDirectory() as tmp_dir:
+            _write_dataset(tmp_dir)
+            dataset = TreeDGLDataset(tmp_dir, 1, torch.device('cpu'), True)
+            loader = PrefetchLoader(dataset, 0, 2, 1, persistent=True)
+            try:
+                passes, pools = [], []
+                for _ in range(2):
+                    passes.append([(batch_id, labels.tolist()) for batch_id, _, labels, _ in loader])
+                    pools.append(loader._pool)
+                # workers are created once for all passes
+                self.assertIsNotNone(pools[0])
+                self.assertIs(pools[0], pools[1])
+            finally:
+                loader.close()
+
+        self.assertIsNone(loader._pool)
+        self.assertListEqual([(0, [[1], [2]]), (1, [[3], [4]]), (2, [[5], [6]])], passes[0])
+        self.assertListEqual(passes[0], passes[1])
+
+    def test_workers_are_stopped(self):
+        with TemporaryDirectory() as tmp_dir:
+            _write_dataset(tmp_dir)
+            dataset = TreeDGLDataset(tmp_dir, 1, torch.device('cpu'), True)
+            loader = PrefetchLoader(dataset, 0, 2, 1)
+            self.assertEqual(3, len(list(loader)))
+        self.assertIsNone(loader._pool)
+
+
+if __name__ == '__main__':
+    unittest.main()
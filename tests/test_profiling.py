@@ -0,0 +1,74 @@
+import os
+import unittest
+from json import load as json_load
+from tempfile import TemporaryDirectory
+
+import dgl
+import torch
+from torch import nn
+
+from utils.profiling import TrainingProfiler
+
+
+class _ToyModel(nn.Module):
+
+    def __init__(self):
+        super().__init__()
+        self.embedding = nn.Linear(4, 8)
+        self.encoder = nn.Linear(8, 8)
+        self.decoder = nn.Linear(8, 2)
+
+    def forward(self, x: torch.Tensor) -> torch.Tensor:
+        return self.decoder(self.encoder(self.embedding(x)))
+
+
+class ProfilingTest(unittest.TestCase):
+
+    def test_stages_and_counts(self):
+        model = _ToyModel()
+        profiler = TrainingProfiler()
+        profiler.attach(model)
+        graph = dgl.batch([dgl.graph(([0, 0], [1, 2])), dgl.graph(([0], [1]))])
+
+        profiler.add_batch(graph)
+        with profiler.stage('backward'):
+            model(torch.rand(5, 4)).sum().backward()
+        state_dict = profiler.get_state_dict()
+
+        for stage in ['embedding', 'encoder', 'decoder', 'backward']:
+            self.assertGreater(state_dict[f'time/{stage}'], 0)
+        self.assertEqual(5, state_dict['batch_nodes'])
+        self.assertEqual(3, state_dict['batch_edges'])
+        self.assertEqual(2, state_dict['batch_trees'])
+        self.assertGreater(state_dict['nodes_per_sec'], 0)
+        self.assertGreater(state_dict['peak_memory_mb'], 0)
+
+    def test_evaluation_is_not_timed(self):
+        model = _ToyModel()
+        profiler = TrainingProfiler()
+        profiler.attach(model)
+        model.eval()
+        with torch.no_grad():
+            model(torch.rand(5, 4))
+        state_dict = profiler.get_state_dict()
+
+        self.assertNotIn('time/encoder', state_dict)
+
+    def test_trace_window(self):
+        model = _ToyModel()
+        with TemporaryDirectory() as tmp_dir:
+            trace_path = os.path.join(tmp_dir, 'trace.json')
+            profiler = TrainingProfiler(trace_path, trace_start=1, trace_steps=2)
+            for step in range(4):
+                profiler.on_step_begin(step)
+                model(torch.rand(5, 4)).sum().backward()
+                profiler.on_step_end(step)
+                # the trace is written after the last step of the window
+                self.assertEqual(step >= 2, os.path.exists(trace_path))
+
+            with open(trace_path) as trace_file:
+                self.assertGreater(len(json_load(trace_file)), 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
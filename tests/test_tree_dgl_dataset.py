@@ -0,0 +1,63 @@
+import pickle
+import unittest
+from tempfile import TemporaryDirectory
+
+import numpy as np
+import torch
+from dgl import unbatch
+
+from data_loaders import TreeDGLDataset
+from data_preprocessing.batch_writer import ColumnarWriter
+from tests.test_columnar_format import _create_graph
+
+
+def _write_dataset(dataset_path: str) -> None:
+    writer = ColumnarWriter(dataset_path, np.int16, np.int16, np.int32)
+    writer.add([_create_graph(3, [0, 0], [1, 2], 10)], [[1, 2]], ['a.java'])
+    writer.add([_create_graph(2, [0], [1], 20), _create_graph(1, [], [], 30)], [[3, 4], [5, 6]],
+               ['b.java', 'c.java'])
+    writer.close()
+
+
+class TreeDGLDatasetTest(unittest.TestCase):
+
+    def test_batch_is_loaded_with_schedule(self):
+        with TemporaryDirectory() as tmp_dir:
+            _write_dataset(tmp_dir)
+            dataset = TreeDGLDataset(tmp_dir, 2, torch.device('cpu'), True)
+            batch = dataset.load_batch(0)
+
+        # batches are passed from prefetch workers by pickling
+        _, _, schedule = pickle.loads(pickle.dumps(batch))
+        self.assertListEqual([1, 2, 4], schedule.leaves.tolist())
+        # nodes of level are sorted by number of children
+        self.assertListEqual([3, 0], schedule.internal_levels[0].nodes.tolist())
+
+    def test_batch_of_trees(self):
+        with TemporaryDirectory() as tmp_dir:
+            _write_dataset(tmp_dir)
+            dataset = TreeDGLDataset(tmp_dir, 2, torch.device('cpu'), True)
+            graph, labels, _ = dataset.load_batch(0)
+
+        self.assertListEqual([1, 2, 4], graph.edges()[0].tolist())
+        self.assertListEqual([0, 0, 3], graph.edges()[1].tolist())
+        self.assertListEqual([10, 10, 10, 20, 20], graph.ndata['type'].tolist())
+        self.assertListEqual([[1, 3], [2, 4]], labels.tolist())
+        trees = unbatch(graph)
+        self.assertListEqual([3, 2], [tree.number_of_nodes() for tree in trees])
+        self.assertListEqual([[1, 2], [1]], [tree.edges()[0].tolist() for tree in trees])
+        self.assertListEqual([[20, 21], [22, 23]], trees[1].ndata['token'].tolist())
+
+    def test_split_cache(self):
+        with TemporaryDirectory() as tmp_dir:
+            _write_dataset(tmp_dir)
+            dataset = TreeDGLDataset(tmp_dir, 2, torch.device('cpu'), True, cache_size=4)
+        # each worker gets its own copy of dataset with a part of the budget
+        worker_dataset = pickle.loads(pickle.dumps(dataset))
+        worker_dataset.split_cache(2)
+        self.assertEqual(2 * 1024 ** 2, worker_dataset._cache.budget)
+        self.assertEqual(4 * 1024 ** 2, dataset._cache.budget)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,38 @@
+import unittest
+
+import numpy as np
+
+from utils.tree_operations import LEAVES_TO_ROOT, get_trees_statistics
+
+
+class TreeOperationsTest(unittest.TestCase):
+
+    def test_trees_statistics(self):
+        # first tree: 0 -> {1, 2, 3}, 1 -> {4, 5}, 3 -> 6; second tree: single node; third tree: 0 -> 1 -> 2
+        n_nodes = np.array([7, 1, 3])
+        n_edges = np.array([6, 0, 2])
+        src = np.array([3, 0, 1, 0, 1, 0, 1, 0])
+        dst = np.array([6, 1, 4, 2, 5, 3, 2, 1])
+
+        statistics = get_trees_statistics(n_nodes, n_edges, src, dst)
+
+        self.assertListEqual([7, 1, 3], statistics['n_nodes'].tolist())
+        self.assertListEqual([3, 1, 3], statistics['depth'].tolist())
+        self.assertListEqual([3, 0, 1], statistics['max_degree'].tolist())
+        self.assertListEqual([4, 1, 1], statistics['n_leaves'].tolist())
+
+    def test_statistics_of_inverted_trees(self):
+        n_nodes = np.array([7, 1, 3])
+        n_edges = np.array([6, 0, 2])
+        src = np.array([3, 0, 1, 0, 1, 0, 1, 0])
+        dst = np.array([6, 1, 4, 2, 5, 3, 2, 1])
+
+        statistics = get_trees_statistics(n_nodes, n_edges, src, dst)
+        inverted_statistics = get_trees_statistics(n_nodes, n_edges, dst, src, LEAVES_TO_ROOT)
+
+        for name, values in statistics.items():
+            self.assertListEqual(values.tolist(), inverted_statistics[name].tolist())
+
+
+if __name__ == '__main__':
+    unittest.main()
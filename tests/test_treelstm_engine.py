@@ -0,0 +1,144 @@
+import unittest
+from copy import deepcopy
+
+import dgl
+import numpy as np
+import torch
+
+from model.encoder.treelstm import TreeLSTM
+from utils.level_schedule import build_level_schedule, get_level_schedule
+from tests.generator import generate_node_with_children, generate_random_tree, generate_tree
+from utils.common import fix_seed
+
+CELL_PARAMS = {
+    'Convolutional': {'kernel': 3},
+    'SelfAttention': {'n_heads': 2}
+}
+
+
+class TreeLSTMEngineTest(unittest.TestCase):
+
+    def test_level_schedule(self):
+        # 0 <- {1, 2}, 1 <- {3, 4}, 2 <- {5, 6}, edges are directed to root
+        schedule = build_level_schedule(generate_tree(3, 2))
+
+        self.assertEqual(3, len(schedule.levels))
+        self.assertListEqual([3, 4, 5, 6], schedule.leaves.tolist())
+        self.assertEqual(2, len(schedule.internal_levels))
+        self.assertEqual(0, schedule.levels[0].children.shape[0])
+        self.assertListEqual([1, 2], schedule.levels[1].nodes.tolist())
+        # children are referenced by their positions in level order
+        self.assertListEqual([3, 4, 5, 6, 1, 2, 0], schedule.order.tolist())
+        self.assertListEqual([6, 4, 5, 0, 1, 2, 3], schedule.positions.tolist())
+        self.assertListEqual([0, 4, 6], [level.start for level in schedule.levels])
+        self.assertListEqual([0, 1, 2, 3], schedule.levels[1].children.tolist())
+        self.assertListEqual([0, 0, 1, 1], schedule.levels[1].edge_parents.tolist())
+        self.assertEqual(((2, 2),), schedule.levels[1].buckets)
+        self.assertListEqual([4, 5], schedule.levels[2].children.tolist())
+        self.assertListEqual([-1, 0, 0, 1, 1, 2, 2], schedule.parents.tolist())
+        self.assertListEqual([[0], [1, 2], [3, 4, 5, 6]], [nodes.tolist() for nodes in schedule.depth_levels])
+
+    def test_leaves_states(self):
+        # batch of single nodes, all of them are leaves and computed without propagation
+        graph = dgl.batch([generate_node_with_children(0) for _ in range(5)])
+        x = torch.rand(5, 8)
+        for engine in TreeLSTM._known_engines:
+            fix_seed()
+            tree_lstm = TreeLSTM(8, 8, {'name': 'ChildSum', 'params': {}}, engine=engine)
+            cell = tree_lstm.cell[0]
+            graph.ndata['x'] = x
+            h, c = tree_lstm(graph)
+
+            i, o, u = torch.chunk(cell.W_iou(x) + cell.b_iou, 3, 1)
+            true_c = torch.sigmoid(i) * torch.tanh(u)
+            self.assertTrue(torch.allclose(true_c, c, atol=1e-6), f"{engine} memory states of leaves are wrong")
+            self.assertTrue(
+                torch.allclose(torch.sigmoid(o) * torch.tanh(true_c), h, atol=1e-6),
+                f"{engine} hidden states of leaves are wrong"
+            )
+
+    def test_passed_schedule_is_used(self):
+        graph = generate_tree(3, 2)
+        schedule = build_level_schedule(graph)
+        # the schedule loaded with the batch isn't built again
+        self.assertIs(schedule.leaves, get_level_schedule(graph, torch.device('cpu'), schedule).leaves)
+        self.assertListEqual(schedule.leaves.tolist(), get_level_schedule(graph, torch.device('cpu')).leaves.tolist())
+
+    def test_engines_equality(self):
+        random_state = np.random.RandomState(7)
+        trees = [generate_random_tree(50, 6, 4, random_state) for _ in range(8)]
+        n_nodes = sum(tree.number_of_nodes() for tree in trees)
+        for cell in TreeLSTM.get_known_cells():
+            fix_seed()
+            cell_info = {'name': cell, 'params': CELL_PARAMS.get(cell, {})}
+            dgl_tree_lstm = TreeLSTM(8, 8, cell_info, n_layers=2, residual=True, engine='dgl')
+            levels_tree_lstm = deepcopy(dgl_tree_lstm)
+            levels_tree_lstm.engine = 'levels'
+            x = torch.rand(n_nodes, 8)
+
+            results = []
+            for tree_lstm in [dgl_tree_lstm, levels_tree_lstm]:
+                graph = dgl.batch(trees)
+                graph.ndata['x'] = x
+                h, c = tree_lstm(graph)
+                (h.sum() + c.sum()).backward()
+                results.append((h, c, [parameter.grad for parameter in tree_lstm.parameters()]))
+
+            (dgl_h, dgl_c, dgl_grads), (levels_h, levels_c, levels_grads) = results
+            self.assertTrue(torch.allclose(dgl_h, levels_h, atol=1e-6), f"{cell} hidden states are different")
+            self.assertTrue(torch.allclose(dgl_c, levels_c, atol=1e-6), f"{cell} memory states are different")
+            for dgl_grad, levels_grad in zip(dgl_grads, levels_grads):
+                self.assertTrue(torch.allclose(dgl_grad, levels_grad, atol=1e-5), f"{cell} gradients are different")
+
+    def test_wavefront_equality(self):
+        random_state = np.random.RandomState(7)
+        trees = [generate_random_tree(50, 6, 4, random_state) for _ in range(8)]
+        x = torch.rand(sum(tree.number_of_nodes() for tree in trees), 8)
+        for cell in TreeLSTM.get_known_cells():
+            for residual in [False, True]:
+                fix_seed()
+                cell_info = {'name': cell, 'params': CELL_PARAMS.get(cell, {})}
+                levels_tree_lstm = TreeLSTM(8, 8, cell_info, n_layers=3, residual=residual, engine='levels')
+                wavefront_tree_lstm = deepcopy(levels_tree_lstm)
+                wavefront_tree_lstm.engine = 'wavefront'
+
+                results = []
+                for tree_lstm in [levels_tree_lstm, wavefront_tree_lstm]:
+                    graph = dgl.batch(trees)
+                    graph.ndata['x'] = x
+                    h, c = tree_lstm(graph)
+                    (h.sum() + c.sum()).backward()
+                    results.append((h, c, [parameter.grad for parameter in tree_lstm.parameters()]))
+
+                (levels_h, levels_c, levels_grads), (wavefront_h, wavefront_c, wavefront_grads) = results
+                self.assertTrue(torch.allclose(levels_h, wavefront_h, atol=1e-6), f"{cell} outputs are different")
+                self.assertTrue(torch.allclose(levels_c, wavefront_c, atol=1e-6), f"{cell} memory states are different")
+                for levels_grad, wavefront_grad in zip(levels_grads, wavefront_grads):
+                    # layer norms aren't used without residual connections
+                    if levels_grad is None:
+                        self.assertIsNone(wavefront_grad)
+                        continue
+                    self.assertTrue(
+                        torch.allclose(levels_grad, wavefront_grad, atol=1e-5), f"{cell} gradients are different"
+                    )
+
+    def test_fused_child_sum_loads_child_sum(self):
+        random_state = np.random.RandomState(7)
+        graph = dgl.batch([generate_random_tree(50, 6, 4, random_state) for _ in range(8)])
+        x = torch.rand(graph.number_of_nodes(), 8)
+        fix_seed()
+        child_sum = TreeLSTM(8, 8, {'name': 'ChildSum', 'params': {}}, n_layers=2, engine='levels')
+        fused_child_sum = TreeLSTM(8, 8, {'name': 'FusedChildSum', 'params': {}}, n_layers=2, engine='levels')
+        fused_child_sum.load_state_dict(child_sum.state_dict())
+
+        graph.ndata['x'] = x
+        h, c = child_sum(graph)
+        graph.ndata['x'] = x
+        fused_h, fused_c = fused_child_sum(graph)
+
+        self.assertTrue(torch.allclose(h, fused_h, atol=1e-6))
+        self.assertTrue(torch.allclose(c, fused_c, atol=1e-6))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,44 +1,71 @@
+import os
 from argparse import ArgumentParser
 from json import load as json_load
 from pickle import load as pkl_load
 from typing import Dict
 
+import numpy as np
 import torch
 import torch.nn as nn
 
 from data_loaders import TreeDGLDataset
 from logger import known_loggers, create_logger
 from model.tree2seq import Tree2Seq
-from trainer import evaluate_on_dataset, train_on_dataset
+from trainer import AsyncEvaluator, create_evaluation_loader, evaluate_on_dataset, train_on_dataset
+from utils.checkpoint_writer import load_checkpoint
 from utils.common import fix_seed, get_device, PAD
+from utils.distributed import (
+    init_distributed, is_distributed_launch, shard_batch_order, unwrap_model, wrap_model
+)
+from utils.profiling import TrainingProfiler
 from utils.scheduler import get_scheduler
 
 
 def train(params: Dict, logger_name: str) -> None:
     fix_seed()
     device = get_device()
+    # processes are started by torch.distributed launcher, e.g. torchrun --nproc_per_node N train.py ...
+    rank, world_size = 0, 1
+    if is_distributed_launch():
+        rank, world_size = init_distributed(params.get('distributed_backend', 'gloo'))
+        if device.type == 'cuda':
+            device = torch.device(f"cuda:{os.environ.get('LOCAL_RANK', 0)}")
+        print(f"process {rank} of {world_size}")
     print(f"using {device} device")
 
     is_resumed = 'resume' in params
     checkpoint = {}
     if is_resumed:
-        checkpoint = torch.load(params['resume'], map_location=device)
+        checkpoint = load_checkpoint(params['resume'], map_location=device)
         resume_wandb_id = params.get('resume_wandb_id', False)
         params = checkpoint['config']
         params['resume_wandb_id'] = resume_wandb_id
 
-    training_set = TreeDGLDataset(
-        params['paths']['train'], params['batch_size'], device, True,
-        params.get('max_n_nodes', -1), params.get('max_depth', -1)
-    )
-    validation_set = TreeDGLDataset(params['paths']['validate'], params['batch_size'], device, True)
-
     with open(params['paths']['vocabulary'], 'rb') as pkl_file:
         vocabulary = pkl_load(pkl_file)
         token_to_id = vocabulary['token_to_id']
         type_to_id = vocabulary['type_to_id']
         label_to_id = vocabulary['label_to_id']
 
+    training_set = TreeDGLDataset(
+        params['paths']['train'], params['batch_size'], device, True,
+        params.get('max_n_nodes', -1), params.get('max_depth', -1), params.get('cache_size', 1024),
+        params.get('max_batch_nodes', -1), label_to_id[PAD]
+    )
+    validation_params = {
+        'dataset_path': params['paths']['validate'], 'batch_size': params['batch_size'], 'device': device,
+        'invert_edges': True, 'cache_size': params.get('cache_size', 1024),
+        'max_batch_nodes': params.get('max_batch_nodes', -1), 'label_pad_index': label_to_id[PAD]
+    }
+    # with asynchronous evaluation validation set is owned by evaluator process
+    is_async_evaluation = params.get('async_evaluation', False)
+    validation_loader = None
+    if not is_async_evaluation:
+        # workers of validation loader are kept between evaluations
+        validation_loader = create_evaluation_loader(
+            TreeDGLDataset(**validation_params), params.get('n_workers', 0), params.get('prefetch_depth', 2)
+        )
+
     print('model initializing...')
     # create model
     model = Tree2Seq(
@@ -47,14 +74,17 @@ def train(params: Dict, logger_name: str) -> None:
     ).to(device)
     if 'state_dict' in checkpoint:
         model.load_state_dict(checkpoint['state_dict'])
+    configuration = model.get_configuration()
+    if world_size > 1:
+        model = wrap_model(model, device)
 
     # create optimizer
     optimizer = torch.optim.Adam(model.parameters(), lr=params['lr'], weight_decay=params['weight_decay'])
     if 'optimizer_state_dict' in checkpoint:
         optimizer.load_state_dict(checkpoint['optimizer_state_dict'])
 
-    # create scheduler
-    scheduler = get_scheduler(params['scheduler'], optimizer, len(training_set) * params['n_epochs'])
+    # create scheduler, each process makes a step per its batch, so steps are counted over a shard of batches
+    scheduler = get_scheduler(params['scheduler'], optimizer, len(training_set) // world_size * params['n_epochs'])
     if 'scheduler_state_dict' in checkpoint:
         scheduler.load_state_dict(checkpoint['scheduler_state_dict'])
 
@@ -62,36 +92,89 @@ def train(params: Dict, logger_name: str) -> None:
     criterion = nn.CrossEntropyLoss(ignore_index=label_to_id[PAD]).to(device)
 
     # init logger
-    logger = create_logger(logger_name, params['logging_folder'], params['checkpoints_folder'], params)
-    logger.add_to_saving('configuration', model.get_configuration())
+    logger = create_logger(logger_name, params['logging_folder'], params['checkpoints_folder'], params, rank)
+    logger.add_to_saving('configuration', configuration)
+
+    # evaluator is created by the main process only, other processes skip evaluation
+    evaluator = None
+    evaluation_step = params['evaluation_step']
+    if is_async_evaluation and rank == 0:
+        evaluator = AsyncEvaluator(
+            configuration, validation_params, label_to_id[PAD], params.get('n_workers', 0),
+            params.get('prefetch_depth', 2), params.get('max_pending_snapshots', 1)
+        )
+    elif is_async_evaluation:
+        evaluation_step = -1
+
+    # profiler synchronizes device around stages, so it's disabled by default
+    profiler = None
+    profiling_params = params.get('profiling', {})
+    if profiling_params.get('enabled', False):
+        profiler = TrainingProfiler(
+            os.path.join(params['logging_folder'], f'trace_rank_{rank}.json'),
+            profiling_params.get('trace_start', -1), profiling_params.get('trace_steps', 0)
+        )
+        profiler.attach(model)
 
     start_batch_id = checkpoint.get('batch_id', -1) + 1
     # train loop
     print("ok, let's train it")
-    for epoch in range(params['n_epochs']):
-        logger.epoch = epoch
-
-        # train 1 epoch
-        train_on_dataset(
-            training_set, validation_set, model, criterion, optimizer, scheduler, params['clip_norm'], logger,
-            start_batch_id, params['logging_step'], params['evaluation_step'], params['checkpoint_step']
-        )
-
-        eval_epoch_info = evaluate_on_dataset(validation_set, model, criterion)
-        logger.log(eval_epoch_info.get_state_dict(), len(training_set), is_train=False)
-
-        model_dump = {
-            'state_dict': model.state_dict(),
-            'optimizer_state_dict': optimizer.state_dict(),
-            'scheduler_state_dict': scheduler.state_dict(),
-        }
-        logger.save_model(f'epoch_{epoch}.pt', model_dump)
+    try:
+        for epoch in range(params['n_epochs']):
+            logger.epoch = epoch
+            batch_order = list(range(len(training_set)))
+            # batches with node budget are ordered by depth and size of trees inside each file,
+            # so they are always shuffled, otherwise each epoch would go from shallow trees to deep ones
+            if params.get('shuffle_batches', False) or training_set.max_batch_nodes > 0:
+                # order depends only on epoch, so resumed training visits the same batches
+                batch_order = training_set.get_batch_order(np.random.RandomState(epoch))
+            # the order is the same in all processes, so their shards don't intersect
+            batch_order = shard_batch_order(batch_order, rank, world_size)
+
+            # train 1 epoch
+            train_on_dataset(
+                training_set, validation_loader, model, criterion, optimizer, scheduler, params['clip_norm'], logger,
+                start_batch_id, params['logging_step'], evaluation_step, params['checkpoint_step'],
+                params.get('n_workers', 0), params.get('prefetch_depth', 2), batch_order, evaluator,
+                profiler
+            )
+
+            # score of the epoch checkpoint, the best one is kept by checkpoints rotation
+            score = None
+            if evaluator is not None:
+                # score is set when the result arrives
+                evaluator.submit(len(batch_order), model, f'epoch_{epoch}.pt')
+            elif not is_async_evaluation:
+                eval_epoch_info = evaluate_on_dataset(validation_loader, model, criterion)
+                eval_state_dict = eval_epoch_info.get_state_dict()
+                logger.log(eval_state_dict, len(batch_order), is_train=False)
+                score = eval_state_dict['f1_score']
+
+            model_dump = {
+                'state_dict': unwrap_model(model).state_dict(),
+                'optimizer_state_dict': optimizer.state_dict(),
+                'scheduler_state_dict': scheduler.state_dict(),
+            }
+            logger.save_model(f'epoch_{epoch}.pt', model_dump, score)
+        if evaluator is not None:
+            evaluator.close(logger)
+    except BaseException:
+        # failed training doesn't wait for evaluation of its snapshots
+        if evaluator is not None:
+            evaluator.terminate()
+        raise
+    finally:
+        if validation_loader is not None:
+            validation_loader.close()
+        logger.close()
 
 
 if __name__ == '__main__':
     arg_parse = ArgumentParser()
     arg_parse.add_argument('config', type=str, help='path to config json')
     arg_parse.add_argument('logger', choices=known_loggers.keys())
+    # torch.distributed.launch passes it to each process, rank is taken from environment variables instead
+    arg_parse.add_argument('--local_rank', type=int, default=0, help='local rank of the process, ignored')
     args = arg_parse.parse_args()
 
     with open(args.config) as config_file:
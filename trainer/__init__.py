@@ -1 +1,2 @@
-from .trainer import evaluate_on_dataset, train_on_dataset
+from .trainer import create_evaluation_loader, evaluate_on_dataset, train_on_dataset
+from .async_evaluator import AsyncEvaluator
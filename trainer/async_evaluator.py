@@ -0,0 +1,140 @@
+import signal
+from collections import deque
+from queue import Empty
+from typing import Dict, Optional, Tuple
+
+import torch
+import torch.multiprocessing as mp
+import torch.nn as nn
+
+from logger import AbstractLogger
+from utils.distributed import unwrap_model
+
+
+def _stop_evaluator(signum, frame) -> None:
+    raise SystemExit()
+
+
+def _run_evaluator(
+        snapshots: mp.Queue, results: mp.Queue, model_configuration: Dict, dataset_params: Dict, pad_index: int,
+        n_workers: int, prefetch_depth: int
+) -> None:
+    # imported here to avoid cyclic import with trainer module, that uses evaluator
+    from data_loaders import TreeDGLDataset
+    from model.tree2seq import Tree2Seq
+    from trainer.trainer import create_evaluation_loader, evaluate_on_dataset
+
+    # terminated evaluator still stops workers of its loader
+    signal.signal(signal.SIGTERM, _stop_evaluator)
+    dataset = TreeDGLDataset(**dataset_params)
+    model = Tree2Seq(**model_configuration).to(dataset.device)
+    criterion = nn.CrossEntropyLoss(ignore_index=pad_index).to(dataset.device)
+    loader = create_evaluation_loader(dataset, n_workers, prefetch_depth)
+    try:
+        while True:
+            snapshot = snapshots.get()
+            if snapshot is None:
+                break
+            batch_id, state_dict = snapshot
+            model.load_state_dict(state_dict)
+            eval_info = evaluate_on_dataset(loader, model, criterion)
+            results.put((batch_id, eval_info.get_state_dict()))
+    finally:
+        loader.close()
+
+
+class AsyncEvaluator:
+    """Evaluate snapshots of the model in a separate process, that owns its own validation dataset.
+    Training process only copies weights to CPU, evaluator gets one snapshot at a time.
+    Snapshots submitted while evaluator is busy wait in the training process, at most `max_pending` of them,
+    the oldest waiting snapshot is skipped when a new one doesn't fit. Results are tagged with the batch id
+    of the snapshot and logged by the training process on poll or close. If the snapshot is saved as a checkpoint,
+    its F1 score is passed to the logger as the score of the checkpoint, so the best one is kept by rotation.
+
+    :param model_configuration: configuration of Tree2Seq model to create it in evaluator
+    :param dataset_params: params of TreeDGLDataset for validation
+    :param pad_index: index of padding label, that is ignored by the loss
+    :param n_workers: number of workers for loading batches in evaluator
+    :param prefetch_depth: number of batches loaded in advance
+    :param max_pending: number of snapshots waiting for evaluator
+    """
+
+    def __init__(
+            self, model_configuration: Dict, dataset_params: Dict, pad_index: int, n_workers: int = 0,
+            prefetch_depth: int = 2, max_pending: int = 1
+    ):
+        context = mp.get_context('spawn')
+        self._snapshots = context.Queue()
+        self._results = context.Queue()
+        # waiting snapshots with names of their checkpoints
+        self._pending = deque(maxlen=max_pending)
+        self._is_evaluating = False
+        self._evaluating_checkpoint = None
+        self._process = context.Process(
+            target=_run_evaluator,
+            args=(
+                self._snapshots, self._results, model_configuration, dataset_params, pad_index,
+                n_workers, prefetch_depth
+            )
+        )
+        self._process.start()
+
+    def _send_pending(self) -> None:
+        if not self._is_evaluating and len(self._pending) > 0:
+            batch_id, state_dict, self._evaluating_checkpoint = self._pending.popleft()
+            self._snapshots.put((batch_id, state_dict))
+            self._is_evaluating = True
+
+    def submit(self, batch_id: int, model: nn.Module, checkpoint_name: Optional[str] = None) -> None:
+        """Send snapshot of the model to evaluator
+
+        :param batch_id: batch id to log the result with
+        :param model: model to evaluate
+        :param checkpoint_name: name of the checkpoint saved from the same model, that gets the score
+        """
+        state_dict = {
+            key: value.detach().to('cpu', copy=True) for key, value in unwrap_model(model).state_dict().items()
+        }
+        if len(self._pending) == self._pending.maxlen:
+            print(f"evaluator is busy, skip snapshot of batch {self._pending[0][0]}")
+        self._pending.append((batch_id, state_dict, checkpoint_name))
+        self._send_pending()
+
+    def _log_result(self, result: Tuple[int, Dict], logger: AbstractLogger) -> None:
+        batch_id, state_dict = result
+        logger.log(state_dict, batch_id, is_train=False)
+        if self._evaluating_checkpoint is not None:
+            logger.set_score(self._evaluating_checkpoint, state_dict['f1_score'])
+        self._is_evaluating = False
+        self._evaluating_checkpoint = None
+        self._send_pending()
+
+    def poll(self, logger: AbstractLogger) -> None:
+        """Log finished evaluation without waiting and send the next snapshot"""
+        if not self._is_evaluating:
+            return
+        try:
+            result = self._results.get_nowait()
+        except Empty:
+            return
+        self._log_result(result, logger)
+
+    def close(self, logger: AbstractLogger) -> None:
+        """Wait for all submitted snapshots, log their results and stop evaluator"""
+        while self._is_evaluating:
+            if not self._process.is_alive() and self._results.empty():
+                raise RuntimeError(f"evaluator stopped with {len(self._pending) + 1} snapshots not evaluated")
+            try:
+                self._log_result(self._results.get(timeout=1.), logger)
+            except Empty:
+                continue
+        self._snapshots.put(None)
+        self._process.join()
+
+    def terminate(self) -> None:
+        """Stop evaluator without waiting for submitted snapshots, e.g. when training failed"""
+        self._pending.clear()
+        self._process.terminate()
+        self._process.join()
+        # snapshot may stay in the queue buffer, it shouldn't block exit of the training process
+        self._snapshots.cancel_join_thread()
@@ -6,18 +6,24 @@ from torch import nn
 
 from model.tree2seq import Tree2Seq
 from utils.common import PAD, UNK, EOS
-from utils.metrics import calculate_batch_statistics
+from utils.distributed import unwrap_model
+from utils.level_schedule import LevelSchedule
+from utils.metrics import calculate_batch_statistics_vectorized
+from utils.profiling import TrainingProfiler, profile_stage
 
 
 def _forward_pass(
-        model: Tree2Seq, graph: dgl.DGLGraph, labels: torch.Tensor, criterion: nn.modules.loss
+        model: Tree2Seq, graph: dgl.DGLGraph, labels: torch.Tensor, schedule: LevelSchedule,
+        criterion: nn.modules.loss, profiler: TrainingProfiler = None
 ) -> Tuple[torch.Tensor, torch.Tensor, Dict]:
     """Make model step
 
-    :param model: Tree2Seq model
+    :param model: Tree2Seq model, possibly wrapped for distributed training
     :param graph: batched dgl graph
     :param labels: [seq len; batch size] ground truth labels
+    :param schedule: level schedule of the batch, if it's loaded with it
     :param criterion: criterion to optimize
+    :param profiler: profiler to time computation of loss and metrics
     :return: Tuple[
         loss [1] torch tensor with loss information
         prediction [the longest sequence, batch size]
@@ -25,49 +31,57 @@ def _forward_pass(
     ]
     """
     # [seq len; batch size; vocab size]
-    root_logits = model(graph, labels)
-
-    # if seq len in labels equal to 1, then model solve classification task
-    # for longer sequences we should remove <SOS> token, since it's always on the first place
-    if labels.shape[0] > 1:
-        # [seq len - 1; batch size; vocab size]
-        root_logits = root_logits[1:]
-        # [seq len - 1; batch size]
-        labels = labels[1:]
-
-    loss = criterion(root_logits.reshape(-1, root_logits.shape[-1]), labels.reshape(-1))
-    # [the longest sequence, batch size]
-    prediction = model.predict(root_logits)
-
-    # Calculate metrics
-    skipping_tokens = [model.decoder.label_to_id[token]
-                       for token in [PAD, UNK, EOS]
-                       if token in model.decoder.label_to_id]
-    batch_info = {
-        'loss': loss.item(),
-        'statistics':
-            calculate_batch_statistics(
-                labels.t(), prediction.t(), skipping_tokens
-            )
-    }
+    root_logits = model(graph, labels, schedule)
+
+    with profile_stage(profiler, 'loss'):
+        # if seq len in labels equal to 1, then model solve classification task
+        # for longer sequences we should remove <SOS> token, since it's always on the first place
+        if labels.shape[0] > 1:
+            # [seq len - 1; batch size; vocab size]
+            root_logits = root_logits[1:]
+            # [seq len - 1; batch size]
+            labels = labels[1:]
+
+        loss = criterion(root_logits.reshape(-1, root_logits.shape[-1]), labels.reshape(-1))
+        # [the longest sequence, batch size]
+        prediction = unwrap_model(model).predict(root_logits)
+
+        # Calculate metrics
+        label_to_id = unwrap_model(model).decoder.label_to_id
+        skipping_tokens = [label_to_id[token]
+                           for token in [PAD, UNK, EOS]
+                           if token in label_to_id]
+        # loss and statistics are kept on the device, they are read only at logging
+        batch_info = {
+            'loss': loss.detach(),
+            'statistics':
+                calculate_batch_statistics_vectorized(
+                    labels.t(), prediction.t(), skipping_tokens
+                )
+        }
 
     return loss, prediction, batch_info
 
 
 def train_on_batch(
         model: Tree2Seq, criterion: nn.modules.loss, optimizer: torch.optim, scheduler: torch.optim.lr_scheduler,
-        graph: dgl.DGLGraph, labels: torch.Tensor, clip_norm: int
+        graph: dgl.DGLGraph, labels: torch.Tensor, schedule: LevelSchedule, clip_norm: int,
+        profiler: TrainingProfiler = None
 ) -> Dict:
     model.train()
+    if profiler is not None:
+        profiler.add_batch(graph)
 
     # Model step
     model.zero_grad()
-    loss, prediction, batch_info = _forward_pass(model, graph, labels, criterion)
+    loss, prediction, batch_info = _forward_pass(model, graph, labels, schedule, criterion, profiler)
     batch_info['learning_rate'] = scheduler.get_last_lr()[0]
-    loss.backward()
-    nn.utils.clip_grad_value_(model.parameters(), clip_norm)
-    optimizer.step()
-    scheduler.step()
+    with profile_stage(profiler, 'backward'):
+        loss.backward()
+    with profile_stage(profiler, 'optimizer'):
+        nn.utils.clip_grad_value_(model.parameters(), clip_norm)
+        optimizer.step()
+        scheduler.step()
     del loss
     del prediction
     torch.cuda.empty_cache()
@@ -77,12 +91,12 @@ def train_on_batch(
 
 def eval_on_batch(
         model: Tree2Seq, criterion: nn.modules.loss, graph: dgl.DGLGraph,
-        labels: torch.Tensor
+        labels: torch.Tensor, schedule: LevelSchedule = None
 ) -> Tuple[Dict, torch.Tensor]:
     model.eval()
     # Model step
     with torch.no_grad():
-        loss, prediction, batch_info = _forward_pass(model, graph, labels, criterion)
+        loss, prediction, batch_info = _forward_pass(model, graph, labels, schedule, criterion)
         del loss
 
     return batch_info, prediction
@@ -1,52 +1,92 @@
+from typing import List
+
 import torch
 import torch.nn as nn
-from torch.utils.data import Dataset
 from tqdm.auto import tqdm
 
+from data_loaders import TreeDGLDataset, PrefetchLoader
 from logger import AbstractLogger
 from model.tree2seq import Tree2Seq
+from trainer.async_evaluator import AsyncEvaluator
 from trainer.batch_step import eval_on_batch, train_on_batch
 from utils.common import is_step_match
+from utils.distributed import get_rank, get_world_size, unwrap_model
 from utils.learning_info import LearningInfo
+from utils.profiling import TrainingProfiler
+
+
+def create_evaluation_loader(dataset: TreeDGLDataset, n_workers: int = 0, prefetch_depth: int = 2) -> PrefetchLoader:
+    """Create loader for repeated evaluations, its workers are kept between them, so it should be closed.
+    In distributed training each process evaluates its part of batches.
+    """
+    order = list(range(get_rank(), len(dataset), get_world_size()))
+    return PrefetchLoader(dataset, 0, n_workers, prefetch_depth, order, persistent=True)
 
 
-def evaluate_on_dataset(dataset: Dataset, model: Tree2Seq, criterion: nn.modules.loss) -> LearningInfo:
+def evaluate_on_dataset(loader: PrefetchLoader, model: Tree2Seq, criterion: nn.modules.loss) -> LearningInfo:
+    """Evaluate model on batches of loader (see create_evaluation_loader), in distributed training
+    gradients aren't synchronized, and results are summed over processes
+    """
     eval_epoch_info = LearningInfo()
 
-    for batch_id in tqdm(range(len(dataset))):
-        graph, labels = dataset[batch_id]
+    for batch_id, graph, labels, schedule in tqdm(loader):
         batch_info, prediction = eval_on_batch(
-            model, criterion, graph, labels
+            unwrap_model(model), criterion, graph, labels, schedule
         )
         eval_epoch_info.accumulate_info(batch_info)
         del prediction
 
+    eval_epoch_info.all_reduce()
     return eval_epoch_info
 
 
 def train_on_dataset(
-        train_dataset: Dataset, val_dataset, model: Tree2Seq, criterion: nn.modules.loss, optimizer: torch.optim,
-        scheduler: torch.optim.lr_scheduler, clip_norm: int, logger: AbstractLogger, start_batch_id: int = 0,
-        log_step: int = -1, eval_step: int = -1, save_step: int = -1
+        train_dataset: TreeDGLDataset, val_loader: PrefetchLoader, model: Tree2Seq, criterion: nn.modules.loss,
+        optimizer: torch.optim, scheduler: torch.optim.lr_scheduler, clip_norm: int, logger: AbstractLogger,
+        start_batch_id: int = 0, log_step: int = -1, eval_step: int = -1, save_step: int = -1,
+        n_workers: int = 0, prefetch_depth: int = 2, batch_order: List[int] = None, evaluator: AsyncEvaluator = None,
+        profiler: TrainingProfiler = None
 ):
+    """Train model for one epoch. In distributed training batch order should contain only batches
+    of the current process and have the same length in all processes, see utils.distributed.shard_batch_order.
+    If evaluator is passed, snapshots of the model are sent to it instead of evaluating in place,
+    and finished evaluations are logged as they come.
+    If profiler is passed, times of training stages and throughput are logged with training statistics,
+    the model should be attached to the profiler in advance.
+    """
     train_epoch_info = LearningInfo()
 
-    batch_iterator_pb = tqdm(range(start_batch_id, len(train_dataset)), total=len(train_dataset))
+    loader = PrefetchLoader(train_dataset, start_batch_id, n_workers, prefetch_depth, batch_order)
+    n_steps = len(loader.order)
+    batch_iterator_pb = tqdm(loader, total=n_steps)
     batch_iterator_pb.update(start_batch_id)
     batch_iterator_pb.refresh()
 
-    for batch_id in batch_iterator_pb:
-        graph, labels = train_dataset[batch_id]
-        batch_info = train_on_batch(model, criterion, optimizer, scheduler, graph, labels, clip_norm)
+    if profiler is not None:
+        profiler.start('data')
+    for batch_id, graph, labels, schedule in batch_iterator_pb:
+        if profiler is not None:
+            profiler.stop('data')
+            profiler.on_step_begin(batch_id)
+        batch_info = train_on_batch(
+            model, criterion, optimizer, scheduler, graph, labels, schedule, clip_norm, profiler
+        )
         train_epoch_info.accumulate_info(batch_info)
+        if profiler is not None:
+            profiler.on_step_end(batch_id)
 
         if is_step_match(batch_id, log_step):
-            logger.log(train_epoch_info.get_state_dict(), batch_id, is_train=True)
+            train_epoch_info.all_reduce()
+            state_dict = train_epoch_info.get_state_dict()
+            state_dict.update(loader.get_cache_state_dict())
+            if profiler is not None:
+                state_dict.update(profiler.get_state_dict())
+            logger.log(state_dict, batch_id, is_train=True)
             train_epoch_info = LearningInfo()
 
         if is_step_match(batch_id, save_step):
             train_dump = {
-                'state_dict': model.state_dict(),
+                'state_dict': unwrap_model(model).state_dict(),
                 'optimizer_state_dict': optimizer.state_dict(),
                 'scheduler_state_dict': scheduler.state_dict(),
                 'batch_id': batch_id
@@ -54,8 +94,20 @@ def train_on_dataset(
             logger.save_model(f'batch_{batch_id}.pt', train_dump)
 
         if is_step_match(batch_id, eval_step):
-            eval_info = evaluate_on_dataset(val_dataset, model, criterion)
-            logger.log(eval_info.get_state_dict(), batch_id, is_train=False)
+            if evaluator is None:
+                eval_info = evaluate_on_dataset(val_loader, model, criterion)
+                logger.log(eval_info.get_state_dict(), batch_id, is_train=False)
+            else:
+                evaluator.submit(batch_id, model)
+
+        if evaluator is not None:
+            evaluator.poll(logger)
+
+        if profiler is not None:
+            profiler.start('data')
 
+    if profiler is not None:
+        profiler.stop('data')
+    train_epoch_info.all_reduce()
     if train_epoch_info.batch_processed > 0:
-        logger.log(train_epoch_info.get_state_dict(), len(train_dataset) - 1, is_train=True)
+        logger.log(train_epoch_info.get_state_dict(), n_steps - 1, is_train=True)
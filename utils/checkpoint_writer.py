@@ -0,0 +1,165 @@
+import os
+from queue import Queue
+from threading import Thread
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import torch
+
+VOCABULARY_NAME = 'vocabulary.pt'
+VOCABULARY_KEYS = ['token_to_id', 'type_to_id', 'label_to_id']
+
+
+def _snapshot(obj: Any) -> Any:
+    """Copy all tensors of (nested) object to CPU, so training can continue changing them"""
+    if isinstance(obj, torch.Tensor):
+        return obj.detach().to('cpu', copy=True)
+    if isinstance(obj, dict):
+        return obj.__class__((key, _snapshot(value)) for key, value in obj.items())
+    if isinstance(obj, (list, tuple)):
+        return obj.__class__(_snapshot(value) for value in obj)
+    return obj
+
+
+def _atomic_save(obj: Any, path: str) -> None:
+    tmp_path = f'{path}.tmp'
+    torch.save(obj, tmp_path)
+    os.replace(tmp_path, path)
+
+
+def split_vocabulary(checkpoint: Dict) -> Tuple[Dict, Dict]:
+    """Move vocabularies out of model configuration of the checkpoint
+
+    :return: checkpoint without vocabularies and dict with them
+    """
+    if 'configuration' not in checkpoint:
+        return checkpoint, {}
+    configuration = dict(checkpoint['configuration'])
+    vocabulary = {key: configuration.pop(key) for key in VOCABULARY_KEYS if key in configuration}
+    checkpoint = dict(checkpoint, configuration=configuration)
+    return checkpoint, vocabulary
+
+
+def load_checkpoint(path: str, map_location: torch.device = None) -> Dict:
+    """Load checkpoint and restore vocabularies in model configuration,
+    if they are stored once per run in the file next to the checkpoint
+    """
+    checkpoint = torch.load(path, map_location=map_location)
+    configuration = checkpoint.get('configuration')
+    if configuration is not None and any(key not in configuration for key in VOCABULARY_KEYS):
+        vocabulary_path = os.path.join(os.path.dirname(path), VOCABULARY_NAME)
+        if not os.path.exists(vocabulary_path):
+            raise ValueError(f"no vocabulary for checkpoint {path}, it should be in {vocabulary_path}")
+        configuration.update(torch.load(vocabulary_path))
+    return checkpoint
+
+
+class CheckpointWriter:
+    """Write checkpoints in a background thread.
+    Saving only copies tensors to CPU, serialization and writing happens in the thread, each file is written
+    to a temporary one and then atomically replaced, so an interrupted write doesn't leave a broken checkpoint.
+    In each folder only the last keep_last checkpoints are kept together with the one with the best score.
+    Score can be set after saving, e.g. when the checkpoint is evaluated asynchronously.
+
+    :param keep_last: number of the last checkpoints to keep, -1 to keep all of them
+    :param on_saved: function called with the path of each written file
+    """
+
+    def __init__(self, keep_last: int = -1, on_saved: Callable[[str], None] = None):
+        self.keep_last = keep_last
+        self.on_saved = on_saved
+        self._saved_once = set()
+        # checkpoints of each folder in order of saving with their scores
+        self._checkpoints: Dict[str, List[Tuple[str, Optional[float]]]] = {}
+        self._error = None
+        self._queue = Queue()
+        self._thread = Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def _run(self) -> None:
+        while True:
+            task = self._queue.get()
+            try:
+                if task is None:
+                    return
+                obj, path, is_rotated, score = task
+                # task without object only updates the score of saved checkpoint
+                if obj is None:
+                    self._update_score(path, score)
+                    continue
+                _atomic_save(obj, path)
+                if self.on_saved is not None:
+                    self.on_saved(path)
+                if is_rotated:
+                    self._rotate(path, score)
+            except Exception as err:
+                self._error = err
+            finally:
+                self._queue.task_done()
+
+    def _rotate(self, path: str, score: Optional[float]) -> None:
+        # the same name can be saved again, e.g. batch checkpoints of each epoch,
+        # the file is rewritten, so only its last saving takes part in rotation
+        folder = os.path.dirname(path)
+        checkpoints = [checkpoint for checkpoint in self._checkpoints.get(folder, []) if checkpoint[0] != path]
+        checkpoints.append((path, score))
+        self._checkpoints[folder] = checkpoints
+        self._remove_old(folder)
+
+    def _update_score(self, path: str, score: float) -> None:
+        # checkpoint removed before its score arrived stays removed
+        folder = os.path.dirname(path)
+        checkpoints = self._checkpoints.get(folder, [])
+        self._checkpoints[folder] = [
+            (checkpoint_path, score if checkpoint_path == path else checkpoint_score)
+            for checkpoint_path, checkpoint_score in checkpoints
+        ]
+        self._remove_old(folder)
+
+    def _remove_old(self, folder: str) -> None:
+        checkpoints = self._checkpoints.get(folder, [])
+        if self.keep_last == -1 or len(checkpoints) <= self.keep_last:
+            return
+        scored = [checkpoint for checkpoint in checkpoints if checkpoint[1] is not None]
+        best = max(scored, key=lambda checkpoint: checkpoint[1])[0] if len(scored) > 0 else None
+        kept = []
+        for i, (checkpoint_path, checkpoint_score) in enumerate(checkpoints):
+            if i >= len(checkpoints) - self.keep_last or checkpoint_path == best:
+                kept.append((checkpoint_path, checkpoint_score))
+            elif os.path.exists(checkpoint_path):
+                os.remove(checkpoint_path)
+        self._checkpoints[folder] = kept
+
+    def _check_error(self) -> None:
+        if self._error is not None:
+            error, self._error = self._error, None
+            raise RuntimeError(f"failed to write checkpoint: {error}") from error
+
+    def save(self, obj: Any, path: str, score: float = None) -> None:
+        """Save object to path in background, the file takes part in rotation.
+        Score is used to keep the best checkpoint, the higher the better.
+        """
+        self._check_error()
+        self._queue.put((_snapshot(obj), path, True, score))
+
+    def set_score(self, path: str, score: float) -> None:
+        """Set score of the checkpoint saved to path, if it is still kept by rotation"""
+        self._check_error()
+        self._queue.put((None, path, True, score))
+
+    def save_once(self, obj: Any, path: str) -> None:
+        """Save object to path in background only the first time, the file doesn't take part in rotation"""
+        self._check_error()
+        if path in self._saved_once:
+            return
+        self._saved_once.add(path)
+        self._queue.put((_snapshot(obj), path, False, None))
+
+    def flush(self) -> None:
+        """Wait until all checkpoints are written"""
+        self._queue.join()
+        self._check_error()
+
+    def close(self) -> None:
+        self.flush()
+        self._queue.put(None)
+        self._thread.join()
@@ -0,0 +1,54 @@
+import json
+import os
+from typing import Dict, Tuple
+
+import numpy as np
+
+INDEX_NAME = 'index.json'
+FORMAT_NAME = 'columnar'
+FORMAT_VERSION = 1
+
+# columns of the format, each one is a flat binary file
+NODE_OFFSETS = 'node_offsets'
+EDGE_OFFSETS = 'edge_offsets'
+SRC = 'src'
+DST = 'dst'
+TOKEN = 'token'
+TYPE = 'type'
+LABEL = 'label'
+SOURCE_PATHS = 'source_paths.txt'
+
+
+def get_compact_dtype(vocabulary_size: int) -> np.dtype:
+    """The smallest signed integer type, that fits all ids of vocabulary"""
+    return np.dtype(np.int16) if vocabulary_size <= np.iinfo(np.int16).max + 1 else np.dtype(np.int32)
+
+
+def get_column_path(dataset_path: str, column: str) -> str:
+    return os.path.join(dataset_path, f'{column}.bin')
+
+
+def is_columnar_dataset(dataset_path: str) -> bool:
+    return os.path.exists(os.path.join(dataset_path, INDEX_NAME))
+
+
+def load_columnar_dataset(dataset_path: str) -> Tuple[Dict, Dict[str, np.ndarray]]:
+    """Memory map columns of dataset in columnar format.
+    Nodes and edges of all graphs are stored one after another, offsets of graph i are in [offsets[i], offsets[i + 1]).
+    Edges are numbered inside their graph. Token is a matrix [n_nodes, token length],
+    label is a matrix [n_graphs, label length] or a vector [n_graphs].
+
+    :param dataset_path: path to folder with index and columns
+    :return: index of dataset and dict with memory mapped columns
+    """
+    with open(os.path.join(dataset_path, INDEX_NAME), 'r') as index_file:
+        index = json.load(index_file)
+    if index['format'] != FORMAT_NAME or index['version'] != FORMAT_VERSION:
+        raise ValueError(f"unsupported dataset format {index['format']} v{index['version']} in {dataset_path}")
+    columns = {}
+    for column, (dtype, shape) in index['columns'].items():
+        if np.prod(shape) == 0:
+            columns[column] = np.empty(shape, dtype=dtype)
+        else:
+            columns[column] = np.memmap(get_column_path(dataset_path, column), dtype=dtype, mode='r', shape=tuple(shape))
+    return index, columns
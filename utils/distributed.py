@@ -0,0 +1,76 @@
+import os
+from typing import Dict, List, Tuple
+
+import torch
+import torch.distributed as dist
+from torch import nn
+from torch.nn.parallel import DistributedDataParallel
+
+
+def is_distributed_launch() -> bool:
+    """Check that the process is started by torch.distributed launcher with more than one process"""
+    return int(os.environ.get('WORLD_SIZE', 1)) > 1
+
+
+def init_distributed(backend: str = 'gloo') -> Tuple[int, int]:
+    """Initialize the default process group from environment variables, that are set by the launcher
+    (MASTER_ADDR, MASTER_PORT, RANK, WORLD_SIZE). Processes on the same host share cores,
+    so each process uses its part of them for intra-op parallelism.
+
+    :param backend: backend of torch.distributed, gloo works on CPU
+    :return: rank of the process and number of processes
+    """
+    dist.init_process_group(backend, init_method='env://')
+    if 'LOCAL_WORLD_SIZE' in os.environ:
+        torch.set_num_threads(max(1, (os.cpu_count() or 1) // int(os.environ['LOCAL_WORLD_SIZE'])))
+    return dist.get_rank(), dist.get_world_size()
+
+
+def get_rank() -> int:
+    return dist.get_rank() if dist.is_available() and dist.is_initialized() else 0
+
+
+def get_world_size() -> int:
+    return dist.get_world_size() if dist.is_available() and dist.is_initialized() else 1
+
+
+def is_main_process() -> bool:
+    return get_rank() == 0
+
+
+def unwrap_model(model: nn.Module) -> nn.Module:
+    """Get the original model from DistributedDataParallel wrapper"""
+    return model.module if isinstance(model, DistributedDataParallel) else model
+
+
+def wrap_model(model: nn.Module, device: torch.device) -> DistributedDataParallel:
+    """Wrap model to average gradients over processes during backward pass.
+    Some parameters may get no gradient, e.g. layer norms of TreeLSTM without residual connections,
+    so the wrapper searches for them on each step instead of waiting for their gradients forever.
+    """
+    return DistributedDataParallel(
+        model, device_ids=[device] if device.type == 'cuda' else None, find_unused_parameters=True
+    )
+
+
+def shard_batch_order(order: List[int], rank: int, world_size: int) -> List[int]:
+    """Select batches of the process. The order is truncated to a multiple of world size,
+    so all processes make the same number of steps and none of them waits for gradients at the end of epoch.
+
+    :param order: order of batches in dataset, the same for all processes
+    :param rank: rank of the process
+    :param world_size: number of processes
+    :return: batches of the process, every world_size-th batch starting from rank
+    """
+    n_steps = len(order) // world_size
+    return order[rank:n_steps * world_size:world_size]
+
+
+def all_reduce_sum(values: Dict[str, float]) -> Dict[str, float]:
+    """Sum values over all processes, without initialized process group values are returned as is"""
+    if get_world_size() == 1:
+        return values
+    keys = sorted(values.keys())
+    tensor = torch.tensor([float(values[key]) for key in keys], dtype=torch.float64)
+    dist.all_reduce(tensor, op=dist.ReduceOp.SUM)
+    return dict(zip(keys, tensor.tolist()))
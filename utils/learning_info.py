@@ -1,9 +1,14 @@
 from typing import Dict
 
+from utils.distributed import all_reduce_sum
 from utils.metrics import calculate_metrics
 
 
 class LearningInfo:
+    """Accumulate loss and statistics of batches, values can be either numbers or tensors on any device,
+    tensors are read only in get_state_dict, so accumulation doesn't synchronize with the device.
+    """
+
     def __init__(self):
         self.loss = 0.0
         self.batch_processed = 0
@@ -21,12 +26,20 @@ class LearningInfo:
         for statistic in ['true_positive', 'false_positive', 'false_negative']:
             self.statistics[statistic] += batch_info['statistics'][statistic]
 
+    def all_reduce(self) -> None:
+        """Sum accumulated info over all processes of distributed training"""
+        reduced = all_reduce_sum({'loss': self.loss, 'batch_processed': self.batch_processed, **self.statistics})
+        self.loss = reduced['loss']
+        self.batch_processed = int(reduced['batch_processed'])
+        for statistic in self.statistics:
+            self.statistics[statistic] = int(reduced[statistic])
+
     def get_state_dict(self) -> Dict:
-        loss = self.loss / self.batch_processed if self.batch_processed > 0 else 0.0
+        loss = float(self.loss) / self.batch_processed if self.batch_processed > 0 else 0.0
         state_dict = {
             'loss': loss
         }
         if self.lr != 0:
             state_dict['learning_rate'] = self.lr
-        state_dict.update(calculate_metrics(self.statistics))
+        state_dict.update(calculate_metrics({key: int(value) for key, value in self.statistics.items()}))
         return state_dict
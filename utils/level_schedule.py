@@ -0,0 +1,160 @@
+from typing import Dict, Iterator, List, NamedTuple, Optional, Tuple
+
+import dgl
+import numpy
+import torch
+
+
+
+class TreeLevel(NamedTuple):
+    """Nodes of one topological level and edges from their children.
+    Nodes are sorted by number of children, edges are grouped by parents in the order of nodes,
+    so nodes with the same number of children form a bucket, and messages of the bucket
+    can be viewed as a mailbox [n nodes in bucket; n children; ...] like in DGL degree bucketing.
+    Levels follow each other in level order of the schedule, so nodes of the level take a slice of it.
+    """
+    # [n nodes in level]
+    nodes: torch.LongTensor
+    # position of the first node of the level in level order
+    start: int
+    # [n edges to level] position of source node of each edge, i.e. child, in level order
+    children: torch.LongTensor
+    # [n edges to level] position of the parent of each edge in nodes
+    edge_parents: torch.LongTensor
+    # (number of children, number of nodes) of each bucket
+    buckets: Tuple[Tuple[int, int], ...]
+
+    @property
+    def positions(self) -> slice:
+        """Slice of level nodes in level order"""
+        return slice(self.start, self.start + self.nodes.shape[0])
+
+    def to(self, device: torch.device) -> 'TreeLevel':
+        return TreeLevel(
+            self.nodes.to(device), self.start, self.children.to(device), self.edge_parents.to(device), self.buckets
+        )
+
+    def split_by_degree(
+            self, messages: Dict[str, torch.Tensor], data: Dict[str, torch.Tensor]
+    ) -> Iterator[Tuple[Dict[str, torch.Tensor], Dict[str, torch.Tensor]]]:
+        """Split messages of edges and data of nodes by buckets
+
+        :param messages: dict with tensors [n edges to level; ...]
+        :param data: dict with tensors [n nodes in level; ...]
+        :return: mailbox [n nodes in bucket; n children; ...] and data [n nodes in bucket; ...] of each bucket
+        """
+        node_start, edge_start = 0, 0
+        for degree, n_nodes in self.buckets:
+            node_end, edge_end = node_start + n_nodes, edge_start + n_nodes * degree
+            mailbox = {
+                key: value[edge_start:edge_end].view(n_nodes, degree, *value.shape[1:])
+                for key, value in messages.items()
+            }
+            yield mailbox, {key: value[node_start:node_end] for key, value in data.items()}
+            node_start, edge_start = node_end, edge_end
+
+
+class LevelSchedule(NamedTuple):
+    """Topological levels of batched graph directed from leaves to root,
+    the first level contains all leaves, each next level depends only on the previous ones.
+    Level order places nodes level by level, so inputs of the batch are split by levels at once,
+    and each level writes its slice of states instead of scattering its nodes.
+    For propagation from root to leaves it also keeps parents of nodes and their depths.
+    """
+    levels: List[TreeLevel]
+    # [n nodes] nodes in level order
+    order: torch.LongTensor
+    # [n nodes] position of each node in level order
+    positions: torch.LongTensor
+    # [n nodes] parent of each node, -1 for roots
+    parents: torch.LongTensor
+    # nodes of each depth, starting from roots, each next depth contains children of the previous one
+    depth_levels: List[torch.LongTensor]
+
+    @property
+    def leaves(self) -> torch.LongTensor:
+        return self.levels[0].nodes
+
+    @property
+    def sizes(self) -> List[int]:
+        """Number of nodes in each level, e.g. to split tensors in level order by levels"""
+        return [level.nodes.shape[0] for level in self.levels]
+
+    @property
+    def internal_levels(self) -> List[TreeLevel]:
+        """Levels of nodes with children, all of them except the first one"""
+        return self.levels[1:]
+
+    def to(self, device: torch.device) -> 'LevelSchedule':
+        return LevelSchedule(
+            [level.to(device) for level in self.levels], self.order.to(device), self.positions.to(device),
+            self.parents.to(device), [nodes.to(device) for nodes in self.depth_levels]
+        )
+
+
+def build_level_schedule(graph: dgl.DGLGraph) -> LevelSchedule:
+    """Build the schedule from the same topological frontiers as dgl.prop_nodes_topo uses
+
+    :param graph: batched graph directed from leaves to root
+    :return: level schedule on CPU
+    """
+    n_nodes = graph.number_of_nodes()
+    src, dst = (edges.cpu().numpy() for edges in graph.all_edges())
+    frontiers = [frontier.cpu().numpy() for frontier in dgl.topological_nodes_generator(graph)]
+
+    node_level = numpy.empty(n_nodes, dtype=numpy.int64)
+    for level_id, frontier in enumerate(frontiers):
+        node_level[frontier] = level_id
+    in_degree = numpy.bincount(dst, minlength=n_nodes)
+    # edges are ordered by level of parent and, inside level, by id
+    edge_order = numpy.argsort(node_level[dst], kind='stable')
+    edge_offsets = numpy.concatenate([[0], numpy.cumsum(numpy.bincount(node_level[dst], minlength=len(frontiers)))])
+
+    position = numpy.empty(n_nodes, dtype=numpy.int64)
+    # children are in the previous levels, so their positions in level order are known
+    order_position = numpy.empty(n_nodes, dtype=numpy.int64)
+    levels = []
+    start = 0
+    for level_id, frontier in enumerate(frontiers):
+        nodes = frontier[numpy.lexsort((frontier, in_degree[frontier]))]
+        position[nodes] = numpy.arange(nodes.shape[0])
+        order_position[nodes] = start + position[nodes]
+
+        edges = edge_order[edge_offsets[level_id]:edge_offsets[level_id + 1]]
+        # messages of each node are ordered by edge id, as in DGL mailbox
+        edges = edges[numpy.argsort(position[dst[edges]], kind='stable')]
+
+        degrees, counts = numpy.unique(in_degree[nodes], return_counts=True)
+        levels.append(TreeLevel(
+            torch.from_numpy(nodes), start, torch.from_numpy(order_position[src[edges]]),
+            torch.from_numpy(position[dst[edges]]), tuple(zip(degrees.tolist(), counts.tolist()))
+        ))
+        start += nodes.shape[0]
+    order = numpy.empty(n_nodes, dtype=numpy.int64)
+    order[order_position] = numpy.arange(n_nodes)
+
+    parents = numpy.full(n_nodes, -1, dtype=numpy.int64)
+    parents[src] = dst
+    # parent of each node is in one of the next levels, so depths are assigned from the last level
+    depth = numpy.zeros(n_nodes, dtype=numpy.int64)
+    for frontier in reversed(frontiers):
+        has_parent = parents[frontier] != -1
+        depth[frontier[has_parent]] = depth[parents[frontier[has_parent]]] + 1
+    depth_order = numpy.argsort(depth, kind='stable')
+    depth_offsets = numpy.cumsum(numpy.bincount(depth, minlength=1))[:-1]
+    depth_levels = [torch.from_numpy(nodes) for nodes in numpy.split(depth_order, depth_offsets)]
+    return LevelSchedule(
+        levels, torch.from_numpy(order), torch.from_numpy(order_position), torch.from_numpy(parents), depth_levels
+    )
+
+
+def get_level_schedule(
+        graph: dgl.DGLGraph, device: torch.device, schedule: Optional[LevelSchedule] = None
+) -> LevelSchedule:
+    """Get the passed schedule on the device or build it, if the batch is loaded without it.
+    Batches of TreeDGLDataset are loaded with the schedule, that is built by the loading process,
+    e.g. prefetch worker, so in training it isn't built again.
+    """
+    if schedule is None:
+        schedule = build_level_schedule(graph)
+    return schedule.to(device)
@@ -38,6 +38,36 @@ def calculate_batch_statistics(
     }
 
 
+def calculate_batch_statistics_vectorized(
+        original_tokens: torch.Tensor, predicted_tokens: torch.Tensor, skipping_tokens: List
+) -> Dict:
+    """Vectorized version of calculate_batch_statistics with the same semantics:
+    each occurrence of a subtoken is counted, so duplicates are counted several times.
+    All subtokens of the batch are compared at once, and statistics stay on the device of tensors,
+    so there is no synchronization until they are read.
+
+    :param skipping_tokens: list of tokens, which will be skipped
+    :param original_tokens: tensor with original subtokens [batch size, original len]
+    :param predicted_tokens: tensor with predicted subtokens [batch size, predicted len]
+    :return: statistic for given tensors, each one is a 0-dim tensor
+    """
+    skipping_tokens = original_tokens.new_tensor(skipping_tokens)
+    # [batch size, predicted len, original len]
+    is_equal = predicted_tokens.unsqueeze(2) == original_tokens.unsqueeze(1)
+    # [batch size, predicted len]
+    is_predicted_in_original = is_equal.any(dim=2)
+    is_predicted_counted = ~(predicted_tokens.unsqueeze(-1) == skipping_tokens).any(dim=-1)
+    # [batch size, original len]
+    is_original_in_predicted = is_equal.any(dim=1)
+    is_original_counted = ~(original_tokens.unsqueeze(-1) == skipping_tokens).any(dim=-1)
+
+    return {
+        'true_positive': (is_predicted_counted & is_predicted_in_original).sum(),
+        'false_positive': (is_predicted_counted & ~is_predicted_in_original).sum(),
+        'false_negative': (is_original_counted & ~is_original_in_predicted).sum()
+    }
+
+
 def calculate_metrics(statistics: Dict) -> Dict:
     """Calculate precision, recall, and f1 based on a TP, FP, FN
 
@@ -0,0 +1,132 @@
+import os
+import resource
+from collections import defaultdict
+from contextlib import contextmanager, nullcontext
+from time import perf_counter
+from typing import ContextManager, Dict, Iterator, Optional
+
+import dgl
+import torch
+from torch import nn
+
+from utils.distributed import unwrap_model
+
+# stages of the model, that are timed by forward hooks
+MODEL_STAGES = ['embedding', 'encoder', 'decoder']
+
+
+class TrainingProfiler:
+    """Opt-in instrumentation of training steps.
+    It accumulates wall-clock time of each stage (data loading, embedding, encoder, decoder, loss, backward,
+    optimizer), number of nodes, edges and trees in batches, and reports them with throughput
+    and peak memory on get_state_dict. On CUDA the device is synchronized around each stage,
+    so times correspond to stages, but training becomes a bit slower.
+    Optionally, steps [trace_start, trace_start + trace_steps) of the first epoch are recorded
+    by autograd profiler and exported to trace_path in Chrome trace format (chrome://tracing).
+
+    :param trace_path: path to the trace file
+    :param trace_start: the first traced step, -1 to disable tracing
+    :param trace_steps: number of traced steps
+    """
+
+    def __init__(self, trace_path: str = None, trace_start: int = -1, trace_steps: int = 0):
+        self.trace_path = trace_path
+        self.trace_start = trace_start
+        self.trace_steps = trace_steps
+        self._is_cuda = torch.cuda.is_available()
+        self._trace: Optional[torch.autograd.profiler.profile] = None
+        self._is_traced = False
+        self._stage_starts = {}
+        self._hooks = []
+        self._reset()
+
+    def _reset(self) -> None:
+        self._times = defaultdict(float)
+        self._counts = defaultdict(int)
+        self._window_start = perf_counter()
+        if self._is_cuda:
+            torch.cuda.reset_max_memory_allocated()
+
+    def _synchronize(self) -> None:
+        if self._is_cuda:
+            torch.cuda.synchronize()
+
+    def start(self, stage: str) -> None:
+        self._synchronize()
+        self._stage_starts[stage] = perf_counter()
+
+    def stop(self, stage: str) -> None:
+        self._synchronize()
+        self._times[stage] += perf_counter() - self._stage_starts.pop(stage)
+
+    @contextmanager
+    def stage(self, name: str) -> Iterator[None]:
+        self.start(name)
+        try:
+            yield
+        finally:
+            self.stop(name)
+
+    def attach(self, model: nn.Module) -> None:
+        """Time embedding, encoder and decoder of Tree2Seq model with forward hooks,
+        so the model is called as usual, e.g. inside DistributedDataParallel
+        """
+        model = unwrap_model(model)
+        for name in MODEL_STAGES:
+            module = getattr(model, name)
+            # evaluation calls the same modules, it shouldn't be counted as training time
+            self._hooks.append(module.register_forward_pre_hook(
+                lambda module, _, stage=name: self.start(stage) if module.training else None
+            ))
+            self._hooks.append(module.register_forward_hook(
+                lambda module, *_, stage=name: self.stop(stage) if module.training else None
+            ))
+
+    def detach(self) -> None:
+        for hook in self._hooks:
+            hook.remove()
+        self._hooks = []
+
+    def add_batch(self, graph: dgl.DGLGraph) -> None:
+        self._counts['steps'] += 1
+        self._counts['nodes'] += graph.number_of_nodes()
+        self._counts['edges'] += graph.number_of_edges()
+        self._counts['trees'] += graph.batch_size
+
+    def on_step_begin(self, step: int) -> None:
+        if self._is_traced or self.trace_path is None or self.trace_start == -1 or step != self.trace_start:
+            return
+        self._is_traced = True
+        self._trace = torch.autograd.profiler.profile(use_cuda=self._is_cuda)
+        self._trace.__enter__()
+
+    def on_step_end(self, step: int) -> None:
+        if self._trace is not None and step + 1 >= self.trace_start + self.trace_steps:
+            self._trace.__exit__(None, None, None)
+            os.makedirs(os.path.dirname(self.trace_path) or '.', exist_ok=True)
+            self._trace.export_chrome_trace(self.trace_path)
+            print(f"trace of steps {self.trace_start}-{step} is saved to {self.trace_path}")
+            self._trace = None
+
+    def get_state_dict(self) -> Dict[str, float]:
+        """Report statistics accumulated since the previous call and start a new window"""
+        window_time = perf_counter() - self._window_start
+        state_dict = {f'time/{stage}': stage_time for stage, stage_time in sorted(self._times.items())}
+        state_dict['time/total'] = window_time
+        n_steps = max(1, self._counts['steps'])
+        for counter in ['nodes', 'edges', 'trees']:
+            state_dict[f'batch_{counter}'] = self._counts[counter] / n_steps
+        state_dict['nodes_per_sec'] = self._counts['nodes'] / window_time
+        state_dict['trees_per_sec'] = self._counts['trees'] / window_time
+        if self._is_cuda:
+            state_dict['peak_memory_mb'] = torch.cuda.max_memory_allocated() / 1024 ** 2
+        else:
+            # maximum resident set size of the process, in kilobytes on Linux
+            state_dict['peak_memory_mb'] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+        self._reset()
+        return state_dict
+
+
+def profile_stage(profiler: Optional[TrainingProfiler], name: str) -> ContextManager:
+    """Time the stage if profiler is passed, otherwise do nothing"""
+    return nullcontext() if profiler is None else profiler.stage(name)
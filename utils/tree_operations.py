@@ -1,8 +1,18 @@
-from typing import List
+import json
+import os
+from typing import List, Dict, Optional
 
 import dgl
 import numpy
 
+TREE_STATISTICS_NAME = 'statistics.npz'
+TREE_STATISTICS = ['n_nodes', 'depth', 'max_degree', 'n_leaves']
+
+# direction of edges in stored trees, encoders propagate states from leaves to root
+TREE_ORIENTATION_NAME = 'orientation.json'
+ROOT_TO_LEAVES = 'root_to_leaves'
+LEAVES_TO_ROOT = 'leaves_to_root'
+
 
 def get_root_indexes(tree_sizes: List[int]) -> numpy.ndarray:
     """Get indexes of roots in given graph
@@ -16,3 +26,88 @@ def get_root_indexes(tree_sizes: List[int]) -> numpy.ndarray:
 
 def get_tree_depth(tree: dgl.DGLGraph) -> int:
     return len(dgl.topological_nodes_generator(tree))
+
+
+def get_trees_statistics(
+        n_nodes: numpy.ndarray, n_edges: numpy.ndarray, src: numpy.ndarray, dst: numpy.ndarray,
+        orientation: str = ROOT_TO_LEAVES
+) -> Dict[str, numpy.ndarray]:
+    """Calculate statistics of trees, that are described by flat arrays:
+    nodes and edges of trees go one after another, edges are numbered inside their tree and directed
+    from parent to child or, for LEAVES_TO_ROOT orientation, from child to parent.
+    Depth of each node is found by pointer jumping, so it takes logarithmic number of vectorized steps.
+
+    :return: dict with number of nodes, depth (number of levels), max number of children, and number of leaves
+    of each tree
+    """
+    if orientation == LEAVES_TO_ROOT:
+        src, dst = dst, src
+    n_nodes = numpy.asarray(n_nodes, dtype=numpy.int64)
+    node_offsets = numpy.cumsum(n_nodes) - n_nodes
+    edge_offsets = numpy.repeat(node_offsets, n_edges)
+    src = numpy.asarray(src, dtype=numpy.int64) + edge_offsets
+    dst = numpy.asarray(dst, dtype=numpy.int64) + edge_offsets
+
+    ancestor = numpy.full(n_nodes.sum(), -1, dtype=numpy.int64)
+    ancestor[dst] = src
+    distance = (ancestor != -1).astype(numpy.int64)
+    is_jumping = ancestor != -1
+    while is_jumping.any():
+        jumping_ancestor = ancestor[is_jumping]
+        distance[is_jumping] += distance[jumping_ancestor]
+        ancestor[is_jumping] = ancestor[jumping_ancestor]
+        is_jumping = ancestor != -1
+
+    out_degree = numpy.bincount(src, minlength=ancestor.shape[0])
+    return {
+        'n_nodes': n_nodes,
+        'depth': numpy.maximum.reduceat(distance, node_offsets) + 1,
+        'max_degree': numpy.maximum.reduceat(out_degree, node_offsets),
+        'n_leaves': numpy.add.reduceat(out_degree == 0, node_offsets)
+    }
+
+
+def get_graphs_statistics(graphs: List[dgl.DGLGraph], orientation: str = ROOT_TO_LEAVES) -> Dict[str, numpy.ndarray]:
+    edges = [graph.all_edges(order='eid') for graph in graphs]
+    return get_trees_statistics(
+        numpy.array([graph.number_of_nodes() for graph in graphs]),
+        numpy.array([src.shape[0] for src, _ in edges]),
+        numpy.concatenate([src.numpy() for src, _ in edges]),
+        numpy.concatenate([dst.numpy() for _, dst in edges]),
+        orientation
+    )
+
+
+def concatenate_statistics(statistics: List[Dict[str, numpy.ndarray]]) -> Dict[str, numpy.ndarray]:
+    return {
+        name: numpy.concatenate([part[name] for part in statistics]).astype(numpy.int32) for name in TREE_STATISTICS
+    }
+
+
+def save_trees_statistics(dataset_path: str, statistics: Dict[str, numpy.ndarray]) -> None:
+    numpy.savez(os.path.join(dataset_path, TREE_STATISTICS_NAME), **statistics)
+
+
+def load_trees_statistics(dataset_path: str) -> Optional[Dict[str, numpy.ndarray]]:
+    """Load statistics of trees from the dataset folder, if they were calculated before"""
+    statistics_path = os.path.join(dataset_path, TREE_STATISTICS_NAME)
+    if not os.path.exists(statistics_path):
+        return None
+    with numpy.load(statistics_path) as statistics:
+        return {name: statistics[name] for name in TREE_STATISTICS}
+
+
+def save_trees_orientation(dataset_path: str, orientation: str) -> None:
+    if orientation not in [ROOT_TO_LEAVES, LEAVES_TO_ROOT]:
+        raise ValueError(f"unknown orientation of trees {orientation}")
+    with open(os.path.join(dataset_path, TREE_ORIENTATION_NAME), 'w') as orientation_file:
+        json.dump({'orientation': orientation}, orientation_file)
+
+
+def load_trees_orientation(dataset_path: str) -> str:
+    """Load orientation of trees in the dataset folder, datasets without it store trees from root to leaves"""
+    orientation_path = os.path.join(dataset_path, TREE_ORIENTATION_NAME)
+    if not os.path.exists(orientation_path):
+        return ROOT_TO_LEAVES
+    with open(orientation_path, 'r') as orientation_file:
+        return json.load(orientation_file)['orientation']